@@ -0,0 +1,85 @@
+# In admission.py
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+from structured_logging import get_logger
+
+log = get_logger("admission")
+
+CAPACITY_RETRY_INTERVAL = 5.0  # seconds between host capacity re-checks while blocked
+
+class AdmissionController:
+    """
+    Bounded, first-come-first-served admission for container creation.
+
+    Users are queued at most once; the head of the queue is admitted when a
+    creation slot is free and has_capacity(in_flight) (blocking, run in the
+    executor) says the host can take another container.
+    """
+    def __init__(self, max_concurrent: int, has_capacity: Callable[[int], bool]):
+        self.max_concurrent = max_concurrent
+        self.has_capacity = has_capacity
+        self.queue: Deque[str] = deque()
+        self.active: Dict[str, float] = {}  # user_id -> admitted at
+        self._admitted: Dict[str, asyncio.Future] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.avg_duration = 10.0  # EWMA of creation time, seconds
+
+    def enqueue(self, user_id: str) -> None:
+        """Queue a creation for user_id (no-op if it is already queued or running)"""
+        if user_id in self._admitted:
+            return
+        self._admitted[user_id] = asyncio.get_running_loop().create_future()
+        self.queue.append(user_id)
+        self._kick()
+
+    async def wait_admitted(self, user_id: str) -> None:
+        await asyncio.shield(self._admitted[user_id])
+
+    def release(self, user_id: str) -> None:
+        """Free user_id's slot (or queue entry) and admit whoever is next"""
+        started = self.active.pop(user_id, None)
+        if started is not None:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+        else:
+            try:
+                self.queue.remove(user_id)
+            except ValueError:
+                pass
+        future = self._admitted.pop(user_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+        self._kick()
+
+    def status(self, user_id: str) -> Optional[Dict]:
+        """Queue position (0 once admitted) and a rough ETA until admission, in seconds"""
+        if user_id in self.active:
+            return {"position": 0, "eta_seconds": 0}
+        try:
+            position = self.queue.index(user_id) + 1
+        except ValueError:
+            return None
+        waves = (position - 1) // self.max_concurrent + 1
+        return {"position": position, "eta_seconds": round(waves * self.avg_duration, 1)}
+
+    def _kick(self) -> None:
+        if self.queue and (self._dispatcher is None or self._dispatcher.done()):
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.queue and len(self.active) < self.max_concurrent:
+            try:
+                fits = await loop.run_in_executor(None, self.has_capacity, len(self.active))
+            except Exception as e:
+                log.warning("admission.capacity_check_failed", error=str(e))
+                fits = True
+            if not fits:
+                await asyncio.sleep(CAPACITY_RETRY_INTERVAL)
+                continue
+            if not self.queue:
+                break
+            user_id = self.queue.popleft()
+            self.active[user_id] = time.monotonic()
+            self._admitted[user_id].set_result(None)
@@ -0,0 +1,124 @@
+# In bench/asgi_client.py
+import asyncio
+import json
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+# Minimal ASGI driver: calls the app directly on the current event loop, so
+# the benchmark measures the app rather than an HTTP stack or a test
+# client's worker thread.
+
+def _scope(kind: str, url: str) -> dict:
+    parts = urlsplit(url)
+    return {
+        "type": kind,
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "scheme": "ws" if kind == "websocket" else "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+        "subprotocols": [],
+    }
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, url: str, body: Optional[dict] = None) -> Tuple[int, object]:
+        """Send one HTTP request; returns (status, decoded JSON body or raw bytes)"""
+        scope = dict(_scope("http", url), method=method)
+        payload = json.dumps(body).encode() if body is not None else b""
+        sent = False
+        finished = asyncio.Event()
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            # Only report the disconnect once the response is out, like a patient client
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        raw = b"".join(chunks)
+        try:
+            return status, json.loads(raw)
+        except ValueError:
+            return status, raw
+
+    def websocket(self, url: str) -> "WebSocketSession":
+        return WebSocketSession(self.app, _scope("websocket", url))
+
+class WebSocketClosed(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"WebSocket closed with code {code}")
+        self.code = code
+
+class WebSocketSession:
+    """async with client.websocket(url) as ws: await ws.send_text(...); await ws.receive()"""
+    def __init__(self, app, scope: dict):
+        self.app = app
+        self.scope = scope
+        self.to_app: asyncio.Queue = asyncio.Queue()
+        self.from_app: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "WebSocketSession":
+        self.task = asyncio.create_task(self.app(self.scope, self.to_app.get, self.from_app.put))
+        await self.to_app.put({"type": "websocket.connect"})
+        message = await self._next()
+        if message["type"] == "websocket.close":
+            raise WebSocketClosed(message.get("code", 1000))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, timeout=5)
+        except (asyncio.TimeoutError, Exception):
+            self.task.cancel()
+
+    async def _next(self) -> dict:
+        getter = asyncio.ensure_future(self.from_app.get())
+        done, _ = await asyncio.wait({getter, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            return getter.result()
+        getter.cancel()
+        if self.task.exception() is not None:
+            raise self.task.exception()
+        return {"type": "websocket.close", "code": 1006}
+
+    async def send_text(self, text: str) -> None:
+        await self.to_app.put({"type": "websocket.receive", "text": text})
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.to_app.put({"type": "websocket.receive", "bytes": data})
+
+    async def receive(self) -> bytes:
+        """Next data frame from the app (text is returned encoded)"""
+        message = await self._next()
+        if message["type"] == "websocket.close":
+            raise WebSocketClosed(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return message["bytes"]
+        return (message.get("text") or "").encode()
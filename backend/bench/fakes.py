@@ -0,0 +1,752 @@
+# In bench/fakes.py
+import itertools
+import queue
+import shlex
+import socket
+import tarfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from docker.errors import NotFound
+from file_tree import ROW_FIELDS, build_tree
+from search import fuzzy_ranges
+
+# Stand-ins for the Docker daemon and NeonDB so the app can run in-process
+# under load. They implement only what the backend calls, with latencies
+# that can be dialled in to resemble a real host.
+
+ExecResult = namedtuple("ExecResult", ["exit_code", "output"])
+
+PROMPT = b"[root@bench workspace]$ "
+FILLER_LINE = b"." * 79 + b"\n"  # streamed output never contains keystroke letters
+
+class FakeShell(threading.Thread):
+    """
+    The far end of an exec socket: echoes input like a tty, answers each line
+    with a prompt, and optionally streams filler output at output_rate bytes/s.
+    """
+    def __init__(self, sock: socket.socket, output_rate: int = 0):
+        super().__init__(name="fake-shell", daemon=True)
+        self.sock = sock
+        self.output_rate = output_rate
+        self._send_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _send(self, data: bytes) -> None:
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def run(self):
+        if self.output_rate:
+            threading.Thread(target=self._stream, name="fake-shell-output", daemon=True).start()
+        try:
+            self._send(PROMPT)
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                echo = data.replace(b"\r", b"\r\n")
+                if b"\r" in data or b"\n" in data:
+                    echo += PROMPT
+                self._send(echo)
+        except OSError:
+            pass
+        finally:
+            self.stop()
+
+    def _stream(self):
+        # Lines are sent in ~20ms batches to keep the rate smooth without a syscall per line
+        per_batch = max(1, int(self.output_rate * 0.02) // len(FILLER_LINE))
+        interval = per_batch * len(FILLER_LINE) / self.output_rate
+        batch = FILLER_LINE * per_batch
+        while not self._done.wait(interval):
+            try:
+                self._send(batch)
+            except OSError:
+                break
+
+    def stop(self):
+        self._done.set()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class FakeExecSocket:
+    """What APIClient.exec_start(socket=True) returns: the raw socket is at ._sock"""
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+
+    def close(self):
+        self._sock.close()
+
+class FakeImage:
+    def __init__(self, tags: List[str], labels: Dict[str, str], layers: int, files: Dict[str, bytes]):
+        self.id = "sha256:" + uuid.uuid4().hex
+        self.tags = tags
+        self.labels = labels
+        self.files = files
+        self.attrs = {
+            "Created": datetime.now(timezone.utc).isoformat(),
+            "Size": sum(map(len, files.values())),
+            "RootFS": {"Layers": [f"layer-{i}" for i in range(layers)]},
+        }
+
+class FakeContainer:
+    def __init__(self, daemon: "FakeDockerClient", name: str, labels: Dict[str, str], image: FakeImage):
+        self.daemon = daemon
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.image = image
+        self.labels = {**image.labels, **labels}
+        self.status = "created"
+        self.files: Dict[str, bytes] = dict(image.files)
+        self.cpu_quota = 50000
+        self.mem_limit = 1024 ** 3
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def attrs(self):
+        return {
+            "State": {"Running": self.status == "running"},
+            "HostConfig": {"CpuQuota": self.cpu_quota, "Memory": self.mem_limit},
+        }
+
+    def reload(self):
+        pass
+
+    def start(self):
+        if self.status == "running":
+            return
+        self.status = "starting"
+        threading.Timer(self.daemon.start_latency, self._started).start()
+
+    def _started(self):
+        if self.status == "starting":
+            self.status = "running"
+            self.daemon.emit(self.id, "start")
+
+    def stop(self):
+        self.status = "exited"
+        self.daemon.emit(self.id, "die")
+
+    def remove(self, force: bool = False):
+        self.daemon.remove(self.id)
+        self.status = "removed"
+        self.daemon.emit(self.id, "destroy")
+
+    def logs(self):
+        return b""
+
+    def commit(self, repository: str, tag: str, changes=(), **kwargs) -> FakeImage:
+        """Snapshot the files; only LABEL changes are understood"""
+        labels = dict(self.labels)
+        for change in changes:
+            if change.startswith("LABEL "):
+                labels.update(item.split("=", 1) for item in shlex.split(change[6:]))
+        with self._lock:
+            files = dict(self.files)
+        return self.daemon.images.add(FakeImage([f"{repository}:{tag}"], labels,
+                                                len(self.image.attrs["RootFS"]["Layers"]) + 1, files))
+
+    def update(self, cpu_quota: Optional[int] = None, mem_limit: Optional[int] = None, **kwargs) -> dict:
+        if cpu_quota is not None:
+            self.cpu_quota = cpu_quota
+        if mem_limit is not None:
+            self.mem_limit = mem_limit
+        return {"Warnings": []}
+
+    def exec_run(self, cmd, **kwargs) -> ExecResult:
+        time.sleep(self.daemon.exec_latency)
+        if isinstance(cmd, list) and cmd and cmd[0] == "find":
+            with self._lock:
+                paths = sorted(self.files)
+            listing = "".join(f"f\t{time.time():.6f}\t{len(self.files.get(p, b''))}\t{p}\n" for p in paths)
+            return ExecResult(0, listing.encode())
+        return ExecResult(0, b"")
+
+    def put_archive(self, path: str, data) -> bool:
+        time.sleep(self.daemon.exec_latency)
+        base = path.rstrip("/").split("/workspace", 1)[-1].lstrip("/")
+        with tarfile.open(fileobj=data, mode="r|") as tar:
+            for member in tar:
+                if member.isfile():
+                    name = f"{base}/{member.name}" if base else member.name
+                    with self._lock:
+                        self.files[name.lstrip("/")] = tar.extractfile(member).read()
+        return True
+
+    def get_archive(self, path: str):
+        name = path.split("/workspace/", 1)[-1]
+        with self._lock:
+            content = self.files.get(name)
+        if content is None:
+            raise NotFound(f"No such file: {path}")
+        out = BytesIO()
+        with tarfile.TarFile(fileobj=out, mode="w") as tar:
+            info = tarfile.TarInfo(name=name.rsplit("/", 1)[-1])
+            info.size = len(content)
+            tar.addfile(info, BytesIO(content))
+        return iter([out.getvalue()]), {"name": name, "size": len(content)}
+
+class FakeEventStream:
+    """Iterator over container events; close() ends it like the real HTTP stream"""
+    _CLOSED = object()
+
+    def __init__(self, backlog: List[dict], container_id: Optional[str]):
+        self.container_id = container_id
+        self.closed = False
+        self.queue = queue.SimpleQueue()
+        for event in backlog:
+            self.queue.put(event)
+
+    def wants(self, event: dict) -> bool:
+        return self.container_id is None or event["id"] == self.container_id
+
+    def __iter__(self):
+        while True:
+            event = self.queue.get()
+            if event is self._CLOSED:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+        self.queue.put(self._CLOSED)
+
+class _Containers:
+    def __init__(self, daemon: "FakeDockerClient"):
+        self.daemon = daemon
+
+    def list(self, filters: Optional[dict] = None, **kwargs) -> List[FakeContainer]:
+        include_stopped = kwargs.get("all", False)
+        filters = filters or {}
+        labels = dict(label.split("=", 1) for label in filters.get("label", []))
+        status = filters.get("status")
+        with self.daemon.lock:
+            containers = list(self.daemon.containers_by_id.values())
+        return [
+            c for c in containers
+            if all(c.labels.get(k) == v for k, v in labels.items())
+            and (status is None or c.status == status)
+            and (include_stopped or status is not None or c.status == "running")
+        ]
+
+    def get(self, container_id: str) -> FakeContainer:
+        with self.daemon.lock:
+            container = self.daemon.containers_by_id.get(container_id)
+        if container is None:
+            raise NotFound(f"No such container: {container_id}")
+        return container
+
+    def run(self, image: str, command=None, labels: Optional[dict] = None, name: Optional[str] = None,
+            **kwargs) -> FakeContainer:
+        time.sleep(self.daemon.create_latency)
+        container = FakeContainer(self.daemon, name or uuid.uuid4().hex[:12], labels or {},
+                                  self.daemon.images.get(image))
+        with self.daemon.lock:
+            self.daemon.containers_by_id[container.id] = container
+        container.start()
+        return container
+
+class _Volumes:
+    def __init__(self):
+        self.names = set()
+        self.lock = threading.Lock()
+
+    def get(self, name: str):
+        with self.lock:
+            if name not in self.names:
+                raise NotFound(f"No such volume: {name}")
+        return name
+
+    def create(self, name: str, labels: Optional[dict] = None):
+        with self.lock:
+            self.names.add(name)
+        return name
+
+class _Images:
+    def __init__(self, base_image: str):
+        self.by_id: Dict[str, FakeImage] = {}
+        self.lock = threading.Lock()
+        self.add(FakeImage([base_image], {}, 5, {}))
+
+    def add(self, image: FakeImage) -> FakeImage:
+        with self.lock:
+            for other in self.by_id.values():
+                other.tags = [t for t in other.tags if t not in image.tags]
+            self.by_id[image.id] = image
+        return image
+
+    def _find(self, ref: str) -> Optional[FakeImage]:
+        with self.lock:
+            return next((i for i in self.by_id.values() if ref == i.id or ref in i.tags), None)
+
+    def get(self, ref: str) -> FakeImage:
+        image = self._find(ref)
+        if image is None:
+            raise NotFound(f"No such image: {ref}")
+        return image
+
+    def list(self, filters: Optional[dict] = None) -> List[FakeImage]:
+        key, _, value = (filters or {}).get("label", "").partition("=")
+        with self.lock:
+            images = list(self.by_id.values())
+        return [i for i in images if not key or i.labels.get(key) == value]
+
+    def remove(self, image: str, force: bool = False) -> None:
+        found = self._find(image)
+        if found is None:
+            raise NotFound(f"No such image: {image}")
+        with self.lock:
+            if image in found.tags and len(found.tags) > 1:
+                found.tags.remove(image)
+            else:
+                self.by_id.pop(found.id, None)
+
+class _API:
+    """The subset of the low-level APIClient used for interactive shells"""
+    def __init__(self, daemon: "FakeDockerClient"):
+        self.daemon = daemon
+        self.execs: Dict[str, FakeShell] = {}
+        self._pending: Dict[str, str] = {}
+        self._ids = itertools.count(1)
+
+    def exec_create(self, container_id: str, cmd, **kwargs) -> dict:
+        self.daemon.containers.get(container_id)
+        exec_id = f"exec-{next(self._ids)}"
+        self._pending[exec_id] = container_id
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id: str, socket: bool = False, tty: bool = False) -> FakeExecSocket:
+        time.sleep(self.daemon.exec_latency)
+        self._pending.pop(exec_id)
+        app_end, shell_end = _socketpair()  # the `socket` argument shadows the module here
+        shell = FakeShell(shell_end, self.daemon.output_rate)
+        self.execs[exec_id] = shell
+        shell.start()
+        return FakeExecSocket(app_end)
+
+    def exec_resize(self, exec_id: str, height: int, width: int) -> None:
+        pass
+
+    def kill(self, exec_id: str) -> None:
+        shell = self.execs.pop(exec_id, None)
+        if shell is not None:
+            shell.stop()
+
+    def stats(self, container_id: str, stream: bool = True, one_shot: Optional[bool] = None) -> dict:
+        """A one-shot stats document; each container burns a quarter CPU and holds 100 MiB"""
+        container = self.daemon.containers.get(container_id)
+        elapsed = time.time() - container.created_at
+        return {
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": int(elapsed * 0.25e9)},
+                "system_cpu_usage": int(time.time() * 1e9) * self.daemon.cpus,
+                "online_cpus": self.daemon.cpus,
+            },
+            "memory_stats": {"usage": 100 * 1024 ** 2, "limit": container.mem_limit, "stats": {"inactive_file": 0}},
+            "blkio_stats": {"io_service_bytes_recursive": [{"op": "write", "value": sum(map(len, list(container.files.values())))}]},
+            "networks": {"eth0": {"rx_bytes": 0, "tx_bytes": 0}},
+        }
+
+def _socketpair():
+    return socket.socketpair()
+
+class FakeDockerClient:
+    """
+    In-process Docker daemon. Latencies are in seconds; output_rate is the
+    filler output each shell streams, in bytes per second (0 for none).
+    """
+    def __init__(self, create_latency: float = 0.5, start_latency: float = 0.3,
+                 exec_latency: float = 0.005, output_rate: int = 0,
+                 mem_total: int = 64 * 1024 ** 3, cpus: int = 16,
+                 base_image: str = "ehcaw/lsclear:latest"):
+        self.create_latency = create_latency
+        self.start_latency = start_latency
+        self.exec_latency = exec_latency
+        self.output_rate = output_rate
+        self.mem_total = mem_total
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.containers_by_id: Dict[str, FakeContainer] = {}
+        self.containers = _Containers(self)
+        self.volumes = _Volumes()
+        self.images = _Images(base_image)
+        self.api = _API(self)
+        self._events: List[dict] = []
+        self._streams: List[FakeEventStream] = []
+
+    def info(self) -> dict:
+        return {"MemTotal": self.mem_total, "NCPU": self.cpus}
+
+    def remove(self, container_id: str) -> None:
+        with self.lock:
+            self.containers_by_id.pop(container_id, None)
+
+    def emit(self, container_id: str, action: str) -> None:
+        event = {"id": container_id, "Action": action, "time": int(time.time())}
+        with self.lock:
+            self._events.append(event)
+            self._streams = [s for s in self._streams if not s.closed]
+            streams = [s for s in self._streams if s.wants(event)]
+        for stream in streams:
+            stream.queue.put(event)
+
+    def events(self, decode: bool = True, since: Optional[int] = None, filters: Optional[dict] = None):
+        container_id = (filters or {}).get("container")
+        with self.lock:
+            backlog = [
+                e for e in self._events
+                if (since is None or e["time"] >= since) and (container_id is None or e["id"] == container_id)
+            ]
+            stream = FakeEventStream(backlog, container_id)
+            self._streams.append(stream)
+        return stream
+
+class InMemoryNeonDB:
+    """
+    Drop-in for postgres.NeonDB backed by process-wide dicts, so every
+    instance the app creates sees the same data. Each public method sleeps
+    query_latency once to stand in for a network round trip.
+    """
+    query_latency = 0.0
+
+    _lock = threading.RLock()
+    _nodes: Dict[int, dict] = {}
+    _ids = itertools.count(1)
+    _revisions: Dict[str, int] = {}
+    _changes: Dict[str, List[tuple]] = {}  # user_id -> [(revision, node_id, op)]
+
+    def __init__(self, dsn: Optional[str] = None, replica_dsns=None):
+        self.conn = None
+        self.connect()
+
+    def _round_trip(self):
+        if self.query_latency:
+            time.sleep(self.query_latency)
+
+    def connect(self):
+        self.conn = True
+
+    def close(self) -> None:
+        pass
+
+    def ensure_connection(self) -> None:
+        pass
+
+    def read_route(self, user_id: str) -> str:
+        return "primary"
+
+    def ensure_change_log_schema(self) -> None:
+        pass
+
+    def _record_change(self, user_id: str, node_id: int, op: str) -> int:
+        revision = self._revisions.get(user_id, 0) + 1
+        self._revisions[user_id] = revision
+        self._changes.setdefault(user_id, []).append((revision, node_id, op))
+        return revision
+
+    def get_tree_revision(self, user_id: str) -> int:
+        self._round_trip()
+        return self._revisions.get(user_id, 0)
+
+    def get_changes_since(self, user_id: str, revision: int) -> Optional[Dict]:
+        self._round_trip()
+        with self._lock:
+            current = self._revisions.get(user_id, 0)
+            if revision > current:
+                return None
+            latest = {}
+            for rev, node_id, op in self._changes.get(user_id, []):
+                if rev > revision:
+                    latest[node_id] = (rev, op)
+            changes = []
+            for node_id, (_, op) in sorted(latest.items(), key=lambda item: item[1][0]):
+                node = self._nodes.get(node_id)
+                if op == "d" or node is None:
+                    changes.append({"op": "delete", "id": node_id})
+                else:
+                    changes.append(dict(self._public(node), op="upsert"))
+            return {"revision": current, "changes": changes}
+
+    def _public(self, node: dict) -> dict:
+        public = {k: v for k, v in node.items() if k != "user_id"}
+        public["created_at"] = node["created_at"].isoformat()
+        public["updated_at"] = node["updated_at"].isoformat()
+        return public
+
+    def _children(self, user_id: str, parent_id: Optional[int]) -> List[dict]:
+        return [n for n in self._nodes.values() if n["user_id"] == user_id and n["parent_id"] == parent_id]
+
+    def get_tree_rows(self, user_id: str, parent_id: int = None) -> List[tuple]:
+        self._round_trip()
+        with self._lock:
+            if parent_id is None:
+                nodes = [n for n in self._nodes.values() if n["user_id"] == user_id]
+            else:
+                nodes = self._children(user_id, parent_id)
+                for node in nodes:
+                    nodes.extend(self._children(user_id, node["id"]))
+            nodes.sort(key=lambda n: (not n["is_dir"], n["name"]))
+            return [tuple(n[field] for field in ROW_FIELDS) for n in nodes]
+
+    def get_user_file_structure(self, user_id: str, parent_id: int = None) -> List[Dict]:
+        return build_tree(self.get_tree_rows(user_id, parent_id), parent_id)
+
+    def _paths(self, user_id: str) -> Dict[int, str]:
+        by_parent: Dict[Optional[int], List[dict]] = {}
+        for node in self._nodes.values():
+            if node["user_id"] == user_id:
+                by_parent.setdefault(node["parent_id"], []).append(node)
+        paths = {}
+        pending = [(n, n["name"]) for n in by_parent.get(None, [])]
+        while pending:
+            node, path = pending.pop()
+            paths[node["id"]] = path
+            pending.extend((c, f"{path}/{c['name']}") for c in by_parent.get(node["id"], []))
+        return paths
+
+    def get_node_paths(self, user_id: str) -> Dict[str, Dict]:
+        self._round_trip()
+        with self._lock:
+            return {
+                path: {"id": node_id, "is_dir": self._nodes[node_id]["is_dir"],
+                       "updated_at": self._nodes[node_id]["updated_at"]}
+                for node_id, path in self._paths(user_id).items()
+            }
+
+    def search_file_names(self, user_id: str, query: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        self._round_trip()
+        with self._lock:
+            paths = self._paths(user_id)
+            hits = [
+                n for n in self._nodes.values()
+                if n["user_id"] == user_id and not n["is_dir"] and fuzzy_ranges(n["name"], query)
+            ]
+            # Contiguous matches first, standing in for trigram similarity
+            hits.sort(key=lambda n: (query.lower() not in n["name"].lower(), len(n["name"]), n["id"]))
+            return [{"id": n["id"], "name": n["name"], "path": paths[n["id"]]} for n in hits[offset:offset + limit]]
+
+    def search_file_contents(self, user_id: str, query: str, limit: int = 20, offset: int = 0,
+                             case_sensitive: bool = False) -> List[Dict]:
+        self._round_trip()
+        needle = query if case_sensitive else query.lower()
+        with self._lock:
+            paths = self._paths(user_id)
+            hits = [
+                n for n in self._nodes.values()
+                if n["user_id"] == user_id and not n["is_dir"] and n["content"]
+                and needle in (n["content"] if case_sensitive else n["content"].lower())
+            ]
+            hits.sort(key=lambda n: (n["parent_id"] or 0, n["name"], n["id"]))
+            return [
+                {"id": n["id"], "path": paths[n["id"]], "content": n["content"]}
+                for n in hits[offset:offset + limit]
+            ]
+
+    def find_child_id(self, user_id: str, parent_id: Optional[int], name: str) -> Optional[int]:
+        self._round_trip()
+        with self._lock:
+            for node in self._children(user_id, parent_id):
+                if node["name"] == name:
+                    return node["id"]
+            return None
+
+    def resolve_path(self, user_id: str, path: str) -> Optional[int]:
+        node_id = None
+        for part in path.split("/"):
+            node_id = self.find_child_id(user_id, node_id, part)
+            if node_id is None:
+                return None
+        return node_id
+
+    def get_node_path(self, user_id: str, node_id: int) -> Optional[str]:
+        self._round_trip()
+        with self._lock:
+            parts = []
+            node = self._nodes.get(node_id)
+            if node is None or node["user_id"] != user_id:
+                return None
+            while node is not None:
+                parts.append(node["name"])
+                node = self._nodes.get(node["parent_id"]) if node["parent_id"] is not None else None
+            return "/".join(reversed(parts))
+
+    def get_node(self, user_id: str, node_id: int) -> Optional[Dict]:
+        self._round_trip()
+        node = self._nodes.get(node_id)
+        if node is None or node["user_id"] != user_id:
+            return None
+        return {k: node[k] for k in ("id", "parent_id", "name", "is_dir")}
+
+    def _check_destination(self, user_id: str, node_id: int, parent_id: Optional[int], name: str,
+                           moving: bool) -> None:
+        ancestor = parent_id
+        if parent_id is not None:
+            parent = self._nodes.get(parent_id)
+            if parent is None or parent["user_id"] != user_id or not parent["is_dir"]:
+                raise ValueError("Parent directory not found or not a directory")
+        while ancestor is not None:
+            if ancestor == node_id:
+                raise ValueError("Cannot place a directory inside itself")
+            ancestor = self._nodes[ancestor]["parent_id"]
+        if any(n["name"] == name and (not moving or n["id"] != node_id)
+               for n in self._children(user_id, parent_id)):
+            raise ValueError("A node with this name already exists in the specified location")
+
+    def move_node(self, user_id: str, node_id: int, parent_id: Optional[int], name: str) -> None:
+        self._round_trip()
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None or node["user_id"] != user_id:
+                raise ValueError("Node not found or access denied")
+            self._check_destination(user_id, node_id, parent_id, name, moving=True)
+            node.update(parent_id=parent_id, name=name, updated_at=datetime.now(timezone.utc))
+            self._record_change(user_id, node_id, "u")
+
+    def copy_node(self, user_id: str, node_id: int, parent_id: Optional[int], name: str) -> int:
+        self._round_trip()
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None or node["user_id"] != user_id:
+                raise ValueError("Node not found or access denied")
+            self._check_destination(user_id, node_id, parent_id, name, moving=False)
+            now = datetime.now(timezone.utc)
+            by_parent: Dict[int, List[dict]] = {}
+            for n in self._nodes.values():
+                if n["user_id"] == user_id and n["parent_id"] is not None:
+                    by_parent.setdefault(n["parent_id"], []).append(n)
+            root_id = next(self._ids)
+            pending = [(node, root_id, parent_id, name)]
+            while pending:
+                source, new_id, new_parent, new_name = pending.pop()
+                self._nodes[new_id] = dict(source, id=new_id, parent_id=new_parent, name=new_name,
+                                           created_at=now, updated_at=now)
+                self._record_change(user_id, new_id, "u")
+                pending.extend((c, next(self._ids), new_id, c["name"]) for c in by_parent.get(source["id"], []))
+            return root_id
+
+    def get_file_content(self, user_id: str, file_id: int) -> Optional[str]:
+        self._round_trip()
+        node = self._nodes.get(file_id)
+        if node is None or node["user_id"] != user_id or node["is_dir"]:
+            return None
+        return node["content"]
+
+    def get_file_version(self, user_id: str, file_id: int) -> Optional[datetime]:
+        self._round_trip()
+        node = self._nodes.get(file_id)
+        if node is None or node["user_id"] != user_id or node["is_dir"]:
+            return None
+        return node["updated_at"]
+
+    def get_file_with_version(self, user_id: str, file_id: int):
+        self._round_trip()
+        with self._lock:
+            node = self._nodes.get(file_id)
+            if node is None or node["user_id"] != user_id or node["is_dir"]:
+                return None
+            return node["content"], node["updated_at"]
+
+    def update_file_content(self, user_id: str, file_id: int, content: str) -> datetime:
+        self._round_trip()
+        with self._lock:
+            node = self._nodes.get(file_id)
+            if node is None or node["user_id"] != user_id or node["is_dir"]:
+                raise ValueError("File not found or not a file")
+            node["content"] = content
+            node["updated_at"] = datetime.now(timezone.utc)
+            self._record_change(user_id, file_id, "u")
+            return node["updated_at"]
+
+    def delete_node(self, user_id: str, node_id: int) -> None:
+        self._round_trip()
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None or node["user_id"] != user_id:
+                raise ValueError("Node not found or access denied")
+            by_parent: Dict[int, List[int]] = {}
+            for n in self._nodes.values():
+                if n["user_id"] == user_id and n["parent_id"] is not None:
+                    by_parent.setdefault(n["parent_id"], []).append(n["id"])
+            doomed = [node_id]
+            for doomed_id in doomed:
+                doomed.extend(by_parent.get(doomed_id, []))
+            for doomed_id in doomed:
+                del self._nodes[doomed_id]
+            self._record_change(user_id, node_id, "d")
+
+    def create_node(self, user_id: str, name: str, is_dir: bool, parent_id: Optional[int] = None,
+                    content: Optional[str] = None) -> Dict:
+        self._round_trip()
+        with self._lock:
+            if parent_id is not None:
+                parent = self._nodes.get(parent_id)
+                if parent is None or parent["user_id"] != user_id or not parent["is_dir"]:
+                    raise ValueError("Parent directory not found or not a directory")
+            if any(n["name"] == name for n in self._children(user_id, parent_id)):
+                raise ValueError("A node with this name already exists in the specified location")
+            now = datetime.now(timezone.utc)
+            node = {
+                "id": next(self._ids),
+                "user_id": user_id,
+                "parent_id": parent_id,
+                "name": name,
+                "is_dir": is_dir,
+                "content": content,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._nodes[node["id"]] = node
+            self._record_change(user_id, node["id"], "u")
+            return dict(self._public(node), children=[])
+
+    def create_nodes(self, user_id: str, rows) -> List[int]:
+        self._round_trip()
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            ids = []
+            for parent_id, name, is_dir, content in rows:
+                node_id = next(self._ids)
+                self._nodes[node_id] = {
+                    "id": node_id, "user_id": user_id, "parent_id": parent_id, "name": name,
+                    "is_dir": is_dir, "content": content, "created_at": now, "updated_at": now,
+                }
+                self._record_change(user_id, node_id, "u")
+                ids.append(node_id)
+            return ids
+
+    def update_file_contents(self, user_id: str, updates) -> None:
+        self._round_trip()
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            for node_id, content in updates:
+                node = self._nodes.get(node_id)
+                if node is not None and node["user_id"] == user_id and not node["is_dir"]:
+                    node["content"] = content
+                    node["updated_at"] = now
+                    self._record_change(user_id, node_id, "u")
+
+    def get_usage(self, user_id: str) -> Dict:
+        self._round_trip()
+        with self._lock:
+            nodes = [n for n in self._nodes.values() if n["user_id"] == user_id]
+            used = sum(len((n["content"] or "").encode("utf-8")) for n in nodes)
+        return {"bytes": used, "nodes": len(nodes), "quota_bytes": 0, "quota_nodes": 0}
+
+    def iter_tree(self, user_id: str, batch_size: int = 200):
+        self._round_trip()
+        with self._lock:
+            rows = sorted(
+                (path, self._nodes[node_id]["is_dir"], self._nodes[node_id]["content"],
+                 self._nodes[node_id]["updated_at"])
+                for node_id, path in self._paths(user_id).items()
+            )
+        yield from rows
@@ -0,0 +1,87 @@
+# In bench/kernel_bench.py
+"""
+Compare running a snippet as a cold `python3 -c` exec with running it on the
+warm kernel /api/run/ws uses, in a real sandbox container (Docker required).
+
+    cd backend && python -m bench.kernel_bench
+    python -m bench.kernel_bench --container terminal-alice --repeat 50
+    python -m bench.kernel_bench --code "print(sum(range(10**6)))"
+
+Without --container a throwaway container is started from the sandbox image
+and removed afterwards. "kernel:start" is the one-off cost of the first run
+(bridge, kernel and preload); "kernel" is every run after it. Both sides
+measure from request to complete output, as the server sees it.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+import docker
+from bench.stats import print_table, summarize
+from kernel_runner import KernelPool, start_kernel_exec
+
+DEFAULT_CODE = "import pandas as pd\nprint(pd.DataFrame({'x': range(100)}).x.sum())"
+
+def stop_exec(exec_id: str, sock) -> None:
+    sock.close()
+
+def cold_runs(container, code: str, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = container.exec_run(["python3", "-c", code], workdir="/workspace")
+        samples.append(time.perf_counter() - start)
+        if result.exit_code != 0:
+            raise SystemExit(f"cold run failed: {result.output.decode(errors='replace')}")
+    return samples
+
+async def warm_runs(client, container_id: str, code: str, repeat: int) -> Dict[str, List[float]]:
+    pool = KernelPool()
+    samples: Dict[str, List[float]] = {"kernel:start": [], "kernel": []}
+    start = time.perf_counter()
+    kernel = await pool.get_or_start(container_id, lambda cid: start_kernel_exec(client, cid), stop_exec)
+    for i in range(repeat + 1):
+        async for message in kernel.run(code):
+            if message["type"] == "done" and message["status"] != "ok":
+                raise SystemExit(f"kernel run ended with {message['status']}")
+            if message["type"] == "error":
+                raise SystemExit("\n".join(message["traceback"]))
+        samples["kernel:start" if i == 0 else "kernel"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+    await pool.close(container_id)
+    return samples
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--container", help="existing container to run in (default: start a throwaway one)")
+    parser.add_argument("--image", default="ehcaw/lsclear:latest", help="image for the throwaway container")
+    parser.add_argument("--code", default=DEFAULT_CODE, help="snippet to run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of each variant")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    client = docker.from_env()
+    if args.container:
+        container, owned = client.containers.get(args.container), False
+    else:
+        container = client.containers.run(args.image, command=["tail", "-f", "/dev/null"], detach=True,
+                                          working_dir="/workspace", labels={"managed_by": "bench"})
+        owned = True
+    try:
+        start = time.perf_counter()
+        samples = {"python3 -c": cold_runs(container, args.code, args.repeat)}
+        samples.update(asyncio.run(warm_runs(client, container.id, args.code, args.repeat)))
+        print_table(summarize(samples, {}, time.perf_counter() - start))
+    finally:
+        if owned:
+            container.remove(force=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# In bench/loadtest.py
+"""
+Drive N simulated users through the app in-process against a fake Docker
+daemon and an in-memory (or local Postgres) NeonDB, and report latency
+percentiles and throughput.
+
+    cd backend && python -m bench.loadtest --users 50
+    python -m bench.loadtest --users 50 --json out.json --baseline last.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# Per-request info logs would dominate the run; set before the app's loggers are configured
+os.environ.setdefault("LOG_LEVEL", "warning")
+# The load is deliberately heavier than one user's rate limits allow
+for _endpoint in ("FS_EVENT", "FILE_SAVE", "IMPORT"):
+    os.environ.setdefault(f"RATE_LIMIT_{_endpoint}", "0")
+
+import docker
+import postgres
+from bench.fakes import FakeDockerClient, InMemoryNeonDB
+from bench.asgi_client import ASGIClient
+from bench.stats import print_table, summarize
+from session_supervisor import FRAME_INPUT
+
+KEYSTROKES = "abcdefghijklmnopqrstuvwxyz"  # never appears in the fake shells' filler output
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.bytes_out = 0
+
+    async def time(self, op: str, coro):
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            self.errors[op] = self.errors.get(op, 0) + 1
+            raise
+        self.samples.setdefault(op, []).append(time.perf_counter() - start)
+        return result
+
+def install_fakes(args) -> FakeDockerClient:
+    """Swap in the fakes before main is imported, since it connects at import time"""
+    fake = FakeDockerClient(
+        create_latency=args.create_latency,
+        start_latency=args.start_latency,
+        exec_latency=args.exec_latency,
+        output_rate=args.output_rate,
+    )
+    docker.from_env = lambda *a, **kw: fake
+    if not args.real_postgres:
+        InMemoryNeonDB.query_latency = args.db_latency
+        postgres.NeonDB = InMemoryNeonDB
+    return fake
+
+async def start_terminal(client: ASGIClient, user_id: str) -> str:
+    while True:
+        status, body = await client.request("POST", "/terminal/start", {"user_id": user_id})
+        if status == 202:
+            await asyncio.sleep(0.2)
+            continue
+        if status != 200:
+            raise RuntimeError(f"/terminal/start returned {status}: {body}")
+        return body["session_id"]
+
+async def wait_for(ws, needle: bytes, recorder: Recorder) -> None:
+    while True:
+        data = await ws.receive()
+        recorder.bytes_out += len(data)
+        if needle in data:
+            return
+
+async def terminal_traffic(client: ASGIClient, sid: str, args, recorder: Recorder) -> None:
+    async def type_text(text: str):
+        if args.legacy_input:
+            await ws.send_text(text)
+        else:
+            await ws.send_bytes(bytes([FRAME_INPUT]) + text.encode())
+
+    url = f"/terminal/ws/{sid}" if args.legacy_input else f"/terminal/ws/{sid}?proto=binary"
+    async with client.websocket(url) as ws:
+        await wait_for(ws, b"$ ", recorder)
+        for i in range(args.keystrokes):
+            key = KEYSTROKES[i % len(KEYSTROKES)]
+            await type_text(key)
+            await recorder.time("terminal.echo", wait_for(ws, key.encode(), recorder))
+            if args.keystroke_interval:
+                await asyncio.sleep(args.keystroke_interval)
+        await type_text("\r")
+        await wait_for(ws, b"$ ", recorder)
+
+async def file_saves(client: ASGIClient, db, user_id: str, args, recorder: Recorder) -> None:
+    loop = asyncio.get_running_loop()
+    file_id = await loop.run_in_executor(None, db.resolve_path, user_id, "main.py")
+    if file_id is None:
+        file_id = (await loop.run_in_executor(None, db.create_node, user_id, "main.py", False, None, ""))["id"]
+    content = "x = 1\n" * (args.file_size // 6)
+    for i in range(args.saves):
+        async def save():
+            status, body = await client.request(
+                "PUT", f"/api/files/{file_id}", {"content": f"# rev {i}\n{content}", "userId": user_id}
+            )
+            if status != 200:
+                raise RuntimeError(f"update_file returned {status}: {body}")
+        await recorder.time("update_file", save())
+
+async def fs_events(client: ASGIClient, user_id: str, args, recorder: Recorder) -> None:
+    for i in range(args.fs_events):
+        for cmd in (f"mkdir bench{i}", f"touch bench{i}/sub/file.py", f"cp -r bench{i} copy{i}",
+                    f"mv copy{i} moved{i}", f"rm bench{i}", f"rm moved{i}"):
+            verb = cmd.split(" ", 1)[0]
+
+            async def send():
+                status, body = await client.request(
+                    "POST", "/api/fs-event", {"user_id": user_id, "cmd": cmd, "cwd": "/workspace"}
+                )
+                if status != 200:
+                    raise RuntimeError(f"fs_event {cmd!r} returned {status}: {body}")
+            await recorder.time(f"fs_event.{verb}", send())
+
+async def simulate_user(client: ASGIClient, db, index: int, args, recorder: Recorder) -> None:
+    user_id = f"bench-{index}"
+    try:
+        sid = await recorder.time("terminal.start", start_terminal(client, user_id))
+        await asyncio.gather(
+            terminal_traffic(client, sid, args, recorder),
+            file_saves(client, db, user_id, args, recorder),
+            fs_events(client, user_id, args, recorder),
+        )
+    except Exception as e:
+        print(f"{user_id}: {e}", file=sys.stderr)
+    finally:
+        await client.request("POST", f"/terminal/cleanup/{user_id}")
+
+async def run(args) -> dict:
+    loop = asyncio.get_running_loop()
+    # Docker and NeonDB calls run on the default executor; size it for the
+    # simulated users like a deployment would
+    loop.set_default_executor(ThreadPoolExecutor(args.executor_threads or args.users * 2 + 16))
+    install_fakes(args)
+    import main
+    # ASGIClient sends no lifespan events, so start the stall detector by hand
+    main.watchdog.start(loop)
+
+    client = ASGIClient(main.app)
+    recorder = Recorder()
+    start = time.perf_counter()
+
+    async def staggered(i):
+        await asyncio.sleep(i * args.ramp / max(args.users, 1))
+        await simulate_user(client, main.neon_db, i, args, recorder)
+
+    await asyncio.gather(*(staggered(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+    main.watchdog.stop()
+    return {
+        "users": args.users,
+        "elapsed_s": round(elapsed, 2),
+        "terminal_output_mb_per_sec": round(recorder.bytes_out / elapsed / 1e6, 3),
+        "loop_max_lag_ms": round(main.watchdog.max_lag * 1000, 1),
+        "loop_stalls": len(main.watchdog.stalls),
+        "ops": summarize(recorder.samples, recorder.errors, elapsed),
+    }
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['users']} users in {report['elapsed_s']}s, "
+          f"terminal output {report['terminal_output_mb_per_sec']} MB/s, "
+          f"event loop max lag {report['loop_max_lag_ms']}ms ({report['loop_stalls']} stalls)\n")
+    print_table(report["ops"])
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Operations whose p95 grew by more than tolerance (or that started failing)"""
+    found = []
+    for op, before in baseline.get("ops", {}).items():
+        after = report["ops"].get(op)
+        if after is None:
+            continue
+        if after["errors"] > before["errors"]:
+            found.append(f"{op}: errors {before['errors']} -> {after['errors']}")
+        if before["p95_ms"] and after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(f"{op}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+    return found
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which users arrive")
+    parser.add_argument("--keystrokes", type=int, default=200, help="echoed keystrokes per user")
+    parser.add_argument("--keystroke-interval", type=float, default=0.0, help="think time between keystrokes")
+    parser.add_argument("--legacy-input", action="store_true",
+                        help="type as plain text frames instead of ?proto=binary input frames")
+    parser.add_argument("--saves", type=int, default=20, help="update_file calls per user")
+    parser.add_argument("--file-size", type=int, default=4096, help="bytes per saved file")
+    parser.add_argument("--fs-events", type=int, default=10, help="mkdir/touch/cp/mv/rm rounds per user")
+    parser.add_argument("--output-rate", type=int, default=0, help="filler bytes/s each shell streams")
+    parser.add_argument("--create-latency", type=float, default=0.5, help="fake containers.run latency (s)")
+    parser.add_argument("--start-latency", type=float, default=0.3, help="fake container start latency (s)")
+    parser.add_argument("--exec-latency", type=float, default=0.005, help="fake exec/put_archive latency (s)")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="in-memory NeonDB round trip (s)")
+    parser.add_argument("--real-postgres", action="store_true",
+                        help="use the real NeonDB (PG* environment variables) instead of the in-memory one")
+    parser.add_argument("--executor-threads", type=int, default=0, help="default executor size (0: sized to users)")
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--baseline", help="report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth over the baseline")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
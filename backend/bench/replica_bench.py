@@ -0,0 +1,133 @@
+# In bench/replica_bench.py
+"""
+Check NeonDB's read routing against a primary and a replica, then time the
+same reads on each. Both need the fs_nodes schema.
+
+    cd backend && python -m bench.replica_bench \\
+        --primary "host=localhost port=5432 dbname=ide" --replica "host=localhost port=5433 dbname=ide"
+    python -m bench.replica_bench --primary ... --replica ... --pin-seconds 1 --repeat 200
+
+The replica can be a streaming standby of the primary or, to check routing
+alone, a second standalone instance (e.g. loaded with pg_dump --schema-only).
+The steps:
+- pinned: a file is created, and the next read routes to the primary and sees it
+- replica: once --pin-seconds pass, reads route to the replica. A standby
+  sees the file; a standalone instance doesn't.
+- failover: the replica terminates the bench's connection; the read is
+  retried on the primary and the replica is taken out of rotation
+- unreachable: with only a replica that refuses connections, reads go to the primary
+Then get_tree_rows and get_file_content are timed on each server.
+"""
+import argparse
+import os
+import psycopg2
+import sys
+import time
+from typing import Dict, List
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+from bench.stats import print_table, summarize
+
+UNREACHABLE_DSN = "host=127.0.0.1 port=1"
+
+def check(label: str, ok: bool, detail: str) -> bool:
+    print(f"{label:<12}{'ok' if ok else 'FAIL':<6}{detail}")
+    return ok
+
+def clear(db, user_id: str) -> None:
+    for node in db.get_user_file_structure(user_id):
+        db.delete_node(user_id, node["id"])
+
+def run_checks(NeonDB, args) -> bool:
+    primary = NeonDB(args.primary, ())
+    db = NeonDB(args.primary, [args.replica])
+    ok = True
+    try:
+        clear(primary, args.user)
+        file_id = db.create_node(args.user, "replica_check.py", False, None, "print('written')\n")["id"]
+
+        route = db.read_route(args.user)
+        content = db.get_file_content(args.user, file_id)
+        ok &= check("pinned", route == "primary" and content is not None, f"route={route} sees_write={content is not None}")
+
+        time.sleep(args.pin_seconds + 0.1)
+        route = db.read_route(args.user)
+        content = db.get_file_content(args.user, file_id)
+        ok &= check("replica", route != "primary", f"route={route} sees_write={content is not None}")
+
+        # Kill the backend from a second session, so the failure surfaces mid-query
+        admin = psycopg2.connect(args.replica)
+        try:
+            with admin.cursor() as cursor:
+                cursor.execute("SELECT pg_terminate_backend(%s)", (db._replicas[0].conn.info.backend_pid,))
+        finally:
+            admin.close()
+        content = db.get_file_content(args.user, file_id)
+        route = db.read_route(args.user)
+        ok &= check("failover", content is not None and route == "primary", f"route after failure={route}")
+    finally:
+        clear(primary, args.user)
+        primary.close()
+        db.close()
+
+    unreachable = NeonDB(args.primary, [UNREACHABLE_DSN])
+    try:
+        start = time.perf_counter()
+        unreachable.get_tree_revision(args.user)
+        ok &= check("unreachable", unreachable.read_route(args.user) == "primary",
+                    f"first read {1000 * (time.perf_counter() - start):.0f} ms")
+    finally:
+        unreachable.close()
+    return ok
+
+def time_reads(NeonDB, args) -> Dict[str, dict]:
+    """Seed a small tree once through the primary and read it back --repeat times from each server"""
+    writer = NeonDB(args.primary, ())
+    root = writer.create_node(args.user, "bench", True)["id"]
+    file_id = None
+    for i in range(args.files):
+        file_id = writer.create_node(args.user, f"file_{i}.py", False, root, f"x = {i}\n" * 50)["id"]
+    time.sleep(args.pin_seconds + 0.1)  # let the replica catch up and the pin lapse
+
+    reader = NeonDB(args.primary, [args.replica])
+    samples: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+    try:
+        for label, db in (("primary", writer), ("replica", reader)):
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                db.get_tree_rows(args.user)
+                samples.setdefault(f"{label}:tree_rows", []).append(time.perf_counter() - t)
+                t = time.perf_counter()
+                db.get_file_content(args.user, file_id)
+                samples.setdefault(f"{label}:file_content", []).append(time.perf_counter() - t)
+    finally:
+        writer.delete_node(args.user, root)
+        writer.close()
+        reader.close()
+    return summarize(samples, {}, time.perf_counter() - start)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--primary", required=True, help="primary DSN")
+    parser.add_argument("--replica", required=True, help="replica DSN")
+    parser.add_argument("--pin-seconds", type=float, default=1.0, help="read-your-writes window (REPLICA_PIN_SECONDS)")
+    parser.add_argument("--files", type=int, default=200, help="files in the timed tree")
+    parser.add_argument("--repeat", type=int, default=100, help="reads of each kind per server")
+    parser.add_argument("--user", default="bench-replica", help="user id owning the bench files")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Read at import, so set before postgres is first imported
+    os.environ["REPLICA_PIN_SECONDS"] = str(args.pin_seconds)
+    from postgres import NeonDB
+
+    ok = run_checks(NeonDB, args)
+    print()
+    print_table(time_reads(NeonDB, args))
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# In bench/save_bench.py
+"""
+Measure peak Python memory and time per editor save, from the received
+request body to the container upload having been read, for each save path.
+No database or Docker daemon is involved.
+
+    cd backend && python -m bench.save_bench
+    python -m bench.save_bench --sizes-mb 1 10 50 --repeat 3
+
+"legacy" is the previous PUT /api/files/{id} body: JSON body -> str ->
+encode -> BytesIO -> tar in a second BytesIO. "json" is the same endpoint
+today (the encoded bytes read through a TarStream), and "raw" is
+PUT /api/files/{id}/content (body spooled, decoded once for fs_nodes, and
+read back from the spool by the TarStream). The upload is consumed in 16 KiB
+reads, as the HTTP client sends it. Peaks are allocations on top of the body.
+"""
+import argparse
+import json
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Callable, Dict, List
+
+from tar_stream import TarStream, read_utf8
+
+SEND_BLOCK = 16 * 1024          # what the HTTP client reads per send
+BODY_CHUNK = 64 * 1024          # request body chunk size, as the ASGI server delivers it
+SPOOL_BYTES = 1024 * 1024       # FILE_UPLOAD_SPOOL_BYTES in main
+
+def drain(archive) -> int:
+    sent = 0
+    while True:
+        block = archive.read(SEND_BLOCK)
+        if not block:
+            return sent
+        sent += len(block)
+
+def legacy_save(body: bytes) -> int:
+    content = json.loads(body)["content"]
+    stream = BytesIO()
+    tar = tarfile.TarFile(fileobj=stream, mode="w")
+    content_bytes = content.encode("utf-8")
+    info = tarfile.TarInfo(name="src/main.py")
+    info.size = len(content_bytes)
+    tar.addfile(info, BytesIO(content_bytes))
+    tar.close()
+    stream.seek(0)
+    return drain(stream)
+
+def json_save(body: bytes) -> int:
+    content = json.loads(body)["content"]
+    archive = TarStream()
+    archive.add_bytes("src/main.py", content.encode("utf-8"))
+    return drain(archive)
+
+def raw_save(body: bytes) -> int:
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        view = memoryview(body)
+        for offset in range(0, len(body), BODY_CHUNK):
+            spool.write(view[offset:offset + BODY_CHUNK])
+        size = spool.tell()
+        spool.seek(0)
+        content = read_utf8(spool)  # the copy handed to fs_nodes
+        del content
+        spool.seek(0)
+        archive = TarStream()
+        archive.add_file("src/main.py", spool, size)
+        return drain(archive)
+    finally:
+        spool.close()
+
+def synthetic_source(size: int) -> str:
+    line = "def handler(request):  # ünïcode comment\n    return {'status': 'ok', 'items': list(range(10))}\n"
+    return (line * (size // len(line.encode("utf-8")) + 1))[:size]
+
+def measure(fn: Callable[[bytes], int], body: bytes, repeat: int) -> Dict[str, float]:
+    peaks, times = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        fn(body)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+    return {"peak_mb": max(peaks) / 1024 ** 2, "ms": min(times) * 1000}
+
+def run(sizes_mb: List[float], repeat: int) -> List[tuple]:
+    rows = []
+    for size_mb in sizes_mb:
+        content = synthetic_source(int(size_mb * 1024 * 1024))
+        json_body = json.dumps({"content": content, "userId": "bench", "filePath": "src/main.py"}).encode()
+        raw_body = content.encode("utf-8")
+        del content
+        for label, fn, body in (("legacy", legacy_save, json_body), ("json", json_save, json_body),
+                                ("raw", raw_save, raw_body)):
+            result = measure(fn, body, repeat)
+            rows.append((size_mb, label, len(body) / 1024 ** 2, result["peak_mb"], result["ms"]))
+    return rows
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 10, 50], help="file sizes to save")
+    parser.add_argument("--repeat", type=int, default=3, help="saves per path and size")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    print(f"{'file MB':>8}  {'path':<8}{'body MB':>10}{'peak MB':>10}{'peak/body':>11}{'ms':>10}")
+    for size_mb, label, body_mb, peak_mb, ms in run(args.sizes_mb, args.repeat):
+        print(f"{size_mb:>8g}  {label:<8}{body_mb:>10.1f}{peak_mb:>10.1f}{peak_mb / body_mb:>11.2f}{ms:>10.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# In bench/search_bench.py
+"""
+Time the search API's database and highlighting work on a synthetic project
+(10k files by default) in the Postgres configured by the PG* variables.
+
+    cd backend && python -m bench.search_bench --files 10000
+    python -m bench.search_bench --keep      # reuse the seeded project next run
+
+Seeding goes through NeonDB.create_node, so the trigram indexes are
+maintained exactly as they are for real writes.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+from bench.stats import print_table, summarize
+from search import fuzzy_ranges, line_matches
+
+WORDS = ["config", "handler", "user", "session", "request", "cache", "util", "model", "view", "index",
+         "service", "client", "render", "parse", "token", "event", "store", "route", "query", "schema"]
+EXTENSIONS = [".py", ".ts", ".tsx", ".md", ".json"]
+NAME_QUERIES = ["main", "cfg", "handler.py", "usrsvc", "idx", "zzqx"]
+CONTENT_QUERIES = ["TODO", "def handle_", "import os", "return None", "zzqx_no_match"]
+
+def synthetic_file(rng: random.Random, lines: int) -> str:
+    out = ["import os", "import json", ""]
+    for i in range(lines):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.05:
+            out.append(f"# TODO: tidy up {word}")
+        elif roll < 0.2:
+            out.append(f"def handle_{word}_{i}(request):")
+        elif roll < 0.3:
+            out.append("    return None")
+        else:
+            out.append(f"    {word}_{i} = {rng.choice(WORDS)}.get('{rng.choice(WORDS)}')")
+    return "\n".join(out) + "\n"
+
+def seed(db, user_id: str, files: int, lines: int, rng: random.Random) -> None:
+    """Spread files over a two-level directory tree, ~50 files per directory"""
+    dirs: List[int] = []
+    top_count = max(1, int((files / 50) ** 0.5))
+    for t in range(top_count):
+        top = db.create_node(user_id, f"{rng.choice(WORDS)}_{t}", True)["id"]
+        for c in range(top_count):
+            dirs.append(db.create_node(user_id, f"{rng.choice(WORDS)}_{c}", True, top)["id"])
+    db.create_node(user_id, "main.py", False, None, synthetic_file(rng, lines))
+    for i in range(files - 1):
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{i}{rng.choice(EXTENSIONS)}"
+        db.create_node(user_id, name, False, dirs[i % len(dirs)], synthetic_file(rng, lines))
+        if (i + 1) % 1000 == 0:
+            print(f"seeded {i + 1} files", file=sys.stderr)
+
+def run(db, user_id: str, repeat: int, page: int) -> Dict[str, dict]:
+    samples: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in NAME_QUERIES:
+            t = time.perf_counter()
+            rows = db.search_file_names(user_id, q, page + 1, 0)
+            for row in rows[:page]:
+                fuzzy_ranges(row["name"], q)
+            samples.setdefault(f"name:{q}", []).append(time.perf_counter() - t)
+        for q in CONTENT_QUERIES:
+            t = time.perf_counter()
+            rows = db.search_file_contents(user_id, q, page + 1, 0)
+            for row in rows[:page]:
+                line_matches(row["content"] or "", q)
+            samples.setdefault(f"content:{q}", []).append(time.perf_counter() - t)
+        # A later page, to show OFFSET cost
+        t = time.perf_counter()
+        db.search_file_contents(user_id, "import os", page + 1, page * 10)
+        samples.setdefault("content:page11", []).append(time.perf_counter() - t)
+    return summarize(samples, {}, time.perf_counter() - start)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="files in the synthetic project")
+    parser.add_argument("--lines", type=int, default=60, help="lines per file")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of each query")
+    parser.add_argument("--page", type=int, default=50, help="results per page")
+    parser.add_argument("--user", default="bench-search", help="user id owning the synthetic project")
+    parser.add_argument("--keep", action="store_true", help="leave the project in place (and reuse it if present)")
+    parser.add_argument("--in-memory", action="store_true", help="use the in-memory NeonDB stand-in")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.in_memory:
+        from bench.fakes import InMemoryNeonDB
+        db = InMemoryNeonDB()
+    else:
+        from postgres import NeonDB
+        db = NeonDB()
+
+    roots = db.get_user_file_structure(args.user) if args.keep else []
+    if not roots:
+        for node in db.get_user_file_structure(args.user):
+            db.delete_node(args.user, node["id"])
+        seed_start = time.perf_counter()
+        seed(db, args.user, args.files, args.lines, random.Random(0))
+        print(f"seeded {args.files} files in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+
+    try:
+        ops = run(db, args.user, args.repeat, args.page)
+        print()
+        print_table(ops)
+    finally:
+        if not args.keep:
+            for node in db.get_user_file_structure(args.user):
+                db.delete_node(args.user, node["id"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+# In bench/stats.py
+from typing import Dict, List
+
+def percentile(sorted_samples: List[float], p: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(p / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def summarize(samples: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict[str, dict]:
+    """Per-operation count, errors, p50/p95/p99/max in ms and rate over elapsed seconds"""
+    ops = {}
+    for op in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(op, []))
+        ops[op] = {
+            "count": len(values),
+            "errors": errors.get(op, 0),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round((values[-1] if values else 0) * 1000, 2),
+            "per_sec": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        }
+    return ops
+
+def print_table(ops: Dict[str, dict]) -> None:
+    print(f"{'operation':<24}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'ops/s':>9}")
+    for op, s in ops.items():
+        print(f"{op:<24}{s['count']:>8}{s['errors']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}{s['per_sec']:>9}")
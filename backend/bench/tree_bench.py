@@ -0,0 +1,94 @@
+# In bench/tree_bench.py
+"""
+Time file tree assembly and JSON encoding on synthetic trees, from the row
+tuples NeonDB.get_tree_rows returns. No database is involved.
+
+    cd backend && python -m bench.tree_bench
+    python -m bench.tree_bench --sizes 1000 10000 100000 --repeat 5
+
+"legacy" is the previous path (datetime rows, a dict per row, two-pass
+nesting, json.dumps), "build_tree" the single-pass dicts hydration uses, and
+"tree_json" the encoder that writes snapshots and /api/tree straight from the
+tuples. The new paths get timestamps pre-formatted, as get_tree_rows does.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from bench.stats import print_table, summarize
+from file_tree import build_tree, tree_json
+
+def synthetic_rows(nodes: int, rng: random.Random) -> List[tuple]:
+    """A random tree with ~20 entries per directory, ordered like get_tree_rows"""
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows, dirs = [], [None]
+    for node_id in range(1, nodes + 1):
+        parent = dirs[rng.randrange(len(dirs))] if len(dirs) > 1 else None
+        is_dir = rng.random() < 0.05 or len(dirs) == 1
+        stamp = base + timedelta(seconds=node_id, microseconds=rng.randrange(1, 1000000))
+        content = None if is_dir else f"# file {node_id}\nprint('héllo {node_id}')\n"
+        rows.append((node_id, parent, f"node_{node_id}{'' if is_dir else '.py'}", is_dir, content, stamp, stamp))
+        if is_dir:
+            dirs.append(node_id)
+    rows.sort(key=lambda r: (not r[3], r[2]))
+    return rows
+
+def as_text_timestamps(rows: List[tuple]) -> List[tuple]:
+    """What get_tree_rows returns: timestamps already formatted by Postgres (ISO_UTC)"""
+    return [r[:5] + (r[5].strftime("%Y-%m-%dT%H:%M:%S.%f+00:00"), r[6].strftime("%Y-%m-%dT%H:%M:%S.%f+00:00"))
+            for r in rows]
+
+def legacy_tree(rows: List[tuple]) -> List[Dict]:
+    nodes = [{
+        'id': r[0], 'parent_id': r[1], 'name': r[2], 'is_dir': r[3], 'content': r[4],
+        'created_at': r[5].isoformat() if r[5] else None,
+        'updated_at': r[6].isoformat() if r[6] else None,
+        'children': []
+    } for r in rows]
+    node_map = {node['id']: node for node in nodes}
+    roots = []
+    for node in nodes:
+        if node['parent_id'] is None:
+            roots.append(node)
+        else:
+            node_map[node['parent_id']]['children'].append(node)
+    return roots
+
+def run(sizes: List[int], repeat: int, check: bool) -> Dict[str, dict]:
+    samples: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+    for size in sizes:
+        legacy_rows = synthetic_rows(size, random.Random(size))
+        rows = as_text_timestamps(legacy_rows)
+        if check and json.dumps(legacy_tree(legacy_rows)) != tree_json(rows):
+            raise SystemExit(f"tree_json output differs from json.dumps at {size} nodes")
+        for label, fn in (
+            ("legacy", lambda: json.dumps(legacy_tree(legacy_rows))),
+            ("build_tree", lambda: build_tree(rows)),
+            ("build_tree+dumps", lambda: json.dumps(build_tree(rows))),
+            ("tree_json", lambda: tree_json(rows)),
+        ):
+            for _ in range(repeat):
+                t = time.perf_counter()
+                fn()
+                samples.setdefault(f"{size}:{label}", []).append(time.perf_counter() - t)
+    return summarize(samples, {}, time.perf_counter() - start)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="nodes per tree")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each variant per size")
+    parser.add_argument("--no-check", action="store_true", help="skip comparing tree_json with json.dumps")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    print_table(run(args.sizes, args.repeat, not args.no_check))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# In bench/tree_ops_bench.py
+"""
+Time mv and cp of a large directory (10k descendants by default) in the
+Postgres configured by the PG* variables.
+
+    cd backend && python -m bench.tree_ops_bench --files 10000
+    python -m bench.tree_ops_bench --naive   # also time a node-by-node copy for comparison
+
+move_node is one row update and copy_node one INSERT ... SELECT, so both
+should stay flat as the subtree grows; the naive copy shows what a
+per-node walk through create_node costs instead.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+from bench.stats import print_table, summarize
+
+SEED_BATCH = 1000
+
+def seed(db, user_id: str, files: int) -> int:
+    """A 'project' directory with files spread ~50 per subdirectory; returns its id"""
+    root = db.create_nodes(user_id, [(None, "project", True, None)])[0]
+    dirs = db.create_nodes(user_id, [(root, f"pkg_{i}", True, None) for i in range(max(1, files // 50))])
+    rows = [(dirs[i % len(dirs)], f"module_{i}.py", False, f"# module {i}\nx = {i}\n") for i in range(files)]
+    for start in range(0, len(rows), SEED_BATCH):
+        db.create_nodes(user_id, rows[start:start + SEED_BATCH])
+    return root
+
+def naive_copy(db, user_id: str, tree: List[Dict], parent_id, name=None) -> None:
+    for node in tree:
+        copy = db.create_node(user_id, name or node["name"], node["is_dir"], parent_id, node["content"])
+        naive_copy(db, user_id, node["children"], copy["id"])
+
+def run(db, user_id: str, root: int, repeat: int, naive: bool) -> Dict[str, dict]:
+    samples: Dict[str, List[float]] = {}
+
+    def timed(op, fn, *args):
+        t = time.perf_counter()
+        result = fn(*args)
+        samples.setdefault(op, []).append(time.perf_counter() - t)
+        return result
+
+    holder = db.create_node(user_id, "holder", True)["id"]
+    start = time.perf_counter()
+    for i in range(repeat):
+        timed("mv.rename", db.move_node, user_id, root, None, "renamed")
+        timed("mv.reparent", db.move_node, user_id, root, holder, "project")
+        timed("mv.back", db.move_node, user_id, root, None, "project")
+        copy = timed("cp.subtree", db.copy_node, user_id, root, None, f"copy_{i}")
+        timed("rm.subtree", db.delete_node, user_id, copy)
+        if naive:
+            tree = [n for n in db.get_user_file_structure(user_id) if n["id"] == root]
+            timed("cp.naive", naive_copy, db, user_id, tree, None, f"naive_{i}")
+            db.delete_node(user_id, db.resolve_path(user_id, f"naive_{i}"))
+    db.delete_node(user_id, holder)
+    return summarize(samples, {}, time.perf_counter() - start)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="files under the directory being moved/copied")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each operation")
+    parser.add_argument("--naive", action="store_true", help="also time a node-by-node copy")
+    parser.add_argument("--user", default="bench-tree-ops", help="user id owning the synthetic project")
+    parser.add_argument("--in-memory", action="store_true", help="use the in-memory NeonDB stand-in")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.in_memory:
+        from bench.fakes import InMemoryNeonDB
+        db = InMemoryNeonDB()
+    else:
+        from postgres import NeonDB
+        db = NeonDB()
+
+    for node in db.get_user_file_structure(args.user):
+        db.delete_node(args.user, node["id"])
+    seed_start = time.perf_counter()
+    root = seed(db, args.user, args.files)
+    print(f"seeded {args.files} files in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+
+    try:
+        ops = run(db, args.user, root, args.repeat, args.naive)
+        print()
+        print_table(ops)
+    finally:
+        for node in db.get_user_file_structure(args.user):
+            db.delete_node(args.user, node["id"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# In checkpoints.py
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import docker
+from structured_logging import get_logger
+
+log = get_logger("checkpoints")
+
+# With WORKSPACE_CHECKPOINTS=1 a user's container is committed to a per-user
+# image before it is removed, so installed packages, dotfiles and (without a
+# workspace volume) /workspace itself survive. The next container for that
+# user starts from the checkpoint and skips the .bashrc setup; hydration is
+# skipped too when the tree revision recorded in the checkpoint is current.
+# Running processes are not saved: a checkpoint is the filesystem only.
+
+CHECKPOINT_REPOSITORY = "lsclear-checkpoint"
+CHECKPOINT_LABEL = "lsclear.checkpoint"
+REVISION_LABEL = "lsclear.tree_revision"     # fs_nodes revision (trigger-maintained) when the checkpoint was taken
+CHECKPOINT_MAX_IMAGES = int(os.getenv("CHECKPOINT_MAX_IMAGES", "50"))
+CHECKPOINT_DISK_BUDGET = int(os.getenv("CHECKPOINT_DISK_BUDGET", str(20 * 1024 ** 3)))  # bytes above the base image
+CHECKPOINT_MAX_LAYERS = 100         # each checkpoint stacks a layer; overlay2 allows 125
+CHECKPOINT_WORKERS = int(os.getenv("CHECKPOINT_WORKERS", "2"))  # background commits at once
+
+_last_used: Dict[str, float] = {}   # tag -> last restore, for LRU order within this process
+_retiring: Dict[str, Future] = {}   # user_id -> background checkpoint-and-remove
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=CHECKPOINT_WORKERS, thread_name_prefix="checkpoint")
+
+def checkpoints_enabled() -> bool:
+    return os.getenv("WORKSPACE_CHECKPOINTS") == "1"
+
+def checkpoint_tag(user_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", user_id)[:128]
+
+def checkpoint_ref(user_id: str) -> str:
+    return f"{CHECKPOINT_REPOSITORY}:{checkpoint_tag(user_id)}"
+
+def find_checkpoint(client, user_id: str) -> Optional[str]:
+    """The image reference to start the user's container from, or None for a cold start"""
+    ref = checkpoint_ref(user_id)
+    try:
+        client.images.get(ref)
+    except docker.errors.NotFound:
+        return None
+    with _lock:
+        _last_used[checkpoint_tag(user_id)] = time.time()
+    return ref
+
+def is_current(container, revision: int) -> bool:
+    """Whether the container came from a checkpoint taken at this tree revision"""
+    return container.labels.get(REVISION_LABEL) == str(revision)
+
+def checkpoint_container(client, container, user_id: str, revision: int) -> bool:
+    """
+    Commit the container as the user's checkpoint, replacing the previous one.
+    Returns False when no checkpoint was taken.
+    """
+    layers = len(container.image.attrs.get("RootFS", {}).get("Layers", []))
+    if layers >= CHECKPOINT_MAX_LAYERS:
+        # Another commit would approach the storage driver's layer limit; the next start is cold
+        log.warning("checkpoint.layer_limit", user_id=user_id, layers=layers)
+        delete_checkpoint(client, user_id)
+        return False
+    start = time.perf_counter()
+    try:
+        container.commit(
+            repository=CHECKPOINT_REPOSITORY,
+            tag=checkpoint_tag(user_id),
+            changes=[f"LABEL {CHECKPOINT_LABEL}=1 user_id={json.dumps(user_id)} {REVISION_LABEL}={revision}"],
+        )
+    except Exception as e:
+        log.warning("checkpoint.commit_failed", user_id=user_id, container_id=container.id, error=str(e))
+        return False
+    with _lock:
+        _last_used[checkpoint_tag(user_id)] = time.time()
+    log.info("checkpoint.saved", user_id=user_id, container_id=container.id, revision=revision,
+             seconds=round(time.perf_counter() - start, 3))
+    return True
+
+def checkpoint_and_remove(client, container, user_id: str, revision: int, base_image: str) -> None:
+    """Checkpoint the container and remove it, then drop the superseded checkpoint it was started from"""
+    previous = container.image
+    saved = checkpoint_container(client, container, user_id, revision)
+    container.remove(force=True)
+    if not saved:
+        return
+    if CHECKPOINT_LABEL in previous.labels:
+        try:
+            client.images.remove(previous.id)
+        except docker.errors.APIError:
+            pass  # still the current tag (nothing changed), or used by another container
+    collect_garbage(client, base_image)
+
+def retire_in_background(user_id: str, retire: Callable[[], None]) -> bool:
+    """
+    Run retire() (a checkpoint and remove) on the checkpoint workers, so the
+    caller doesn't wait out the docker commit. Returns False if the user
+    already has one queued or running.
+    """
+    with _lock:
+        if user_id in _retiring:
+            return False
+        future = _retiring[user_id] = _executor.submit(retire)
+
+    def done(future: Future) -> None:
+        with _lock:
+            _retiring.pop(user_id, None)
+        if future.exception() is not None:
+            log.warning("checkpoint.retire_failed", user_id=user_id, error=str(future.exception()))
+
+    future.add_done_callback(done)
+    return True
+
+def retiring(user_id: str) -> Optional[Future]:
+    """The user's background checkpoint-and-remove, if one is queued or running"""
+    with _lock:
+        return _retiring.get(user_id)
+
+def delete_checkpoint(client, user_id: str) -> bool:
+    try:
+        client.images.remove(checkpoint_ref(user_id), force=True)
+    except docker.errors.NotFound:
+        return False
+    with _lock:
+        _last_used.pop(checkpoint_tag(user_id), None)
+    log.info("checkpoint.deleted", user_id=user_id)
+    return True
+
+def list_checkpoints(client, base_image: str) -> List[Dict]:
+    """Checkpoints, least recently used first, with their size above the base image"""
+    try:
+        base_size = client.images.get(base_image).attrs.get("Size", 0)
+    except docker.errors.NotFound:
+        base_size = 0
+    with _lock:
+        last_used = dict(_last_used)
+    entries = []
+    for image in client.images.list(filters={"label": f"{CHECKPOINT_LABEL}=1"}):
+        for ref in image.tags:
+            repository, _, tag = ref.rpartition(":")
+            if repository != CHECKPOINT_REPOSITORY:
+                continue
+            created = image.attrs.get("Created", "")
+            entries.append({
+                "ref": ref,
+                "user_id": image.labels.get("user_id"),
+                "revision": image.labels.get(REVISION_LABEL),
+                "created": created,
+                "last_used": last_used.get(tag, 0.0),
+                "size": max(0, image.attrs.get("Size", 0) - base_size),
+            })
+    # Checkpoints this process has not committed or restored sort first, oldest commit first
+    entries.sort(key=lambda e: (e["last_used"], e["created"]))
+    return entries
+
+def collect_garbage(client, base_image: str) -> int:
+    """Remove least recently used checkpoints until within CHECKPOINT_MAX_IMAGES and CHECKPOINT_DISK_BUDGET"""
+    entries = list_checkpoints(client, base_image)
+    total = sum(e["size"] for e in entries)
+    removed = 0
+    while entries and (len(entries) > CHECKPOINT_MAX_IMAGES or total > CHECKPOINT_DISK_BUDGET):
+        victim = entries.pop(0)
+        try:
+            # Untagging is enough; a container still running from it keeps its layers until removed
+            client.images.remove(victim["ref"])
+        except docker.errors.APIError as e:
+            log.warning("checkpoint.gc_failed", ref=victim["ref"], error=str(e))
+            continue
+        total -= victim["size"]
+        removed += 1
+        with _lock:
+            _last_used.pop(victim["ref"].rpartition(":")[2], None)
+        log.info("checkpoint.evicted", ref=victim["ref"], size=victim["size"])
+    return removed
@@ -0,0 +1,88 @@
+# In container_readiness.py
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, Dict
+
+CONTAINER_READY_TIMEOUT = 30  # seconds
+
+def wait_for_running(client, container, since: int, timeout: float = CONTAINER_READY_TIMEOUT) -> None:
+    """
+    Block until the container is running, driven by the Docker events stream
+    rather than polling. `since` must be taken before the container was
+    started so a start event that races this call is replayed, not missed.
+    """
+    container.reload()
+    if container.status == "running":
+        return
+    if container.status in ("exited", "dead"):
+        raise Exception(f"Container exited with status: {container.status}")
+
+    events = client.events(
+        decode=True,
+        since=since,
+        filters={"type": "container", "container": container.id}
+    )
+    # events() blocks until the next event; closing the stream unblocks it
+    timer = threading.Timer(timeout, events.close)
+    timer.start()
+    try:
+        for event in events:
+            action = event.get("Action") or event.get("status")
+            if action == "start":
+                return
+            if action in ("die", "oom", "destroy"):
+                raise Exception(f"Container {action} before becoming ready")
+    except Exception:
+        if not timer.is_alive():
+            raise TimeoutError(f"Container failed to start within {timeout} seconds")
+        raise
+    finally:
+        timer.cancel()
+        events.close()
+
+    # The stream ended without a start event; it may have been closed by the timer
+    container.reload()
+    if container.status != "running":
+        raise TimeoutError(f"Container failed to start within {timeout} seconds")
+
+def probe(container) -> bool:
+    """Cheap readiness probe: a non-interactive exec that skips .bashrc and its hooks"""
+    try:
+        return container.exec_run(["true"]).exit_code == 0
+    except Exception:
+        return False
+
+def wait_until_ready(client, container, since: int, timeout: float = CONTAINER_READY_TIMEOUT) -> None:
+    """Wait for the running event, then for the exec probe to succeed, with backoff"""
+    deadline = time.monotonic() + timeout
+    wait_for_running(client, container, since, timeout)
+
+    delay = 0.05
+    while not probe(container):
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Container not responsive within {timeout} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+class ReadinessTracker:
+    """
+    One in-flight "container ready" future per user, so concurrent
+    /terminal/start calls share a single lookup/creation instead of racing.
+    """
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def pending(self, user_id: str) -> bool:
+        return user_id in self._pending
+
+    def start(self, user_id: str, start: Callable[[], Awaitable]) -> asyncio.Future:
+        """Return the user's in-flight future, starting it with start() if there is none"""
+        future = self._pending.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(start())
+            self._pending[user_id] = future
+            future.add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return future
+
+ready_containers = ReadinessTracker()
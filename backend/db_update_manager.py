@@ -1,21 +1,31 @@
-from typing import Dict, Set
+import asyncio
+from typing import Dict, Optional, Set, Tuple
 from fastapi import WebSocket
 import json
 from datetime import datetime, timezone
+from file_tree import tree_json
+from structured_logging import get_logger
+from tracing import run_in_executor
+
+log = get_logger("db_update_manager")
 
 class DBUpdateManager:
     def __init__(self):
         self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # Last tree revision delivered to each connection that opted into delta sync
+        self.synced_revisions: Dict[WebSocket, int] = {}
+        # One sync at a time per connection, so deltas built concurrently aren't sent out of order
+        self._sync_locks: Dict[WebSocket, asyncio.Lock] = {}
 
     async def connect(self, user_id: str, websocket: WebSocket):
-        """Register a new WebSocket connection for a user"""
-        if not isinstance(websocket, WebSocket):
-            raise ValueError("websocket parameter must be a WebSocket instance")
+        """Register a new WebSocket connection (or anything with send_text/close) for a user"""
+        if not (hasattr(websocket, "send_text") and hasattr(websocket, "close")):
+            raise ValueError("websocket parameter must provide send_text and close")
             
         if user_id not in self.active_connections:
             self.active_connections[user_id] = set()
         self.active_connections[user_id].add(websocket)
-        print(f"New WebSocket connection for user {user_id}")
+        log.debug("db_update.connect", user_id=user_id)
         return websocket
 
     async def disconnect(self, user_id: str, websocket: WebSocket = None):
@@ -24,17 +34,19 @@ class DBUpdateManager:
             return
             
         if websocket:
+            self.synced_revisions.pop(websocket, None)
+            self._sync_locks.pop(websocket, None)
             try:
                 await websocket.close()
                 self.active_connections[user_id].discard(websocket)
-                print(f"Closed WebSocket for user {user_id}")
+                log.debug("db_update.close", user_id=user_id)
             except Exception as e:
-                print(f"Error closing WebSocket: {e}")
+                log.debug("db_update.close_failed", user_id=user_id, error=str(e))
         
         # Clean up if no more connections for this user
         if not self.active_connections[user_id]:
             del self.active_connections[user_id]
-            print(f"No more active WebSocket connections for user {user_id}")
+            log.debug("db_update.user_idle", user_id=user_id)
 
     async def send_personal_message(self, message: str, user_id: str):
         """Send a message to all WebSocket connections for a user"""
@@ -46,7 +58,7 @@ class DBUpdateManager:
             try:
                 await connection.send_text(message)
             except Exception as e:
-                print(f"Error sending message to WebSocket: {e}")
+                log.warning("db_update.send_failed", user_id=user_id, error=str(e))
                 disconnected.add(connection)
         
         # Clean up disconnected sockets
@@ -55,14 +67,66 @@ class DBUpdateManager:
             
         return True
 
+    async def subscribe(self, user_id: str, websocket: WebSocket, db, revision: int):
+        """Bring a connection up to date from its last known revision and opt it into deltas"""
+        await self._send_sync(user_id, websocket, db, revision)
+
+    async def push_deltas(self, user_id: str, db):
+        """Stream the changes since each subscribed connection's last revision"""
+        for connection in list(self.active_connections.get(user_id, ())):
+            if connection not in self.synced_revisions:
+                continue
+            try:
+                await self._send_sync(user_id, connection, db)
+            except Exception as e:
+                log.warning("db_update.send_failed", user_id=user_id, error=str(e))
+                await self.disconnect(user_id, connection)
+
+    async def _send_sync(self, user_id: str, websocket: WebSocket, db, revision: Optional[int] = None):
+        """Send what websocket is missing since revision (default: the last one it was sent)"""
+        async with self._sync_locks.setdefault(websocket, asyncio.Lock()):
+            if revision is None:
+                revision = self.synced_revisions.get(websocket)
+                if revision is None:
+                    return
+            # The reads (a whole-tree snapshot, possibly a replica connect) stay off the event loop
+            update = await run_in_executor(self._build_sync, user_id, db, revision)
+            if update is not None:
+                revision, text = update
+                await websocket.send_text(text)
+            if websocket in self.active_connections.get(user_id, ()):
+                self.synced_revisions[websocket] = revision
+
+    @staticmethod
+    def _build_sync(user_id: str, db, revision: int) -> Optional[Tuple[int, str]]:
+        """(revision, message) bringing a client at revision up to date, or None if it already is"""
+        delta = db.get_changes_since(user_id, revision)
+        if delta is None:
+            # Too far behind (or ahead of a reset log): send the whole tree
+            current = db.get_tree_revision(user_id)
+            # Written straight from the row tuples: no dict per node, no generic encoder pass
+            return current, '{"type": "snapshot", "revision": %d, "tree": %s}' % (
+                current, tree_json(db.get_tree_rows(user_id))
+            )
+        if delta["revision"] == revision:
+            return None
+        return delta["revision"], json.dumps({
+            "type": "delta",
+            "from_revision": revision,
+            "revision": delta["revision"],
+            "changes": delta["changes"]
+        })
+
 # Create a global instance
 ws_manager = DBUpdateManager()
 
-async def notify_file_update(user_id: str, action: str, path: str):
+async def notify_file_update(user_id: str, action: str, path: str, db: Optional[object] = None):
     message = json.dumps({
         "type": "file_update",
         "action": action,
         "path": path,
         "timestamp": datetime.now(timezone.utc).isoformat()
     })
-    await ws_manager.send_personal_message(message, user_id)
\ No newline at end of file
+    await ws_manager.send_personal_message(message, user_id)
+    if db is not None:
+        await ws_manager.push_deltas(user_id, db)
\ No newline at end of file
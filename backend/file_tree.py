@@ -0,0 +1,92 @@
+# In file_tree.py
+from json.encoder import encode_basestring_ascii
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# A user's tree travels as flat row tuples, in the order NeonDB.get_tree_rows
+# returns them (directories first, then by name). build_tree nests them into
+# the dicts hydration walks; iter_tree_json writes the same nesting straight
+# to JSON text without building a dict per node.
+
+ROW_FIELDS = ("id", "parent_id", "name", "is_dir", "content", "created_at", "updated_at")
+TreeRow = Tuple[int, Optional[int], str, bool, Optional[str], object, object]
+
+JSON_CHUNK_PARTS = 2048  # string pieces per yielded chunk when streaming
+
+def _iso(value) -> Optional[str]:
+    # get_tree_rows already formats timestamps in SQL; other sources pass datetimes
+    if value is None or value.__class__ is str:
+        return value
+    return value.isoformat()
+
+def build_tree(rows: Iterable[TreeRow], root_parent: Optional[int] = None) -> List[Dict]:
+    """
+    Nest rows into node dicts with 'children' in one pass. Each id's children
+    list is created the first time the id is seen, as a node or as a parent,
+    so rows may arrive in any order; sibling order follows row order.
+    """
+    children: Dict[Optional[int], List[Dict]] = {}
+    for node_id, parent_id, name, is_dir, content, created_at, updated_at in rows:
+        own = children.get(node_id)
+        if own is None:
+            own = children[node_id] = []
+        siblings = children.get(parent_id)
+        if siblings is None:
+            siblings = children[parent_id] = []
+        siblings.append({
+            'id': node_id,
+            'parent_id': parent_id,
+            'name': name,
+            'is_dir': is_dir,
+            'content': content,
+            'created_at': _iso(created_at),
+            'updated_at': _iso(updated_at),
+            'children': own,
+        })
+    return children.get(root_parent, [])
+
+def _node_head(row: TreeRow, encode=encode_basestring_ascii) -> str:
+    node_id, parent_id, name, is_dir, content, created_at, updated_at = row
+    created_at, updated_at = _iso(created_at), _iso(updated_at)
+    # Same keys, order and separators as json.dumps(build_tree(rows)); ISO timestamps need no escaping
+    return '{"id": %d, "parent_id": %s, "name": %s, "is_dir": %s, "content": %s, ' \
+           '"created_at": %s, "updated_at": %s, "children": [' % (
+        node_id,
+        "null" if parent_id is None else parent_id,
+        encode(name),
+        "true" if is_dir else "false",
+        "null" if content is None else encode(content),
+        "null" if created_at is None else '"' + created_at + '"',
+        "null" if updated_at is None else '"' + updated_at + '"',
+    )
+
+def iter_tree_json(rows: Sequence[TreeRow], root_parent: Optional[int] = None) -> Iterator[str]:
+    """Yield the JSON array for the nested tree in chunks, depth first without recursion"""
+    by_parent: Dict[Optional[int], List[TreeRow]] = {}
+    for row in rows:
+        siblings = by_parent.get(row[1])
+        if siblings is None:
+            siblings = by_parent[row[1]] = []
+        siblings.append(row)
+
+    parts = ["["]
+    stack = [iter(by_parent.get(root_parent, ()))]
+    first = True
+    while stack:
+        row = next(stack[-1], None)
+        if row is None:
+            stack.pop()
+            parts.append("]}" if stack else "]")
+            first = False
+            continue
+        if not first:
+            parts.append(", ")
+        parts.append(_node_head(row))
+        stack.append(iter(by_parent.get(row[0], ())))
+        first = True
+        if len(parts) >= JSON_CHUNK_PARTS:
+            yield "".join(parts)
+            parts.clear()
+    yield "".join(parts)
+
+def tree_json(rows: Sequence[TreeRow], root_parent: Optional[int] = None) -> str:
+    return "".join(iter_tree_json(rows, root_parent))
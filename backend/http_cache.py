@@ -0,0 +1,74 @@
+# In http_cache.py
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, Optional
+
+from metrics import FILE_CACHE_REQUESTS
+
+# Conditional GETs for NeonDB-backed reads. A file's ETag comes from its id
+# and updated_at, a tree's from the user's tree revision, so both can be
+# checked with a tiny query before any content is read. The revision is
+# bumped by triggers on fs_nodes, so writes that bypass the backend (the
+# frontend's API routes) invalidate tree ETags too. Contents are cached
+# keyed by (user_id, file_id, updated_at): a write changes the key, so stale
+# entries are never served and simply age out.
+
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+FILE_CACHE_MAX_ENTRIES = int(os.getenv("FILE_CACHE_MAX_ENTRIES", "10000"))
+FILE_CACHE_MAX_ITEM = FILE_CACHE_MAX_BYTES // 8   # larger files are read through uncached
+
+def file_etag(file_id: int, updated_at: datetime) -> str:
+    return f'"f{file_id}-{int(updated_at.timestamp() * 1_000_000)}"'
+
+def tree_etag(revision: int) -> str:
+    return f'"t{revision}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+class ContentCache:
+    """LRU of file contents bounded by entry count and total characters; safe across executor threads"""
+    def __init__(self, max_bytes: int = FILE_CACHE_MAX_BYTES, max_entries: int = FILE_CACHE_MAX_ENTRIES,
+                 max_item: int = FILE_CACHE_MAX_ITEM):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_item = max_item
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                FILE_CACHE_REQUESTS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+        FILE_CACHE_REQUESTS.labels("hit").inc()
+        return content
+
+    def put(self, key: Hashable, content: Optional[str]) -> None:
+        if content is None or len(content) > self.max_item:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+file_cache = ContentCache()
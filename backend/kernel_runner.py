@@ -0,0 +1,335 @@
+# In kernel_runner.py
+import asyncio
+import json
+import os
+import posixpath
+import struct
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from metrics import KERNEL_RUN, KERNEL_STARTS
+from session_supervisor import _make_nonblocking
+from structured_logging import get_logger
+
+log = get_logger("kernel_runner")
+
+# Each container gets one warm IPython kernel, started lazily the first time
+# code is run. A small bridge script runs inside the container as a plain
+# (non-tty) exec: it owns the kernel through jupyter_client and speaks JSON
+# lines over the exec's stdin/stdout, so no kernel ports leave the container.
+#
+#   backend -> bridge   {"op": "execute", "id", "code"} | {"op": "interrupt"}
+#   bridge -> backend   {"type": "ready"} | {"type": "restarted", "reason"}
+#                       {"id", "type": "stream", "name", "text"}
+#                       {"id", "type": "display" | "result", "data": {mime: value}}
+#                       {"id", "type": "error", "ename", "evalue", "traceback"}
+#                       {"id", "type": "clear"} | {"id", "type": "done", "status", "elapsed"}
+#
+# Closing the exec's socket closes the bridge's stdin, which shuts the kernel down.
+
+KERNEL_START_TIMEOUT = 60.0         # seconds for the bridge to report a ready kernel
+KERNEL_RUN_TIMEOUT = float(os.getenv("KERNEL_RUN_TIMEOUT", "300"))  # seconds before a run is interrupted
+INTERRUPT_GRACE = 5.0               # seconds an interrupted run gets before the kernel is discarded
+KERNEL_IDLE_TTL = 30 * 60           # seconds an unused kernel is kept warm
+REAP_INTERVAL = 60
+READ_SIZE = 65536
+STDERR_LINES = 20                   # bridge stderr kept for start-up errors
+# Imported once when the kernel starts, so runs find them in sys.modules
+KERNEL_PRELOAD = os.getenv("KERNEL_PRELOAD", "import numpy, pandas, matplotlib.pyplot\ndel numpy, pandas, matplotlib")
+
+BRIDGE = r'''
+import json, os, queue, sys, threading, time
+from jupyter_client.manager import KernelManager
+
+lock = threading.Lock()
+jobs = queue.Queue()
+
+def emit(**msg):
+    line = json.dumps(msg, default=str) + "\n"
+    with lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+def start():
+    km = KernelManager(kernel_name="python3")
+    km.start_kernel(cwd="/workspace")
+    kc = km.client()
+    kc.start_channels()
+    kc.wait_for_ready(timeout=60)
+    preload = os.environ.get("KERNEL_PRELOAD")
+    if preload:
+        kc.execute_interactive(preload, silent=True, store_history=False, timeout=120)
+    return km, kc
+
+def execute(km, kc, run_id, code):
+    msg_id = kc.execute(code, allow_stdin=False)
+    status = "ok"
+    while True:
+        try:
+            msg = kc.get_iopub_msg(timeout=1)
+        except queue.Empty:
+            if not km.is_alive():
+                return "died"
+            continue
+        if msg["parent_header"].get("msg_id") != msg_id:
+            continue
+        kind, content = msg["msg_type"], msg["content"]
+        if kind == "stream":
+            emit(id=run_id, type="stream", name=content["name"], text=content["text"])
+        elif kind in ("display_data", "update_display_data", "execute_result"):
+            emit(id=run_id, type="result" if kind == "execute_result" else "display", data=content["data"])
+        elif kind == "error":
+            status = "error"
+            emit(id=run_id, type="error", ename=content["ename"], evalue=content["evalue"],
+                 traceback=content["traceback"])
+        elif kind == "clear_output":
+            emit(id=run_id, type="clear")
+        elif kind == "status" and content["execution_state"] == "idle":
+            return status
+
+def worker(state):
+    while True:
+        job = jobs.get()
+        started = time.perf_counter()
+        status = execute(state["km"], state["kc"], job["id"], job["code"])
+        if status == "died":
+            state["kc"].stop_channels()
+            state["km"].shutdown_kernel(now=True)
+            state["km"], state["kc"] = start()
+            emit(type="restarted", reason="died")
+        emit(id=job["id"], type="done", status=status, elapsed=round(time.perf_counter() - started, 4))
+
+state = dict(zip(("km", "kc"), start()))
+emit(type="ready")
+threading.Thread(target=worker, args=(state,), daemon=True).start()
+for line in sys.stdin:
+    request = json.loads(line)
+    if request["op"] == "execute":
+        jobs.put(request)
+    elif request["op"] == "interrupt":
+        state["km"].interrupt_kernel()
+state["km"].shutdown_kernel(now=True)
+'''
+
+_FRAME = struct.Struct(">BxxxI")  # docker's stdout/stderr multiplexing header for non-tty execs
+STDOUT, STDERR = 1, 2
+
+def run_request_code(message: Dict, base_path: str = "/workspace") -> str:
+    """The code a run request asks for: a cell's source, or %run of a workspace file"""
+    if isinstance(message.get("code"), str):
+        return message["code"]
+    path = message.get("path")
+    if not isinstance(path, str) or not path:
+        raise ValueError("run needs 'code' or 'path'")
+    full = posixpath.normpath(posixpath.join(base_path, path))
+    if not full.startswith(base_path + "/"):
+        raise ValueError("path must be inside the workspace")
+    # Like `python <path>`: a fresh __main__ namespace, but on the warm interpreter
+    return f"%run {json.dumps(full)}"
+
+def start_kernel_exec(client, container_id: str):
+    """Create and start the bridge exec, returning (exec_id, socket)"""
+    exec_config = client.api.exec_create(
+        container_id,
+        ["python3", "-u", "-c", BRIDGE],
+        stdin=True,
+        stdout=True,
+        stderr=True,
+        tty=False,
+        workdir="/workspace",
+        environment={"HOME": "/root", "KERNEL_PRELOAD": KERNEL_PRELOAD},
+    )
+    exec_id = exec_config["Id"]
+    sock = client.api.exec_start(exec_id, socket=True, tty=False)
+    return exec_id, sock
+
+class KernelSession:
+    """The bridge exec for one container and the runs waiting on its output"""
+    def __init__(self, container_id: str, exec_id: str, sock, stop: Callable):
+        self.container_id = container_id
+        self.exec_id = exec_id
+        self.sock = sock
+        self.last_used = time.monotonic()
+        self.ready = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.stderr: deque = deque(maxlen=STDERR_LINES)
+        self._stop = stop
+        self._runs: Dict[str, asyncio.Queue] = {}
+        self._run_lock = asyncio.Lock()  # one execution at a time, as in a notebook
+        self._nonblocking = _make_nonblocking(sock._sock)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        loop = asyncio.get_running_loop()
+        raw = self.sock._sock
+        buffer = bytearray()
+        lines = {STDOUT: bytearray(), STDERR: bytearray()}
+        try:
+            while True:
+                if self._nonblocking:
+                    data = await loop.sock_recv(raw, READ_SIZE)
+                else:
+                    data = await loop.run_in_executor(None, raw.recv, READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                while len(buffer) >= _FRAME.size:
+                    stream, size = _FRAME.unpack_from(buffer)
+                    if len(buffer) < _FRAME.size + size:
+                        break
+                    pending = lines.setdefault(stream, bytearray())
+                    pending += buffer[_FRAME.size:_FRAME.size + size]
+                    del buffer[:_FRAME.size + size]
+                    *complete, rest = pending.split(b"\n")
+                    pending[:] = rest
+                    for line in complete:
+                        self._handle_line(stream, line)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("kernel.read_failed", container_id=self.container_id, error=str(e))
+        finally:
+            self._finish()
+
+    def _handle_line(self, stream: int, line: bytes) -> None:
+        if stream != STDOUT:
+            self.stderr.append(line.decode("utf-8", "replace"))
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        run = self._runs.get(message.get("id"))
+        if run is not None:
+            run.put_nowait(message)
+        elif message.get("type") == "ready":
+            self.ready.set()
+        elif message.get("type") == "restarted":
+            KERNEL_STARTS.labels("crash").inc()
+            log.warning("kernel.restarted", container_id=self.container_id, reason=message.get("reason"))
+
+    def _finish(self) -> None:
+        self.closed.set()
+        for run in self._runs.values():
+            run.put_nowait({"type": "done", "status": "died"})
+
+    async def _send(self, message: Dict) -> None:
+        loop = asyncio.get_running_loop()
+        data = json.dumps(message).encode() + b"\n"
+        if self._nonblocking:
+            await loop.sock_sendall(self.sock._sock, data)
+        else:
+            await loop.run_in_executor(None, self.sock._sock.sendall, data)
+
+    async def interrupt(self) -> None:
+        if not self.closed.is_set():
+            await self._send({"op": "interrupt"})
+
+    async def run(self, code: str, timeout: float = KERNEL_RUN_TIMEOUT) -> AsyncIterator[Dict]:
+        """Execute code and yield its output messages, ending with one of type 'done'"""
+        async with self._run_lock:
+            run_id = uuid.uuid4().hex
+            queue: asyncio.Queue = asyncio.Queue()
+            self._runs[run_id] = queue
+            self.last_used = time.monotonic()
+            start = time.perf_counter()
+            status = "died"
+            try:
+                if self.closed.is_set():
+                    yield {"id": run_id, "type": "done", "status": status, "elapsed": 0.0}
+                    return
+                await self._send({"op": "execute", "id": run_id, "code": code})
+                interrupted = False
+                while True:
+                    try:
+                        message = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        if not interrupted:
+                            log.warning("kernel.run_timeout", container_id=self.container_id, seconds=timeout)
+                            await self.interrupt()
+                            interrupted, timeout = True, INTERRUPT_GRACE
+                            continue
+                        # The kernel ignored the interrupt; drop it and start fresh next time
+                        await self.close()
+                        status = "timeout"
+                        yield {"id": run_id, "type": "done", "status": status,
+                               "elapsed": round(time.perf_counter() - start, 4)}
+                        return
+                    message["id"] = run_id
+                    if message["type"] == "done":
+                        status = message["status"]
+                        message.setdefault("elapsed", round(time.perf_counter() - start, 4))
+                    yield message
+                    if message["type"] == "done":
+                        return
+            finally:
+                self._runs.pop(run_id, None)
+                self.last_used = time.monotonic()
+                KERNEL_RUN.labels(status).observe(time.perf_counter() - start)
+
+    async def close(self) -> None:
+        if not self.closed.is_set():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._stop, self.exec_id, self.sock)
+        self._reader.cancel()
+        self._finish()
+
+class KernelPool:
+    """Warm kernels keyed by container id"""
+    def __init__(self):
+        self.kernels: Dict[str, KernelSession] = {}
+        self._start_locks: Dict[str, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def warm(self, container_id: str) -> bool:
+        kernel = self.kernels.get(container_id)
+        return kernel is not None and not kernel.closed.is_set()
+
+    async def get_or_start(self, container_id: str, start: Callable, stop: Callable) -> KernelSession:
+        """Return the container's kernel, starting the bridge with start(container_id) if needed"""
+        async with self._start_locks.setdefault(container_id, asyncio.Lock()):
+            kernel = self.kernels.get(container_id)
+            if kernel is not None and not kernel.closed.is_set():
+                return kernel
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            exec_id, sock = await loop.run_in_executor(None, start, container_id)
+            kernel = KernelSession(container_id, exec_id, sock, stop)
+            ready = asyncio.create_task(kernel.ready.wait())
+            closed = asyncio.create_task(kernel.closed.wait())
+            await asyncio.wait({ready, closed}, timeout=KERNEL_START_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            ready.cancel()
+            closed.cancel()
+            if not kernel.ready.is_set():
+                await kernel.close()
+                detail = "; ".join(kernel.stderr) or "timed out"
+                raise RuntimeError(f"Kernel failed to start: {detail}")
+            self.kernels[container_id] = kernel
+            KERNEL_STARTS.labels("cold").inc()
+            log.info("kernel.started", container_id=container_id,
+                     seconds=round(time.perf_counter() - started, 3))
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle())
+        return kernel
+
+    async def close(self, container_id: str) -> None:
+        kernel = self.kernels.pop(container_id, None)
+        self._start_locks.pop(container_id, None)
+        if kernel is not None:
+            await kernel.close()
+
+    async def _reap_idle(self):
+        while self.kernels:
+            await asyncio.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            for container_id, kernel in list(self.kernels.items()):
+                if kernel.closed.is_set():
+                    await self.close(container_id)
+                elif not kernel._run_lock.locked() and now - kernel.last_used > KERNEL_IDLE_TTL:
+                    log.info("kernel.reaped", container_id=container_id)
+                    await self.close(container_id)
+
+kernels = KernelPool()
@@ -0,0 +1,179 @@
+# In loop_watchdog.py
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from metrics import LOOP_LAG, LOOP_STALLS
+from structured_logging import get_logger
+
+log = get_logger("loop_watchdog")
+
+# A heartbeat task on the event loop measures how late each wake-up is. A
+# watchdog thread notices when the heartbeat stops and grabs the loop
+# thread's stack while the blocking call is still on it, which is the only
+# moment the culprit is visible.
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))        # heartbeat period (s)
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))  # lag reported as a stall (s)
+MAX_RECENT_STALLS = 50
+MAX_STACK_FRAMES = 40
+MAX_PROFILE_SECONDS = 60.0
+MIN_PROFILE_INTERVAL = 0.001
+
+def _task_name(loop: asyncio.AbstractEventLoop) -> Optional[str]:
+    task = asyncio.current_task(loop)
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+class LoopWatchdog:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls: Deque[Dict] = deque(maxlen=MAX_RECENT_STALLS)
+        self._beat = 0.0
+        self._pending: Optional[Dict] = None   # stall seen by the watchdog, awaiting its duration
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Call from the loop's own thread"""
+        if self._heartbeat is not None:
+            return
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = loop.create_task(self._run_heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        log.info("loop_watchdog.started", interval=self.interval, threshold=self.threshold)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            previous, self._beat = self._beat, now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self._finish_stall(lag, previous)
+
+    def _watch(self) -> None:
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(poll):
+            beat = self._beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue < self.threshold or (self._pending is not None and self._pending["beat"] == beat):
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = traceback.format_stack(frame, limit=MAX_STACK_FRAMES) if frame is not None else []
+            self._pending = {
+                "beat": beat,
+                "at": datetime.now(timezone.utc).isoformat(),
+                "task": _task_name(self.loop),
+                "stack": [line.rstrip() for line in stack],
+            }
+
+    def _finish_stall(self, lag: float, beat: float) -> None:
+        pending, self._pending = self._pending, None
+        if pending is not None and pending["beat"] != beat:
+            pending = None  # left over from an earlier stall
+        stall = {
+            "at": pending["at"] if pending else datetime.now(timezone.utc).isoformat(),
+            "lag_ms": round(lag * 1000, 1),
+            # A stall shorter than the watchdog's poll can end before its stack is taken
+            "task": pending["task"] if pending else None,
+            "stack": pending["stack"] if pending else [],
+        }
+        self.stalls.append(stall)
+        LOOP_STALLS.inc()
+        log.warning("loop.stall", lag_ms=stall["lag_ms"], task=stall["task"],
+                    where=stall["stack"][-1].strip() if stall["stack"] else None)
+
+    def status(self) -> Dict:
+        return {
+            "running": self._heartbeat is not None,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": list(self.stalls),
+        }
+
+class SamplingProfiler:
+    """
+    Samples thread stacks from a background thread via sys._current_frames:
+    nothing is installed in the profiled threads, so the cost is one stack
+    walk per sampled thread per interval. One profile runs at a time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _collapse(self, frame) -> List[str]:
+        names = []
+        while frame is not None:
+            names.append(self._label(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float, thread_ids: Optional[List[int]] = None) -> str:
+        """
+        Sample for seconds and return collapsed stacks ('thread;outer;...;inner count'
+        per line), the input format of flamegraph.pl and speedscope
+        """
+        seconds = min(max(seconds, interval), MAX_PROFILE_SECONDS)
+        interval = max(interval, MIN_PROFILE_INTERVAL)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            me = threading.get_ident()
+            counts: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me or (thread_ids is not None and ident not in thread_ids):
+                        continue
+                    stack = [names.get(ident, str(ident))] + self._collapse(frame)
+                    counts[";".join(stack)] += 1
+                samples += 1
+                time.sleep(interval)
+            log.info("profile.finished", seconds=round(seconds, 2), samples=samples, stacks=len(counts))
+            return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+        finally:
+            self._lock.release()
+
+watchdog = LoopWatchdog()
+profiler = SamplingProfiler()
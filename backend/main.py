@@ -1,16 +1,55 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from datetime import datetime, timezone
 import docker
-import uuid, asyncio, json, traceback
+import uuid, asyncio, json
+import hmac
 import os
+import functools
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 import tarfile
-from io import BytesIO
+import tempfile
+import zipfile
 from user_file_system import FileSystemManager
-from postgres import NeonDB
+from postgres import NeonDB, QuotaExceeded
 from pydantic import BaseModel
 import shlex
 from db_update_manager import ws_manager, notify_file_update
+from terminal_mux import MuxConnection
+from session_supervisor import supervisor
+import session_recorder
+from container_readiness import ready_containers, wait_until_ready
+from admission import AdmissionController
+from workspace_sync import (
+    VolumeSyncer, volumes_enabled, ensure_volume, remove_volume, volume_mounts, start_sync, stop_sync,
+)
+from metrics import (
+    TERMINAL_START_PHASE, UPDATE_FILE_STEP, FS_EVENT_LATENCY,
+    register_runtime_collector
+)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from tracing import instrument_docker_client, run_in_executor, set_correlation, span
+from structured_logging import get_logger
+from search import fuzzy_ranges, line_matches
+from file_tree import iter_tree_json
+from http_cache import etag_matches, file_cache, file_etag, tree_etag
+from loop_watchdog import profiler, watchdog
+from resource_monitor import ResourceMonitor
+from rate_limit import RateLimiter, limits_from_env, shared_limits_enabled
+from tar_stream import TarStream, read_utf8
+from kernel_runner import kernels, run_request_code, start_kernel_exec
+from checkpoints import (
+    REVISION_LABEL, checkpoint_and_remove, checkpoints_enabled, delete_checkpoint, find_checkpoint,
+    is_current, list_checkpoints, retire_in_background, retiring,
+)
+from project_archive import (
+    ARCHIVE_FORMATS, IMPORT_SPOOL_BYTES, MAX_IMPORT_ARCHIVE_BYTES, ImportLimitExceeded,
+    ProjectImporter, export_archive
+)
 import platform
 
 class FSEvent(BaseModel):
@@ -23,8 +62,17 @@ class FileUpdate(BaseModel):
     userId: str
     filePath: str = ""
 
+log = get_logger("main")
+
 app = FastAPI()
 client = docker.from_env()
+instrument_docker_client(client)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root span per HTTP request; Docker, NeonDB and hydration spans nest under it"""
+    with span(f"{request.method} {request.url.path}", **{"http.method": request.method}):
+        return await call_next(request)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +85,40 @@ app.add_middleware(
 )
 
 neon_db = NeonDB()
+# Primary only, for reads that decide what to write or whether to hydrate: a lagging
+# replica (or a write from another process, which doesn't pin) would mislead them
+primary_db = NeonDB(replica_dsns=())
+register_runtime_collector(supervisor, ws_manager)
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    watchdog.start(asyncio.get_running_loop())
+    resource_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    watchdog.stop()
+    resource_monitor.stop()
+
+CONTAINER_IMAGE = "ehcaw/lsclear:latest"
+CONTAINER_MEM_LIMIT = "1g"
+CONTAINER_MEM_BYTES = 1024 ** 3
+CONTAINER_CPU_QUOTA = 50000  # half a CPU per 100ms period; the resource monitor may raise it
+# How many container creations/starts may hit the Docker daemon at once
+CONTAINER_CREATE_CONCURRENCY = int(os.getenv("CONTAINER_CREATE_CONCURRENCY", "4"))
+# Total container memory limits allowed, as a multiple of host memory
+HOST_MEMORY_OVERCOMMIT = float(os.getenv("HOST_MEMORY_OVERCOMMIT", "1.5"))
+# /terminal/start answers 202 with a queue position if not admitted by then
+QUEUED_RESPONSE_AFTER = 1.0
+SEARCH_MAX_LIMIT = 200
+FILE_UPLOAD_SPOOL_BYTES = 1024 * 1024         # raw saves beyond this spill to a temp file
+MAX_FILE_UPLOAD_BYTES = 100 * 1024 * 1024
+# /admin endpoints answer 404 unless this is set and sent as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+resource_monitor = ResourceMonitor(client, CONTAINER_CPU_QUOTA, CONTAINER_MEM_BYTES, HOST_MEMORY_OVERCOMMIT)
+# Shared buckets get their own connection so limiter round trips don't queue behind neon_db
+rate_limiter = RateLimiter(limits_from_env(), NeonDB(replica_dsns=()) if shared_limits_enabled() else None)
 
 session_containers = {}
 user_containers = {}  # Maps user_id to container_id
@@ -52,6 +134,79 @@ def bash(c, cmd):
 async def test():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+async def enforce_rate_limit(user_id: str, endpoint: str) -> None:
+    """Answer 429 with a Retry-After once user_id has used up endpoint's token bucket"""
+    retry_after = await rate_limiter.check(user_id, endpoint)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+def require_admin(request: Request) -> None:
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/admin/loop")
+async def loop_status(request: Request):
+    """Event-loop lag and the most recent stalls, each with the loop thread's stack at the time"""
+    require_admin(request)
+    return watchdog.status()
+
+@app.get("/admin/profile")
+async def sample_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0, threads: str = "loop"):
+    """
+    Sample stacks for seconds and return them collapsed, one 'frame;frame;... count'
+    line per stack, for flamegraph.pl or speedscope. threads=all includes executor threads.
+    """
+    require_admin(request)
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be 'loop' or 'all'")
+    if profiler.busy():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    thread_ids = [watchdog.loop_thread_id or threading.get_ident()] if threads == "loop" else None
+    try:
+        # The sampler runs on its own thread, so it keeps sampling while the loop is blocked
+        collapsed = await run_in_executor(profiler.sample, seconds, interval_ms / 1000, thread_ids)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed)
+
+@app.get("/admin/resources")
+async def resource_usage(request: Request):
+    """Rolling CPU, memory and IO use of every managed container, grouped by user"""
+    require_admin(request)
+    return resource_monitor.summary()
+
+@app.get("/admin/checkpoints")
+async def checkpoint_list(request: Request):
+    """Workspace checkpoint images, least recently used first, with their size above the base image"""
+    require_admin(request)
+    return await run_in_executor(list_checkpoints, client, CONTAINER_IMAGE)
+
+@app.delete("/api/checkpoints/{user_id}")
+async def checkpoint_delete(user_id: str):
+    """Drop the user's checkpoint so their next container starts from the clean image"""
+    return {"deleted": await run_in_executor(delete_checkpoint, client, user_id)}
+
+@app.get("/api/resources/{user_id}")
+async def user_resource_usage(user_id: str):
+    """Rolling CPU, memory and IO use of the user's containers"""
+    return {"user_id": user_id, "containers": resource_monitor.user_summary(user_id)}
+
+@app.get("/api/storage/{user_id}")
+async def user_storage_usage(user_id: str):
+    """Bytes and files/directories the user stores in fs_nodes, against their quotas"""
+    set_correlation(user_id=user_id)
+    neon_db.ensure_connection()
+    return dict(await run_in_executor(neon_db.get_usage, user_id), user_id=user_id)
+
 def get_platform_specific_image(base_image: str) -> str:
     """Return the appropriate image tag based on the system architecture"""
     machine = platform.machine().lower()
@@ -75,91 +230,124 @@ def cleanup_old_containers():
         # Find containers not associated with any active user
         active_container_ids = set(user_containers.values())
         for container in containers:
+            # A container still being created or started isn't in user_containers yet,
+            # and one being checkpointed is already on its way out
+            user_id = container.labels.get("user_id")
+            if user_id and (ready_containers.pending(user_id) or retiring(user_id)):
+                continue
             if container.id not in active_container_ids:
                 try:
-                    print(f"Cleaning up unused container {container.id}")
-                    container.remove(force=True)
+                    log.info("container.cleanup_unused", container_id=container.id)
+                    if checkpoints_enabled() and user_id:
+                        # docker commit takes seconds; don't hold up the /terminal/start that ran this
+                        retire_in_background(user_id, functools.partial(retire_container, container, user_id))
+                    else:
+                        container.remove(force=True)
                 except Exception as e:
-                    print(f"Error cleaning up container {container.id}: {e}")
+                    log.warning("container.cleanup_failed", container_id=container.id, error=str(e))
+    except Exception:
+        log.exception("container.cleanup_old_failed")
+
+def retire_container(container, user_id: Optional[str]) -> None:
+    """Remove a user's container, committing it as their checkpoint first when checkpoints are on"""
+    if not checkpoints_enabled() or not user_id:
+        container.remove(force=True)
+        return
+    try:
+        primary_db.ensure_connection()
+        revision = primary_db.get_tree_revision(user_id)
     except Exception as e:
-        print(f"Error in cleanup_old_containers: {e}")
+        log.warning("checkpoint.revision_failed", user_id=user_id, error=str(e))
+        revision = -1  # never current, so the restored container is hydrated
+    checkpoint_and_remove(client, container, user_id, revision, CONTAINER_IMAGE)
+
+def find_running_container(user_id: str):
+    """Return the user's running container, if any, without touching stopped ones"""
+    containers = client.containers.list(
+        filters={"label": [f"user_id={user_id}", "managed_by=terminal"], "status": "running"}
+    )
+    return containers[0] if containers else None
+
+def host_has_capacity(in_flight: int) -> bool:
+    """Whether the host has memory for one more container, counting in-flight creations"""
+    total = client.info().get("MemTotal", 0)
+    if not total:
+        return True
+    running = client.containers.list(filters={"label": ["managed_by=terminal"], "status": "running"})
+    # Limits the resource monitor raised count at their current size
+    needed = resource_monitor.memory_committed(c.id for c in running) + (in_flight + 1) * CONTAINER_MEM_BYTES
+    return needed <= total * HOST_MEMORY_OVERCOMMIT
+
+admission = AdmissionController(CONTAINER_CREATE_CONCURRENCY, host_has_capacity)
+
+def get_or_create_container(user_id: str, timings: Optional[Dict[str, float]] = None):
+    """Get existing container for user or create a new one, recording phase timings"""
+    if timings is None:
+        timings = {}
+    phase_start = time.perf_counter()
+
+    def mark(phase: str):
+        nonlocal phase_start
+        now = time.perf_counter()
+        timings[phase] = round(now - phase_start, 4)
+        phase_start = now
 
-def get_or_create_container(user_id: str):
-    """Get existing container for user or create a new one"""
     # Try to find existing container for this user
     try:
         containers = client.containers.list(
             all=True,
             filters={"label": [f"user_id={user_id}", "managed_by=terminal"]}
         )
+        mark("lookup")
 
         # If container exists and is running, return it
-        import time
         if containers:
             container = containers[0]
             if container.status != 'running':
-                print(f"Container {container.id} is {container.status}, attempting to start...")
+                log.info("container.starting", container_id=container.id, status=container.status)
                 try:
+                    since = int(time.time())
                     container.start()
-                    # Wait longer for container to start and verify it's actually running
-                    max_attempts = 30  # Increased from 10 to 30 seconds
-                    for attempt in range(max_attempts):
-                        container.reload()
-                        if container.status == "running":
-                            # Verify container is actually responsive
-                            try:
-                                exit_code, output = bash(container, "echo test")
-                                if exit_code == 0:
-                                    print(f"Container {container.id} is now running and responsive")
-                                    break
-                                else:
-                                    print(f"Container {container.id} is running but not responsive (attempt {attempt + 1}/{max_attempts}). Error: {output}")
-                            except Exception as e:
-                                print(f"Error checking container responsiveness: {e}")
-                        else:
-                            print(f"Container {container.id} status: {container.status} (attempt {attempt + 1}/{max_attempts})")
-                        # If container exited, check logs
-                        if container.status == "exited":
-                            logs = container.logs().decode('utf-8')
-                            print(f"Container {container.id} exited with logs:\n{logs}")
-                            raise Exception(f"Container exited with status: {container.status}")
-
-                        time.sleep(1)
-                    else:
-                        # If we get here, container didn't start in time
-                        logs = container.logs().decode('utf-8')
-                        print(f"Container {container.id} failed to start. Logs:\n{logs}")
-                        container.remove(force=True)
-                        raise Exception(f"Container failed to start within 30 seconds")
+                    wait_until_ready(client, container, since)
+                    mark("start")
+                    log.info("container.ready", container_id=container.id)
                 except Exception as e:
-                    print(f"Error starting container {container.id}: {e}")
+                    log.error("container.start_failed", container_id=container.id, error=str(e))
+                    try:
+                        logs = container.logs().decode('utf-8')
+                        log.info("container.logs", container_id=container.id, logs=logs)
+                    except Exception:
+                        pass
                     container.remove(force=True)
                     raise
-            print(f"Reusing existing container {container.id} for user {user_id}")
+            log.info("container.reuse", container_id=container.id, user_id=user_id)
             return container
     except Exception as e:
-        print(f"Error finding existing container: {e}")
+        log.warning("container.lookup_failed", user_id=user_id, error=str(e))
         if 'containers' in locals() and containers is not None:
             try:
                 containers[0].remove(force=True)
             except:
                 pass
 
-    # Make a new container
+    # Make a new container, from the user's checkpoint when there is one
+    checkpoint = find_checkpoint(client, user_id) if checkpoints_enabled() else None
     try:
         image_name = get_platform_specific_image("ehcaw/lsclear")
+        since = int(time.time())
         container = client.containers.run(
             # image_name,
-            "ehcaw/lsclear:latest",
+            checkpoint or CONTAINER_IMAGE,
             # platform="linux/amd64" if "amd64" in image_name else "linux/arm64",
             command=["tail", "-f", "/dev/null"],  # Keep container running
             tty=True,
             detach=True,
             working_dir="/workspace",
             network_disabled=False,
-            mem_limit="1g",
-            cpu_quota=50000,
+            mem_limit=CONTAINER_MEM_LIMIT,
+            cpu_quota=CONTAINER_CPU_QUOTA,
             labels={"user_id": user_id, "managed_by": "terminal"},
+            volumes=volume_mounts(user_id),
             name=f"terminal-{user_id}",
             remove=False,
             restart_policy={"Name": "on-failure", "MaximumRetryCount": 3},
@@ -171,27 +359,18 @@ def get_or_create_container(user_id: str):
             },
 
         )
+        mark("restore" if checkpoint else "create")
 
-        # Wait a moment for the container to start
-        for attempt in range(30):
-            container.reload()
-            if container.status == "running":
-                # Verify container is actually responsive
-                try:
-                    exit_code, output = bash(container, "echo test")
-                    if exit_code == 0:
-                        print(f"Container {container.id} is now running and responsive")
-                        break
-                    else:
-                        print(f"Container {container.id} is running but not responsive (attempt {attempt + 1}))")
-                except Exception as e:
-                    print(f"Error checking container responsiveness: {e}")
-            else:
-                print(f"Container {container.id} status: {container.status} (attempt {attempt + 1})")
-        if container.status != 'running':
-            raise Exception(f"Container failed to start. Status: {container.status}")
+        # Wait for the start event and a successful probe exec
+        wait_until_ready(client, container, since)
+        mark("ready")
+        log.info("container.ready", container_id=container.id)
 
-        print(f"Successfully created container {container.id} for user {user_id}")
+        if checkpoint:
+            # .bashrc and everything the user installed are already in the image
+            log.info("container.restored", container_id=container.id, user_id=user_id, image=checkpoint)
+            return container
+        log.info("container.created", container_id=container.id, user_id=user_id)
 
         try:
             # Set a simple prompt
@@ -224,19 +403,23 @@ def get_or_create_container(user_id: str):
             '''
             ], tty=True)
             container.exec_run("source ~/.bashrc", tty=True)
+            mark("bashrc")
             return container
         except Exception as e:
-            print(f"Warning: Failed to set up bashrc: {e}")
+            log.warning("container.bashrc_failed", container_id=container.id, error=str(e))
             return container
 
-    except Exception as e:
-        print(f"Error creating container: {e}")
+    except Exception:
+        log.exception("container.create_failed", user_id=user_id, checkpoint=checkpoint)
         # Clean up any partially created container
         if 'container' in locals():
             try:
                 container.remove(force=True)
             except:
                 pass
+        if checkpoint:
+            # Don't retry a broken checkpoint; the next start is cold
+            delete_checkpoint(client, user_id)
         raise
 
 @app.post("/terminal/start")
@@ -245,19 +428,47 @@ async def create_session(user_data: dict):
     user_id = user_data.get('user_id')
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
+    set_correlation(user_id=user_id)
 
     try:
-        # Clean up any old containers first
-        cleanup_old_containers()
-
-        # Get or create container for this user
-        container = get_or_create_container(user_id)
-
-        # Track this user's container
-        user_containers[user_id] = container.id
+        # Concurrent starts for the same user share one lookup/creation
+        async def start_container():
+            timings = {}
+            # Clean up any old containers first
+            await run_in_executor(cleanup_old_containers)
+            retirement = retiring(user_id)
+            if retirement is not None:
+                # Let the user's previous container finish checkpointing, so the new one starts from it
+                await asyncio.gather(asyncio.wrap_future(retirement), return_exceptions=True)
+            new_volume = False
+            if volumes_enabled():
+                new_volume = await run_in_executor(ensure_volume, client, user_id)
+            container = await run_in_executor(find_running_container, user_id)
+            if container is None:
+                # Creating or restarting a container goes through the admission queue
+                admission.enqueue(user_id)
+                try:
+                    await admission.wait_admitted(user_id)
+                    container = await run_in_executor(get_or_create_container, user_id, timings)
+                finally:
+                    admission.release(user_id)
+            # Track this user's container before the start stops counting as pending,
+            # even if the request that queued it has already returned 202
+            user_containers[user_id] = container.id
+            return container, timings, new_volume
+
+        future = ready_containers.start(user_id, start_container)
+        done, _ = await asyncio.wait({future}, timeout=QUEUED_RESPONSE_AFTER)
+        if not done:
+            # Tell queued clients where they stand instead of holding the request open
+            status = admission.status(user_id)
+            if status and status["position"] > 0:
+                return JSONResponse(status_code=202, content={"status": "queued", **status})
+        container, timings, new_volume = await asyncio.shield(future)
 
         # Generate a new session ID
         sid = str(uuid.uuid4())
+        set_correlation(session_id=sid)
 
         # Store session info
         session_containers[sid] = {
@@ -267,30 +478,200 @@ async def create_session(user_data: dict):
         }
 
         # prepopulate file structure into the container
-        file_manager = FileSystemManager(user_id=user_id, container_id=container.id, base_path="/workspace")
-        file_manager.initialize_file_structure()
-
+        hydrate_start = time.perf_counter()
+        from_checkpoint = checkpoints_enabled() and REVISION_LABEL in container.labels
+        restored = False
+        if from_checkpoint:
+            # A checkpoint taken at the current tree revision already holds the DB's files
+            # The revision is bumped by triggers on every fs_nodes write, frontend routes included
+            primary_db.ensure_connection()
+            restored = is_current(container, await run_in_executor(primary_db.get_tree_revision, user_id))
+        if new_volume or (not volumes_enabled() and not restored):
+            # Without a persistent volume (or on its first use) the DB is the source of truth
+            file_manager = FileSystemManager(user_id=user_id, container_id=container.id, base_path="/workspace")
+            if from_checkpoint and not volumes_enabled():
+                # Hydration only adds and overwrites, so files deleted or renamed since would reappear
+                file_manager.clear_workspace()
+            file_manager.initialize_file_structure()
+        if volumes_enabled():
+            # The volume is the source of truth; fs_nodes catches up in the background
+            start_sync(client, user_id, container.id, hydrated=new_volume)
+        timings = dict(timings, hydrate=round(time.perf_counter() - hydrate_start, 4))
+        for phase, seconds in timings.items():
+            TERMINAL_START_PHASE.labels(phase).observe(seconds)
+        log.info("session.started", session_id=sid, user_id=user_id, timings=timings)
 
         return {
             "session_id": sid,
             "container_id": container.id,
-            "is_new_container": container.attrs["State"]["Running"]
+            "is_new_container": container.attrs["State"]["Running"],
+            "startup_timings": timings
         }
     except Exception as e:
-        print(f"Error creating session: {e}")
+        log.exception("session.start_failed", user_id=user_id)
         # Clean up any partially created resources
         if 'container' in locals():
             try:
                 container.remove(force=True)
             except:
                 pass
+        if locals().get('new_volume'):
+            # A half-hydrated volume would otherwise pass for the source of truth next time
+            try:
+                remove_volume(client, user_id)
+            except Exception:
+                pass
         raise HTTPException(status_code=500, detail=str(e))
 
+FS_EVENT_VERBS = ("touch", "mkdir", "rm", "mv", "cp", "cd")
+FS_RESYNC_DELAY = 2.0   # minimum wait before rescanning a workspace whose fs-events were over the limit
+pending_resyncs: Dict[str, asyncio.Task] = {}  # user_id -> scheduled rescan
+
+def schedule_resync(user_id: str, delay: float) -> None:
+    """Fold over-limit fs-events into one rescan of the user's /workspace, once the burst has passed"""
+    if user_id not in pending_resyncs:
+        pending_resyncs[user_id] = asyncio.create_task(_resync(user_id, max(delay, FS_RESYNC_DELAY)))
+
+async def _resync(user_id: str, delay: float) -> None:
+    await asyncio.sleep(delay)
+    # Events from here on schedule a new rescan; this one may scan before they land
+    pending_resyncs.pop(user_id, None)
+    container_id = user_containers.get(user_id)
+    if container_id is None:
+        return
+    try:
+        # One change-capture pass, the same as the volume sync; the first pass of a
+        # fresh syncer diffs against fs_nodes, so deletions are picked up too
+        syncer = VolumeSyncer(client, user_id, container_id)
+        try:
+            if await run_in_executor(syncer.sync_once):
+                await notify_file_update(user_id, "sync", syncer.base_path, db=syncer.db)
+        finally:
+            await run_in_executor(syncer.close)
+        log.info("fs_event.resynced", user_id=user_id)
+    except Exception:
+        log.exception("fs_event.resync_failed", user_id=user_id)
+
 @app.post("/api/fs-event")
 async def fs_event(evt: FSEvent):
+    set_correlation(user_id=evt.user_id)
+    # A runaway loop in the shell fires the hook per command; each event costs several queries
+    retry_after = await rate_limiter.check(evt.user_id, "fs_event")
+    if retry_after is not None:
+        # Don't drop the change: coalesce the burst into one rescan (the volume sync
+        # already rescans persistent workspaces), and tell the hook it was deferred
+        if not volumes_enabled() and evt.cmd.split(" ", 1)[0] != "cd":
+            schedule_resync(evt.user_id, retry_after)
+        return JSONResponse(status_code=202, content={"status": "deferred"})
+    start = time.perf_counter()
+    try:
+        return await _handle_fs_event(evt)
+    finally:
+        verb = evt.cmd.split(" ", 1)[0]
+        FS_EVENT_LATENCY.labels(verb if verb in FS_EVENT_VERBS else "other").observe(time.perf_counter() - start)
+
+def _ensure_parent_dirs(db, user_id: str, rel_dir: str):
+    """Find or create each directory along rel_dir; returns the id of the last one (None for the root)"""
+    parent_id = None
+    if not rel_dir or rel_dir == '.':
+        return parent_id
+    for part in rel_dir.split(os.path.sep):
+        try:
+            child_id = db.find_child_id(user_id, parent_id, part)
+            if child_id is None:
+                # Create the directory if it doesn't exist
+                child_id = db.create_node(
+                    user_id=user_id,
+                    name=part,
+                    is_dir=True,
+                    parent_id=parent_id
+                )['id']
+        except Exception as e:
+            log.error("fs_event.parent_dirs_failed", user_id=user_id, error=str(e))
+            raise
+        parent_id = child_id
+    return parent_id
+
+def _transfer_args(args: List[str]) -> Tuple[List[str], List[str], Optional[str]]:
+    """Split mv/cp arguments into (flags, paths, -t/--target-directory argument or None)"""
+    flags, paths, target_dir = [], [], None
+    it = iter(args)
+    for arg in it:
+        if arg == "--target-directory":
+            target_dir = next(it, None)
+        elif arg.startswith("--target-directory="):
+            target_dir = arg.split("=", 1)[1]
+        elif arg.startswith("-") and not arg.startswith("--") and "t" in arg:
+            # -t DIR, -tDIR, or last in a cluster like -vt DIR
+            i = arg.index("t")
+            if i > 1:
+                flags.append(arg[:i])
+            target_dir = arg[i + 1:] or next(it, None)
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            paths.append(arg)
+    return flags, paths, target_dir
+
+def _transfer_plan(db, user_id: str, sources: List[str], dest: str, target_directory: bool = False):
+    """
+    Resolve mv/cp arguments the way the shell does: into dest if it is an
+    existing directory (which it must be with target_directory, i.e. -t),
+    otherwise onto dest itself (single source only).
+    Returns (source node, new parent id, new name, id already at that name, target path) per source.
+    """
+    dest_rel = os.path.relpath(dest, "/workspace")
+    dest_id = None if dest_rel == "." else db.resolve_path(user_id, dest_rel)
+    into = dest_rel == "." or (dest_id is not None and db.get_node(user_id, dest_id)["is_dir"])
+    if not into:
+        if target_directory or len(sources) > 1:
+            raise HTTPException(400, "Target is not a directory")
+        parent_rel = os.path.dirname(dest_rel)
+        dest_id = db.resolve_path(user_id, parent_rel) if parent_rel else None
+        if parent_rel and dest_id is None:
+            raise HTTPException(404, "Target directory not found")
+
+    plan = []
+    for src in sources:
+        src_rel = os.path.relpath(src, "/workspace")
+        src_id = None if src_rel == "." else db.resolve_path(user_id, src_rel)
+        if src_id is None:
+            raise HTTPException(404, "File or directory not found")
+        name = os.path.basename(src_rel) if into else os.path.basename(dest_rel)
+        target = os.path.join(dest, name) if into else dest
+        plan.append((db.get_node(user_id, src_id), dest_id, name, db.find_child_id(user_id, dest_id, name), target))
+    return plan
+
+async def _handle_fs_event(evt: FSEvent):
+    # ── grab the user’s running container ────────────────────────
+    container_id = user_containers.get(evt.user_id)
+    if not container_id:
+        raise HTTPException(404, "No live container for user")
+
+    # Planned from the primary: a lagging replica would miss paths the shell just created
+    db = primary_db
+    try:
+        # Every query runs in one executor call, so a burst of events doesn't stall the loop
+        updates = await run_in_executor(_apply_fs_event, db, evt)
+    except HTTPException:
+        raise
+    except QuotaExceeded as e:
+        raise HTTPException(507, str(e))
+    except Exception as e:
+        log.exception("fs_event.failed", user_id=evt.user_id, cmd=evt.cmd)
+        raise HTTPException(500, str(e))
+    for action, path in updates:
+        await notify_file_update(evt.user_id, action, path)
+    if updates:
+        await ws_manager.push_deltas(evt.user_id, db)
+    return {"ok": True}
+
+def _apply_fs_event(db, evt: FSEvent) -> List[Tuple[str, str]]:
+    """Mirror one shell command in fs_nodes; returns the (action, path) updates to announce"""
+    updates: List[Tuple[str, str]] = []
     action, *args = shlex.split(evt.cmd)        # args is now a **list**
     if not args:                                # user just hit <Enter>
-        return {"ok": True}
+        return updates
 
     def _abs(p: str) -> str:
         p = p if os.path.isabs(p) else os.path.join(evt.cwd, p)
@@ -299,318 +680,396 @@ async def fs_event(evt: FSEvent):
             raise HTTPException(400, "Path escapes workspace")
         return full
 
-    # ── grab the user’s running container ────────────────────────
-    container_id = user_containers.get(evt.user_id)
-    if not container_id:
-        raise HTTPException(404, "No live container for user")
-
-    fsm = FileSystemManager(evt.user_id, container_id, base_path="/workspace")
+    db.ensure_connection()
 
     # ── handle each verb ─────────────────────────────────────────
-    try:
-        if action == "touch":
-            path = _abs(args[0])
-            rel_path = os.path.relpath(path, "/workspace")
-            # Create parent directories if they don't exist
-            parent_path = os.path.dirname(rel_path)
-            parent_id = None
-
-            if parent_path and parent_path != '.':
-                # Find or create parent directory
-                parent_parts = parent_path.split(os.path.sep)
-                current_parent_id = None
-
-                for part in parent_parts:
-                    try:
-                        # Try to find existing parent
-                        if current_parent_id is None:
-                            cursor = fsm.db.conn.cursor()
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id IS NULL AND name = %s",
-                                (evt.user_id, part)
-                            )
-                        else:
-                            cursor = fsm.db.conn.cursor()
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s",
-                                (evt.user_id, current_parent_id, part)
-                            )
-
-                        result = cursor.fetchone()
-                        if result:
-                            current_parent_id = result[0]
-                        else:
-                            # Create the directory if it doesn't exist
-                            new_dir = fsm.db.create_node(
-                                user_id=evt.user_id,
-                                name=part,
-                                is_dir=True,
-                                parent_id=current_parent_id
-                            )
-                            current_parent_id = new_dir['id']
-
-                    except Exception as e:
-                        print(f"Error creating parent directories: {e}")
-                        raise
-
-                    parent_id = current_parent_id
-
-            # Create the file
-            file_name = os.path.basename(rel_path)
-            try:
-                fsm.db.create_node(
-                    user_id=evt.user_id,
-                    name=file_name,
-                    is_dir=False,
-                    parent_id=parent_id,
-                    content=""
-                )
-                await notify_file_update(evt.user_id, "create", path)
-            except Exception as e:
-                if "duplicate" in str(e).lower():
-                    # File exists, update it
-                    pass  # Just continue, the file is already there
-                else:
-                    raise
+    if action == "touch":
+        path = _abs(args[0])
+        rel_path = os.path.relpath(path, "/workspace")
+        parent_id = _ensure_parent_dirs(db, evt.user_id, os.path.dirname(rel_path))
 
-        elif action == "mkdir":
-            path = _abs(args[0])
-            rel_path = os.path.relpath(path, "/workspace")
-            parent_path = os.path.dirname(rel_path)
-            dir_name = os.path.basename(rel_path)
-            parent_id = None
+        # Create the file
+        file_name = os.path.basename(rel_path)
+        try:
+            db.create_node(
+                user_id=evt.user_id,
+                name=file_name,
+                is_dir=False,
+                parent_id=parent_id,
+                content=""
+            )
+            updates.append(("create", path))
+        except Exception as e:
+            if "duplicate" in str(e).lower():
+                # File exists, update it
+                pass  # Just continue, the file is already there
+            else:
+                raise
 
-            # Handle parent directories
-            if parent_path and parent_path != '.':
-                # Find or create parent directories
-                parent_parts = parent_path.split(os.path.sep)
-                current_parent_id = None
+    elif action == "mkdir":
+        path = _abs(args[0])
+        rel_path = os.path.relpath(path, "/workspace")
+        dir_name = os.path.basename(rel_path)
+        parent_id = _ensure_parent_dirs(db, evt.user_id, os.path.dirname(rel_path))
 
-                for part in parent_parts:
-                    try:
-                        if current_parent_id is None:
-                            cursor = fsm.db.conn.cursor()
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id IS NULL AND name = %s",
-                                (evt.user_id, part)
-                            )
-                        else:
-                            cursor = fsm.db.conn.cursor()
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s",
-                                (evt.user_id, current_parent_id, part)
-                            )
-
-                        result = cursor.fetchone()
-                        if result:
-                            current_parent_id = result[0]
-                        else:
-                            # Create the directory if it doesn't exist
-                            new_dir = fsm.db.create_node(
-                                user_id=evt.user_id,
-                                name=part,
-                                is_dir=True,
-                                parent_id=current_parent_id
-                            )
-                            current_parent_id = new_dir['id']
-
-                    except Exception as e:
-                        print(f"Error creating parent directories: {e}")
-                        raise
-
-                    parent_id = current_parent_id
-
-            # Create the directory
-            try:
-                fsm.db.create_node(
-                    user_id=evt.user_id,
-                    name=dir_name,
-                    is_dir=True,
-                    parent_id=parent_id
-                )
-                await notify_file_update(evt.user_id, "create", path)
-            except Exception as e:
-                if "duplicate" in str(e).lower():
-                    # Directory exists, that's fine
-                    pass
-                else:
-                    raise
+        # Create the directory
+        try:
+            db.create_node(
+                user_id=evt.user_id,
+                name=dir_name,
+                is_dir=True,
+                parent_id=parent_id
+            )
+            updates.append(("create", path))
+        except Exception as e:
+            if "duplicate" in str(e).lower():
+                # Directory exists, that's fine
+                pass
+            else:
+                raise
 
-        elif action == "rm":
-            path = _abs(args[0])
-            rel_path = os.path.relpath(path, "/workspace")
-            cursor = fsm.db.conn.cursor()
-            # Find the node in the database
-            cursor.execute("""
-                WITH RECURSIVE node_tree AS (
-                    -- Start with the target node
-                    SELECT id, parent_id, name, is_dir
-                    FROM fs_nodes
-                    WHERE user_id = %s
-                    AND name = %s
-                    AND parent_id IS NULL
-                    AND %s = name
-                    UNION ALL
-                    -- Recursively find all children
-                    SELECT n.id, n.parent_id, n.name, n.is_dir
-                    FROM fs_nodes n
-                    JOIN node_tree nt ON n.parent_id = nt.id
-                    WHERE n.user_id = %s
-                )
-                SELECT id, is_dir FROM node_tree
-            """, (evt.user_id, rel_path, rel_path, evt.user_id))
-
-            nodes_to_delete = cursor.fetchall()
-
-            if not nodes_to_delete:
-                # Try to find the node with parent path
-                path_parts = rel_path.split(os.path.sep)
-                if len(path_parts) > 1:
-                    parent_path = os.path.sep.join(path_parts[:-1])
-                    file_name = path_parts[-1]
-
-                    # Find parent ID
-                    parent_id = None
-                    parent_parts = parent_path.split(os.path.sep)
-                    current_parent_id = None
-
-                    for part in parent_parts:
-                        if current_parent_id is None:
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id IS NULL AND name = %s",
-                                (evt.user_id, part)
-                            )
-                        else:
-                            cursor.execute(
-                                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s",
-                                (evt.user_id, current_parent_id, part)
-                            )
-
-                        result = cursor.fetchone()
-                        if not result:
-                            raise HTTPException(404, "File or directory not found")
-                        current_parent_id = result[0]
-
-                    parent_id = current_parent_id
-
-                    # Now find the node with this parent
-                    cursor.execute(
-                        "SELECT id, is_dir FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s",
-                        (evt.user_id, parent_id, file_name)
-                    )
-                    nodes_to_delete = cursor.fetchall()
-
-            if not nodes_to_delete:
-                raise HTTPException(404, "File or directory not found")
-
-            # Delete from database (cascading delete will handle children)
-            for node_id, is_dir in nodes_to_delete:
-                fsm.db.delete_node(evt.user_id, node_id)
-
-            await notify_file_update(evt.user_id, "delete", path)
+    elif action == "rm":
+        path = _abs(args[0])
+        rel_path = os.path.relpath(path, "/workspace")
+        node_id = db.resolve_path(evt.user_id, rel_path)
+        if node_id is None:
+            raise HTTPException(404, "File or directory not found")
+
+        # Delete from database (cascading delete will handle children)
+        db.delete_node(evt.user_id, node_id)
+
+        updates.append(("delete", path))
+
+    elif action in ("mv", "cp"):
+        flags, paths, target_dir = _transfer_args(args)
+        paths = [_abs(p) for p in paths]
+        if target_dir is not None:
+            sources, dest = paths, _abs(target_dir)
+        elif len(paths) >= 2:
+            *sources, dest = paths
+        else:
+            sources = []
+        if not sources:
+            return updates
+        recursive = action == "mv" or any(
+            f in ("--recursive", "--archive") or (not f.startswith("--") and set(f[1:]) & set("rRa"))
+            for f in flags
+        )
+        plan = _transfer_plan(db, evt.user_id, sources, dest, target_directory=target_dir is not None)
+        for source, parent_id, name, existing_id, target in plan:
+            if existing_id == source["id"]:
+                continue                        # onto itself
+            if action == "cp" and source["is_dir"] and not recursive:
+                continue                        # cp omits directories without -r
+            if existing_id is not None:
+                existing = db.get_node(evt.user_id, existing_id)
+                if existing["is_dir"] != source["is_dir"]:
+                    continue                    # the shell refuses to mix files and directories
+                if action == "cp" and not source["is_dir"]:
+                    content = db.get_file_content(evt.user_id, source["id"])
+                    db.update_file_content(evt.user_id, existing_id, content or "")
+                    updates.append(("update", target))
+                    continue
+                if action == "cp":
+                    # cp -r merges into an existing directory; the next rehydration picks it up
+                    log.warning("fs_event.copy_merge_skipped", user_id=evt.user_id, target=target)
+                    continue
+                if existing["is_dir"] and db.has_children(evt.user_id, existing_id):
+                    continue                    # mv only replaces an empty directory
+                db.delete_node(evt.user_id, existing_id)
 
-        return {"ok": True}
+            try:
+                if action == "mv":
+                    db.move_node(evt.user_id, source["id"], parent_id, name)
+                else:
+                    db.copy_node(evt.user_id, source["id"], parent_id, name)
+            except QuotaExceeded:
+                raise
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+            updates.append(("move" if action == "mv" else "create", target))
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error in fs_event: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(500, str(e))
+    return updates
 
-@app.get("/api/files/{sid}/{name}")
-async def get_file(sid: str, name: str):
-    # lookup container by sid
-    if sid not in session_containers:
+@app.get("/api/search/{user_id}")
+async def search_files(user_id: str, q: str, kind: str = "name", limit: int = 50, offset: int = 0,
+                       case_sensitive: bool = False):
+    """
+    Quick-open (kind=name: fuzzy file-name match) and find-in-project
+    (kind=content: substring match with per-line highlights), paginated
+    """
+    set_correlation(user_id=user_id)
+    if not q:
+        raise HTTPException(status_code=400, detail="q is required")
+    if kind not in ("name", "content"):
+        raise HTTPException(status_code=400, detail="kind must be 'name' or 'content'")
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, offset)
+
+    neon_db.ensure_connection()
+    # One extra row tells us whether there is another page
+    if kind == "name":
+        rows = await run_in_executor(neon_db.search_file_names, user_id, q, limit + 1, offset)
+        results = [dict(row, ranges=fuzzy_ranges(row["name"], q)) for row in rows[:limit]]
+    else:
+        rows = await run_in_executor(neon_db.search_file_contents, user_id, q, limit + 1, offset, case_sensitive)
+        results = []
+        for row in rows[:limit]:
+            matches, truncated = line_matches(row["content"] or "", q, case_sensitive)
+            results.append({"id": row["id"], "path": row["path"], "matches": matches, "truncated": truncated})
+    return {"results": results, "next_offset": offset + limit if len(rows) > limit else None}
+
+@app.get("/api/tree/{user_id}")
+async def get_tree(user_id: str, request: Request):
+    """The user's whole file tree as nested JSON, streamed as it is encoded"""
+    set_correlation(user_id=user_id)
+    neon_db.ensure_connection()
+    # Read the revision before the rows: a write in between makes the ETag
+    # older than the body, which only costs the client one extra download
+    revision = await run_in_executor(neon_db.get_tree_revision, user_id)
+    etag = tree_etag(revision)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    rows = await run_in_executor(neon_db.get_tree_rows, user_id)
+    # Starlette pulls the sync generator on its threadpool, so encoding stays off the loop
+    return StreamingResponse(
+        iter_tree_json(rows),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+@app.post("/api/projects/{user_id}/import")
+async def import_project(user_id: str, request: Request):
+    """
+    Stream a tar(.gz) or zip request body into the user's file tree, and into
+    their running container if they have one
+    """
+    set_correlation(user_id=user_id)
+    await enforce_rate_limit(user_id, "import")
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_IMPORT_ARCHIVE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Archive larger than {MAX_IMPORT_ARCHIVE_BYTES} bytes")
+            upload.write(chunk)
+
+        def run_import():
+            container = None
+            container_id = user_containers.get(user_id)
+            if container_id:
+                try:
+                    container = client.containers.get(container_id)
+                except docker.errors.NotFound:
+                    pass
+            # Primary only: the importer plans its inserts from the paths it reads
+            db = NeonDB(replica_dsns=())
+            try:
+                return ProjectImporter(db, user_id, container).run(upload)
+            finally:
+                db.close()
+
+        stats = await run_in_executor(run_import)
+    except ImportLimitExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QuotaExceeded as e:
+        # Batches written before the one that hit the quota stay imported
+        raise HTTPException(status_code=507, detail=str(e))
+    except (ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        upload.close()
+
+    await notify_file_update(user_id, "import", "/workspace", db=neon_db)
+    return stats
+
+@app.get("/api/projects/{user_id}/export")
+async def export_project(user_id: str, format: str = "tar"):
+    """Stream the user's file tree as a tar.gz or zip, generated member by member"""
+    if format not in ARCHIVE_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'tar' or 'zip'")
+    set_correlation(user_id=user_id)
+    media_type, extension = ARCHIVE_FORMATS[format]
+    # A dedicated connection: the export holds a server-side cursor open while it streams
+    db = await run_in_executor(NeonDB)
+    return StreamingResponse(
+        export_archive(db, user_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="workspace.{extension}"'},
+    )
+
+async def _file_response(request: Request, user_id: str, file_id: int) -> Optional[Response]:
+    """
+    Serve a file from NeonDB with a strong ETag: 304 if the client's copy is
+    current, otherwise the content from the cache or the database. None if
+    fs_nodes has no such file.
+    """
+    updated_at = await run_in_executor(neon_db.get_file_version, user_id, file_id)
+    if updated_at is None:
+        return None
+    etag = file_etag(file_id, updated_at)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    content = file_cache.get((user_id, file_id, updated_at))
+    if content is None:
+        row = await run_in_executor(neon_db.get_file_with_version, user_id, file_id)
+        if row is None:
+            return None
+        content, updated_at = row
+        etag = file_etag(file_id, updated_at)
+        file_cache.put((user_id, file_id, updated_at), content)
+    return JSONResponse({"content": content or ""}, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/files/{sid}/{name:path}")
+async def get_file(sid: str, name: str, request: Request):
+    """Read a workspace file by path: from NeonDB (conditional) if tracked there, else from the container"""
+    session = session_containers.get(sid)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-
-    container_id = session_containers[sid]
+    user_id = session["user_id"]
+    set_correlation(user_id=user_id, session_id=sid)
+    rel_path = os.path.normpath(name)
+    if rel_path.startswith("..") or os.path.isabs(rel_path):
+        raise HTTPException(status_code=400, detail="Path escapes workspace")
+
+    neon_db.ensure_connection()
+    file_id = await run_in_executor(neon_db.resolve_path, user_id, rel_path)
+    if file_id is not None:
+        response = await _file_response(request, user_id, file_id)
+        if response is not None:
+            return response
+
+    # Not in fs_nodes (e.g. build output): read it from the container
     try:
-        container = client.containers.get(container_id)
-        # Get file content directly from the container
-        exit_code, output = bash(container, f"cat /workspace/{name}")
-        if exit_code != 0:
-            raise HTTPException(status_code=404, detail="File not found")
-        return {"content": output}
+        container = client.containers.get(session["container_id"])
+        exit_code, output = await run_in_executor(container.exec_run, ["cat", f"/workspace/{rel_path}"])
     except Exception as e:
-        print(f"Error getting file: {e}")
+        log.error("file.get_failed", session_id=sid, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
-
-@app.put("/api/files/{file_id}")
-async def update_file(file_id: str, update: FileUpdate):
+    if exit_code != 0:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"content": output.decode("utf-8", errors="replace")}
+
+@app.get("/api/files/{file_id}")
+async def get_file_by_id(file_id: int, user_id: str, request: Request):
+    """Read a file by id from NeonDB, honouring If-None-Match"""
+    set_correlation(user_id=user_id)
+    neon_db.ensure_connection()
+    response = await _file_response(request, user_id, file_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="File not found or access denied")
+    return response
+
+def _store_file(user_id: str, file_id: int, content: str):
     """
-    Update a file's content and sync it to the container
+    Write a file's content to fs_nodes and the cache; returns (path, updated_at).
+    Blocking: run it in the executor, as the content may be up to MAX_FILE_UPLOAD_BYTES.
     """
+    db_start = time.perf_counter()
+    neon_db.ensure_connection()
+    full_path = neon_db.get_node_path(user_id, file_id)
+    if full_path is None:
+        raise HTTPException(status_code=404, detail="File not found or access denied")
+
+    # Update the file content in the database (also logs the change for delta sync)
     try:
-        print(update)
-        if neon_db.conn is None or neon_db.conn.closed != 0: 
-            neon_db.connect()
-        with neon_db.conn.cursor() as cursor:
-            # Get the full path of the file by recursively traversing its parents
-            cursor.execute("""
-                WITH RECURSIVE file_path AS (
-                    SELECT id, parent_id, name, name::text AS path
-                    FROM fs_nodes
-                    WHERE id = %s AND user_id = %s
-                    UNION ALL
-                    SELECT p.id, p.parent_id, p.name, (fp.path || '/' || p.name)
-                    FROM fs_nodes p
-                    JOIN file_path fp ON p.id = fp.parent_id
-                )
-                SELECT path FROM file_path WHERE id = %s;
-            """, (file_id, update.userId, file_id))
-
-            result = cursor.fetchone()
-            if not result:
-                raise HTTPException(status_code=404, detail="File not found or access denied")
-
-            # The query builds the path in reverse, so we split and reverse it
-            path_parts = result[0].split('/')
-            path_parts.reverse()
-            full_path = "/".join(path_parts)
-
-            # Update the file content in the database
-            cursor.execute("""
-                UPDATE fs_nodes
-                SET content = %s, updated_at = NOW()
-                WHERE id = %s AND user_id = %s AND NOT is_dir
-            """, (update.content, file_id, update.userId))
-            neon_db.conn.commit()
-
-        # Get the user's container
-        container_id = user_containers.get(update.userId)
-        if not container_id:
-            raise HTTPException(status_code=404, detail="No active container found for user")
+        updated_at = neon_db.update_file_content(user_id, file_id, content)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    # The saving client already has this content: cache it and hand back its ETag
+    file_cache.put((user_id, file_id, updated_at), content)
+    UPDATE_FILE_STEP.labels("db").observe(time.perf_counter() - db_start)
+    return full_path, updated_at
+
+async def _put_in_container(user_id: str, archive: TarStream) -> None:
+    """Upload a tar (paths relative to /workspace) into the user's running container"""
+    container_id = user_containers.get(user_id)
+    if not container_id:
+        raise HTTPException(status_code=404, detail="No active container found for user")
 
+    def put():
         container = client.containers.get(container_id)
         if container.status != 'running':
             container.start()
+        # The archive is read block by block as it is sent; no tar copy of the content is built
+        container.put_archive(path='/workspace', data=archive)
 
-        # --- Safely write file to container using a tar stream ---
-
-        # In-memory tarfile
-        pw_tarstream = BytesIO()
-        pw_tar = tarfile.TarFile(fileobj=pw_tarstream, mode='w')
-
-        # Encode content to bytes
-        content_bytes = update.content.encode('utf-8')
+    archive_start = time.perf_counter()
+    await run_in_executor(put)
+    UPDATE_FILE_STEP.labels("put_archive").observe(time.perf_counter() - archive_start)
 
-        tarinfo = tarfile.TarInfo(name=full_path)
-        tarinfo.size = len(content_bytes)
+@app.put("/api/files/{file_id}")
+async def update_file(file_id: str, update: FileUpdate):
+    """
+    Update a file's content and sync it to the container
+    """
+    set_correlation(user_id=update.userId)
+    await enforce_rate_limit(update.userId, "file_save")
+    try:
+        log.debug("file.update", user_id=update.userId, file_id=file_id, bytes=len(update.content))
+        full_path, updated_at = await run_in_executor(_store_file, update.userId, int(file_id), update.content)
 
-        # Add file to tar stream
-        pw_tar.addfile(tarinfo, BytesIO(content_bytes))
+        # Let delta-synced clients (e.g. other tabs) pick up the new content
+        await ws_manager.push_deltas(update.userId, neon_db)
 
-        pw_tar.close()
-        pw_tarstream.seek(0)
+        archive = TarStream()
+        archive.add_bytes(full_path, update.content.encode('utf-8'), mtime=updated_at.timestamp())
+        await _put_in_container(update.userId, archive)
 
-        # Put the tar stream into the container's workspace
-        container.put_archive(path='/workspace', data=pw_tarstream)
+        return JSONResponse(
+            {"status": "success", "message": "File updated successfully"},
+            headers={"ETag": file_etag(int(file_id), updated_at)},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("file.update_failed", user_id=update.userId, file_id=file_id)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {"status": "success", "message": "File updated successfully"}
+@app.put("/api/files/{file_id}/content")
+async def upload_file_content(file_id: int, user_id: str, request: Request):
+    """
+    Save a file from the raw request body (UTF-8 text). The body is spooled to
+    memory, or to disk past 1 MiB, and the container upload reads from that spool.
+    """
+    set_correlation(user_id=user_id)
+    await enforce_rate_limit(user_id, "file_save")
+    spool = tempfile.SpooledTemporaryFile(max_size=FILE_UPLOAD_SPOOL_BYTES)
+    try:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_FILE_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"File larger than {MAX_FILE_UPLOAD_BYTES} bytes")
+            spool.write(chunk)
+        spool.seek(0)
+        log.debug("file.upload", user_id=user_id, file_id=file_id, bytes=size)
+        try:
+            # fs_nodes stores text, so one decoded copy is unavoidable
+            content = await run_in_executor(read_utf8, spool)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=415, detail="File content must be UTF-8 text")
+        full_path, updated_at = await run_in_executor(_store_file, user_id, file_id, content)
+        del content  # files too big for the cache needn't stay in memory during the upload
+        await ws_manager.push_deltas(user_id, neon_db)
+
+        spool.seek(0)
+        archive = TarStream()
+        archive.add_file(full_path, spool, size, mtime=updated_at.timestamp())
+        await _put_in_container(user_id, archive)
+        return JSONResponse(
+            {"status": "success", "message": "File updated successfully", "bytes": size},
+            headers={"ETag": file_etag(file_id, updated_at)},
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error updating file: {str(e)}")
+        log.exception("file.upload_failed", user_id=user_id, file_id=file_id)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        spool.close()
 
 @app.get("/terminal/{sid}")
 async def terminal_status(sid: str):
@@ -642,6 +1101,7 @@ async def terminal_stop(sid: str):
 
     container_id = session_containers[sid]
     try:
+        await supervisor.close(sid)
         container = client.containers.get(container_id)
         container.stop()
         container.remove()
@@ -654,17 +1114,20 @@ async def terminal_stop(sid: str):
 async def cleanup_user_container(user_id: str):
     """Clean up a user's container when they're done"""
     try:
-        print(f"Cleanup request for user: {user_id}")
+        log.info("container.cleanup_requested", user_id=user_id)
         if not user_id or user_id == 'undefined' or user_id == 'null':
-            print("No valid user ID provided for cleanup")
+            log.info("container.cleanup_skipped")
             return {"status": "skipped", "message": "No user ID provided"}
 
         if user_id in user_containers:
             container_id = user_containers[user_id]
             try:
                 container = client.containers.get(container_id)
-                print(f"Cleaning up container {container_id} for user {user_id}")
-                container.remove(force=True)
+                log.info("container.cleanup", container_id=container_id, user_id=user_id)
+                await supervisor.close_user(user_id)
+                stop_sync(user_id)
+                await kernels.close(container_id)
+                await run_in_executor(retire_container, container, user_id)
                 # Clean up any sessions for this user
                 global session_containers
                 session_containers = {k: v for k, v in session_containers.items()
@@ -678,11 +1141,50 @@ async def cleanup_user_container(user_id: str):
                 return {"status": "success", "message": "Container not found"}
         return {"status": "not_found", "message": "No container found for user"}
     except Exception as e:
-        print(f"Error cleaning up container for user {user_id}: {e}")
+        log.exception("container.cleanup_failed", user_id=user_id)
         if not isinstance(e, HTTPException):
             raise HTTPException(status_code=500, detail=str(e))
         raise
 
+def start_shell_exec(container_id: str, cols: int = 80, rows: int = 24):
+    """Create and start an interactive bash exec, returning (exec_id, socket)"""
+    exec_config = client.api.exec_create(
+        container_id,
+        ["/bin/bash", "-i"],
+        tty=True,
+        stdin=True,
+        stdout=True,
+        stderr=True,
+        environment={
+            "TERM": "xterm-256color",
+            "COLUMNS": str(cols),
+            "LINES": str(rows),
+            "HOME": "/root",
+            "SHELL": "/bin/bash",
+            "USER": "root"
+        }
+    )
+    exec_id = exec_config["Id"]
+    sock = client.api.exec_start(exec_id, socket=True, tty=True)
+    return exec_id, sock
+
+def resize_shell_exec(exec_id: str, rows: int, cols: int) -> None:
+    # positional args only
+    client.api.exec_resize(exec_id, rows, cols)
+
+def stop_shell_exec(exec_id: str, sock) -> None:
+    """Best-effort teardown of an exec started by start_shell_exec"""
+    if exec_id:
+        try:
+            client.api.kill(exec_id)
+        except:
+            pass
+    if sock:
+        try:
+            sock.close()
+        except:
+            pass
+
 @app.websocket("/terminal/ws/{sid}")
 async def terminal_ws(ws: WebSocket, sid: str):
     """
@@ -690,78 +1192,58 @@ async def terminal_ws(ws: WebSocket, sid: str):
     """
     await ws.accept()
     if not sid:
-        print("Error: session_id query parameter is required")
+        log.warning("terminal.missing_session_id")
         await ws.close(code=1008, reason="session_id query parameter is required")
         return
 
-    print(f"\n=== New WebSocket Connection ===")
-    print(f"Session ID: {sid}")
-    print(f"Client headers: {dict(ws.headers)}")
-    print(f"Query params: {dict(ws.query_params)}")
-    print(f"Available sessions: {list(session_containers.keys())}")
+    log.debug("terminal.connect", session_id=sid)
 
     # Check if session exists
     if sid not in session_containers:
-        error_msg = f"Session {sid} not found in {list(session_containers.keys())}"
-        print(f"Error: {error_msg}")
+        error_msg = f"Session {sid} not found"
+        log.warning("terminal.session_not_found", session_id=sid)
         await ws.close(code=1008, reason=error_msg)
         return
 
     session = session_containers[sid]
     container_id = session["container_id"]
     user_id = session["user_id"]
-    exec_id = None
-    sock = None
-
-    print(f"Found container ID: {container_id} for user: {user_id}")
+    shell = None
+    set_correlation(user_id=user_id, session_id=sid)
 
     try:
-        print(f"WebSocket connection accepted for session: {sid}")
-        # await ws.accept()
-        loop = asyncio.get_running_loop()
-
-        print(f"Found container ID: {container_id} for session: {sid} (user: {user_id})")
         container = client.containers.get(container_id)
-        print(f"Container status: {container.status}")
 
         # Ensure container is running
         if container.status != 'running':
-            print(f"Container {container_id} is not running. Starting...")
+            log.info("container.starting", container_id=container_id, status=container.status)
             container.start()
 
-        # Default terminal size
-        cols = 80
-        rows = 24
-
-        # Create exec instance
-        exec_config = client.api.exec_create(
-            container_id,
-            ["/bin/bash", "-i"],
-            tty=True,
-            stdin=True,
-            stdout=True,
-            stderr=True,
-            environment={
-                "TERM": "xterm-256color",
-                "COLUMNS": str(cols),
-                "LINES": str(rows),
-                "HOME": "/root",
-                "SHELL": "/bin/bash",
-                "USER": "root"
-            }
+        # Reattach to the session's shell if it survived a dropped connection
+        shell = await supervisor.get_or_start(
+            sid, user_id, container_id, start_shell_exec, resize_shell_exec, stop_shell_exec
         )
-        exec_id = exec_config["Id"]
-        print(f"Created exec instance: {exec_id}")
+        offset = ws.query_params.get("offset")
+        await shell.attach(ws, int(offset) if offset and offset.isdigit() else None)
+        log.info("terminal.attached", session_id=sid, user_id=user_id, exec_id=shell.exec_id)
 
-        # Start the exec instance
-        sock = client.api.exec_start(exec_id, socket=True, tty=True)
-        print("Exec instance started")
+        # ?proto=binary clients send typed binary frames (see session_supervisor);
+        # everyone else gets the original text protocol with JSON resize messages
+        binary_frames = ws.query_params.get("proto") == "binary"
 
         async def handle_messages():
-            nonlocal cols, rows
             try:
                 while True:
                     message = await ws.receive()
+                    if message["type"] == "websocket.disconnect":
+                        break
+                    if binary_frames:
+                        if message.get("bytes"):
+                            shell.handle_frame(message["bytes"])
+                        elif message.get("text"):
+                            shell.send(message["text"].encode("utf-8"))
+                        continue
+
                     text = message.get("text", "")
                     # Only try to parse JSON resize if it actually _looks_ like an object
                     if text.startswith("{"):
@@ -769,19 +1251,7 @@ async def terminal_ws(ws: WebSocket, sid: str):
                             payload = json.loads(text)
                             # Ensure it’s a dict and has a “type” key
                             if isinstance(payload, dict) and payload.get("type") == "resize":
-                                new_cols = payload.get("cols", cols)
-                                new_rows = payload.get("rows", rows)
-                                if (new_cols, new_rows) != (cols, rows):
-                                    print(f"Resizing terminal: {cols}x{rows} -> {new_cols}x{new_rows}")
-                                    cols, rows = new_cols, new_rows
-                                    # positional args only
-                                    await loop.run_in_executor(
-                                        None,
-                                        client.api.exec_resize,
-                                        exec_id,
-                                        rows,
-                                        cols
-                                    )
+                                shell.request_resize(payload.get("cols", shell.cols), payload.get("rows", shell.rows))
                                 # skip the “send to shell” below
                                 continue
                         except json.JSONDecodeError:
@@ -789,63 +1259,198 @@ async def terminal_ws(ws: WebSocket, sid: str):
                             pass
 
                     # If it wasn’t a resize object, send raw text to the container
-                    if text and hasattr(sock, "_sock"):
-                        sock._sock.send(text.encode("utf-8"))
+                    if text:
+                        shell.send(text.encode("utf-8"))
 
                     # And handle any binary frames as before
-                    if "bytes" in message and hasattr(sock, "_sock"):
-                        data = message["bytes"]
-                        print(f"Sending binary data to container: {len(data)} bytes")
-                        sock._sock.send(data)
+                    if message.get("bytes"):
+                        shell.send(message["bytes"])
             except Exception as e:
-                print(f"Error in handle_messages: {e}")
+                log.warning("terminal.input_failed", session_id=sid, error=str(e))
                 raise
 
-
-        async def read_from_container():
+        # Output is pumped by the session itself; we only wait for the client
+        # to go away or the shell to exit
+        messages = asyncio.create_task(handle_messages())
+        shell_exit = asyncio.create_task(shell.closed.wait())
+        done, pending = await asyncio.wait({messages, shell_exit}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if shell_exit in done:
+            # The shell itself exited, so a reconnect should start a fresh one
+            await supervisor.close(sid)
             try:
-                while True:
-                    # pull raw bytes off the underlying socket
-                    data = await loop.run_in_executor(
-                        None,
-                        sock._sock.recv,
-                        4096
-                    )
-                    if not data:
-                        break
-                    await ws.send_bytes(data)
-            except Exception as e:
-                print(f"Error reading from container: {e}")
-                raise
-
-        # Start both tasks
-        await asyncio.gather(
-            read_from_container(),
-            handle_messages(),
-            return_exceptions=True
-        )
+                await ws.close()
+            except:
+                pass
 
     except Exception as e:
-        print(f"WebSocket error: {e}")
-        print(traceback.format_exc())
+        log.exception("terminal.ws_failed", session_id=sid)
         try:
             await ws.close(code=1011, reason=str(e))
         except:
             pass
     finally:
-        # Clean up
-        print("Cleaning up WebSocket connection")
-        if exec_id:
+        # Detach only: the shell keeps running so the client can resume it
+        log.debug("terminal.detached", session_id=sid)
+        if shell is not None:
+            await shell.detach(ws)
+
+@app.post("/terminal/{sid}/share")
+async def share_session(sid: str):
+    """Create (or return) a read-only viewer token for a running session"""
+    if sid not in session_containers:
+        raise HTTPException(status_code=404, detail="Session not found")
+    shell = supervisor.sessions.get(sid)
+    if shell is None or shell.closed.is_set():
+        raise HTTPException(status_code=409, detail="Session has no running shell")
+    return {"share_token": supervisor.share(sid), "viewers": len(shell.viewers)}
+
+@app.delete("/terminal/{sid}/share")
+async def unshare_session(sid: str):
+    """Revoke a session's viewer token and disconnect its viewers"""
+    supervisor.unshare(sid)
+    return {"ok": True}
+
+@app.websocket("/terminal/view/{token}")
+async def terminal_view_ws(ws: WebSocket, token: str):
+    """
+    Read-only WebSocket onto a shared session. Viewers get the session's
+    output fanned out from its single exec read; anything they send is ignored.
+    """
+    await ws.accept()
+    shell = supervisor.get_shared(token)
+    if shell is None:
+        await ws.close(code=1008, reason="Shared session not found")
+        return
+
+    viewer = await shell.add_viewer(ws)
+
+    async def drain_input():
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    output = asyncio.create_task(viewer.run())
+    incoming = asyncio.create_task(drain_input())
+    try:
+        await asyncio.wait({output, incoming}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        output.cancel()
+        incoming.cancel()
+        shell.remove_viewer(viewer)
+
+@app.websocket("/terminal/recordings/{sid}/play")
+async def play_recording(ws: WebSocket, sid: str):
+    """
+    Stream a recorded session's output. Query params: speed (default 1.0)
+    and start (seconds into the recording to seek to).
+    """
+    await ws.accept()
+    directory = session_recorder.recordings_dir()
+    try:
+        speed = float(ws.query_params.get("speed", 1.0))
+        start = float(ws.query_params.get("start", 0.0))
+        if not directory:
+            raise FileNotFoundError("Recording is disabled")
+        async for frame in session_recorder.play(directory, sid, speed, start):
+            await ws.send_bytes(frame)
+        await ws.close()
+    except (ValueError, FileNotFoundError) as e:
+        await ws.close(code=1008, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/terminal/mux/{user_id}")
+async def terminal_mux_ws(ws: WebSocket, user_id: str):
+    """
+    Multiplexed WebSocket carrying several shells, resizes and file
+    notifications for one user (framing is described in terminal_mux.py)
+    """
+    await ws.accept()
+
+    def open_shell(sid: str, owner: str):
+        session = session_containers.get(sid)
+        if not session or session["user_id"] != owner:
+            raise ValueError(f"Session {sid} not found")
+        container = client.containers.get(session["container_id"])
+        if container.status != 'running':
+            container.start()
+        return start_shell_exec(session["container_id"])
+
+    mux = MuxConnection(ws, user_id, neon_db, open_shell, resize_shell_exec, stop_shell_exec)
+    try:
+        await mux.run()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        log.exception("mux.ws_failed", user_id=user_id)
+        try:
+            await ws.close(code=1011, reason=str(e))
+        except:
+            pass
+
+@app.websocket("/api/run/ws/{user_id}")
+async def run_code_ws(ws: WebSocket, user_id: str):
+    """
+    Run editor files and cells on a warm kernel in the user's container. Send
+    {"op": "run", "id", "code"} or {"op": "run", "id", "path"}, and {"op": "interrupt"};
+    output streams back tagged with the request id, each run ending with a
+    "done" message (message types are described in kernel_runner.py)
+    """
+    await ws.accept()
+    container_id = user_containers.get(user_id)
+    if container_id is None:
+        container = await run_in_executor(find_running_container, user_id)
+        container_id = container.id if container is not None else None
+    if container_id is None:
+        await ws.close(code=4404, reason="No running container")
+        return
+
+    start = functools.partial(start_kernel_exec, client)
+    kernel = None
+    current: Optional[asyncio.Task] = None
+
+    async def stream(code: str, request_id):
+        async for message in kernel.run(code):
+            await ws.send_json(dict(message, request=request_id))
+
+    try:
+        while True:
+            message = await ws.receive_json()
+            op = message.get("op")
+            if op == "interrupt":
+                if kernel is not None and current is not None and not current.done():
+                    await kernel.interrupt()
+                continue
+            if op != "run":
+                await ws.send_json({"type": "rejected", "request": message.get("id"), "message": f"Unknown op {op!r}"})
+                continue
+            if current is not None and not current.done():
+                await ws.send_json({"type": "rejected", "request": message.get("id"), "message": "A run is in progress"})
+                continue
             try:
-                client.api.kill(exec_id)
-                print(f"Terminated exec instance: {exec_id}")
-            except:
-                pass
-        if sock:
+                code = run_request_code(message)
+                if not kernels.warm(container_id):
+                    await ws.send_json({"type": "starting", "request": message.get("id")})
+                kernel = await kernels.get_or_start(container_id, start, stop_shell_exec)
+            except (ValueError, RuntimeError) as e:
+                await ws.send_json({"type": "rejected", "request": message.get("id"), "message": str(e)})
+                continue
+            current = asyncio.create_task(stream(code, message.get("id")))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        log.exception("run.ws_failed", user_id=user_id)
+    finally:
+        if current is not None and not current.done():
+            # Otherwise the abandoned run keeps the kernel busy for the next one
             try:
-                sock.close()
-            except:
+                await kernel.interrupt()
+            except Exception:
                 pass
+            current.cancel()
 
 @app.websocket("/db_update/ws/{user_id}")
 async def db_update_websocket(websocket: WebSocket, user_id: str):
@@ -853,14 +1458,12 @@ async def db_update_websocket(websocket: WebSocket, user_id: str):
     try:
         # Accept the WebSocket connection first
         await websocket.accept()
-        print(f"WebSocket connection accepted for user {user_id}")
 
         # Connect to the WebSocket manager
         try:
             await ws_manager.connect(user_id, websocket)
-            print(f"WebSocket connection registered for user {user_id}")
         except Exception as e:
-            print(f"Error registering WebSocket connection: {e}")
+            log.error("db_update.register_failed", user_id=user_id, error=str(e))
             await websocket.close(code=1008, reason="Internal server error")
             return
 
@@ -872,6 +1475,14 @@ async def db_update_websocket(websocket: WebSocket, user_id: str):
                 # Handle ping/pong for keepalive
                 if data == "ping":
                     await websocket.send_text("pong")
+                elif data.startswith("{"):
+                    # Versioned sync: {"type": "subscribe", "revision": <last seen>}
+                    try:
+                        payload = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(payload, dict) and payload.get("type") == "subscribe":
+                        await ws_manager.subscribe(user_id, websocket, neon_db, int(payload.get("revision") or 0))
 
             except asyncio.TimeoutError:
                 # Send ping to keep connection alive
@@ -881,19 +1492,18 @@ async def db_update_websocket(websocket: WebSocket, user_id: str):
                     break
 
             except WebSocketDisconnect:
-                print(f"Client {user_id} disconnected")
+                log.debug("db_update.client_disconnected", user_id=user_id)
                 break
 
             except Exception as e:
-                print(f"WebSocket error for user {user_id}: {e}")
+                log.warning("db_update.ws_failed", user_id=user_id, error=str(e))
                 break
 
-    except Exception as e:
-        print(f"Unexpected error in WebSocket for user {user_id}: {e}")
+    except Exception:
+        log.exception("db_update.ws_unexpected", user_id=user_id)
     finally:
         # Clean up the connection
         try:
             await ws_manager.disconnect(user_id, websocket)
-            print(f"WebSocket connection closed for user {user_id}")
         except Exception as e:
-            print(f"Error during WebSocket cleanup for user {user_id}: {e}")
+            log.warning("db_update.cleanup_failed", user_id=user_id, error=str(e))
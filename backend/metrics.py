@@ -0,0 +1,137 @@
+# In metrics.py
+import functools
+import time
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from tracing import tracer
+
+TERMINAL_START_PHASE = Histogram(
+    "terminal_start_phase_seconds",
+    "Time spent in each /terminal/start phase",
+    ["phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+UPDATE_FILE_STEP = Histogram(
+    "update_file_step_seconds",
+    "Time spent in each update_file step",
+    ["step"],
+)
+FS_EVENT_LATENCY = Histogram(
+    "fs_event_seconds",
+    "fs_event handling latency by verb",
+    ["verb"],
+)
+TERMINAL_ECHO_LATENCY = Histogram(
+    "terminal_echo_seconds",
+    "Time from terminal input arriving to the next output reaching the client",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+NEONDB_QUERY = Histogram(
+    "neondb_query_seconds",
+    "NeonDB method latency",
+    ["method"],
+)
+NEONDB_READS = Counter(
+    "neondb_reads",
+    "Read-only NeonDB calls by the server that answered them",
+    ["target"],
+)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop's heartbeat woke up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls",
+    "Heartbeats delayed past the stall threshold",
+)
+FILE_CACHE_REQUESTS = Counter(
+    "file_content_cache_requests",
+    "File content cache lookups by result",
+    ["result"],
+)
+RESOURCE_STATS_CYCLE = Histogram(
+    "resource_stats_cycle_seconds",
+    "Time to sample stats for every managed container once",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+KERNEL_RUN = Histogram(
+    "kernel_run_seconds",
+    "Code runs on warm kernels, from request to completion, by final status",
+    ["status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+KERNEL_STARTS = Counter(
+    "kernel_starts",
+    "Kernel starts: cold for a container's first run, crash for restarts after the kernel died",
+    ["reason"],
+)
+RATE_LIMITED = Counter(
+    "rate_limited_requests",
+    "Requests rejected by the per-user rate limiter",
+    ["endpoint"],
+)
+CONTAINER_LIMIT_UPDATES = Counter(
+    "container_limit_updates",
+    "Live container limit changes made by the resource monitor",
+    ["resource", "direction"],
+)
+
+def timed_query(method):
+    """Decorator recording a NeonDB method's latency under its name, inside a span"""
+    histogram = NEONDB_QUERY.labels(method.__name__)
+    span_name = f"neondb.{method.__name__}"
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(span_name):
+                return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+class _RuntimeCollector:
+    """
+    Reads terminal and WebSocket state at scrape time. The terminal read loop
+    only bumps plain integers on its session, so it pays no metric locking.
+    """
+    def __init__(self, supervisor, ws_manager):
+        self.supervisor = supervisor
+        self.ws_manager = ws_manager
+
+    def collect(self):
+        sessions = list(self.supervisor.sessions.values())
+
+        bytes_total = CounterMetricFamily(
+            "terminal_ws_bytes", "Terminal bytes relayed, by direction", labels=["direction"]
+        )
+        bytes_total.add_metric(["out"], self.supervisor.retired_bytes_out + sum(s.bytes_out for s in sessions))
+        bytes_total.add_metric(["in"], self.supervisor.retired_bytes_in + sum(s.bytes_in for s in sessions))
+        yield bytes_total
+
+        yield GaugeMetricFamily("terminal_active_sessions", "Live supervised shells", value=len(sessions))
+        yield GaugeMetricFamily(
+            "terminal_attached_clients", "Shells with an attached WebSocket",
+            value=sum(1 for s in sessions if s.client is not None)
+        )
+        yield GaugeMetricFamily(
+            "terminal_viewers", "Read-only viewers across shared sessions",
+            value=sum(len(s.viewers) for s in sessions)
+        )
+
+        connections = GaugeMetricFamily(
+            "db_update_connections", "DBUpdateManager connections"
+        )
+        connections.add_metric([], sum(len(c) for c in self.ws_manager.active_connections.values()))
+        yield connections
+        yield GaugeMetricFamily(
+            "db_update_users", "Users with at least one DBUpdateManager connection",
+            value=len(self.ws_manager.active_connections)
+        )
+
+def register_runtime_collector(supervisor, ws_manager) -> None:
+    REGISTRY.register(_RuntimeCollector(supervisor, ws_manager))
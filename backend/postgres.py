@@ -1,92 +1,803 @@
 # In postgres.py
 import psycopg2
-from typing import Dict, List, Optional
+from datetime import datetime
+from psycopg2.extensions import parse_dsn
+from psycopg2.extras import execute_values
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from dotenv import load_dotenv
+import functools
 import os
+import threading
+import time
+import uuid
+import zlib
+from file_tree import TreeRow, build_tree
+from metrics import NEONDB_READS, timed_query
+from search import like_pattern, subsequence_pattern
+from structured_logging import get_logger
 
 load_dotenv()
 
+log = get_logger("postgres")
+
+# How many change-log rows to retain per user before older ones are pruned.
+# Clients further behind than this get a full snapshot instead of deltas.
+CHANGE_LOG_RETENTION = 1000
+
+# Per-user storage quotas over fs_nodes; 0 disables a limit. Usage is kept
+# in fs_user_usage by triggers, so checking it is one primary-key read.
+USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_BYTES", str(1024 ** 3)))
+USER_QUOTA_NODES = int(os.getenv("USER_QUOTA_NODES", "100000"))
+
+# Read replicas, as comma-separated DSNs. Read-only methods go to one of them
+# (the same one for a given user while it is healthy) instead of the primary.
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("PG_REPLICA_DSNS", "").split(",") if dsn.strip()]
+# After a user writes, their reads stay on the primary for this long. Replicas
+# lagging further behind are skipped, so a read after the window sees the write.
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+REPLICA_CHECK_INTERVAL = 2.0    # seconds between lag checks of a replica in use
+REPLICA_RETRY_SECONDS = 30.0    # a failed replica is left alone this long before reconnecting
+REPLICA_CONNECT_TIMEOUT = 2     # seconds; an unreachable replica mustn't stall reads for long
+
+# to_char format matching datetime.isoformat() for a UTC timestamp with microseconds
+ISO_UTC = """'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'"""
+
+class QuotaExceeded(ValueError):
+    """A write would take a user past their storage quota"""
+
+def _utf8_len(content: Optional[str]) -> int:
+    """Bytes content takes in fs_nodes (octet_length), without encoding ASCII text"""
+    if not content:
+        return 0
+    return len(content) if content.isascii() else len(content.encode("utf-8"))
+
+class _Replica:
+    """A read replica's connection, opened on first use, lag-checked while in use and reopened after failures"""
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.host = parse_dsn(dsn).get("host", "")
+        self.conn = None
+        self.lag = 0.0          # seconds behind the primary at the last check
+        self.checked_at = 0.0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self, now: float) -> bool:
+        return self.conn is not None and self.conn.closed == 0 and now - self.checked_at < REPLICA_CHECK_INTERVAL
+
+    def available(self) -> bool:
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        if not self._fresh(now):
+            with self._lock:
+                if not self._fresh(now):
+                    try:
+                        self._check()
+                    except psycopg2.Error as e:
+                        self.failed(e)
+                        return False
+        return self.lag <= REPLICA_PIN_SECONDS
+
+    def _check(self) -> None:
+        if self.conn is None or self.conn.closed != 0:
+            self.conn = psycopg2.connect(self.dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            self.conn.set_session(readonly=True, autocommit=True)
+            log.info("neondb.replica_connected", host=self.host)
+        with self.conn.cursor() as cursor:
+            # Caught up with everything received means no lag, even if the primary has been idle.
+            # A server that isn't a standby (e.g. a second local instance) reads as 0
+            cursor.execute("""
+                SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                       END
+            """)
+            lag = float(cursor.fetchone()[0] or 0)
+        if lag > REPLICA_PIN_SECONDS >= self.lag:
+            log.warning("neondb.replica_lagging", host=self.host, lag_seconds=round(lag, 3))
+        self.lag = lag
+        self.checked_at = time.monotonic()
+
+    def failed(self, error: Exception) -> None:
+        """Take the replica out of rotation for REPLICA_RETRY_SECONDS"""
+        self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        log.warning("neondb.replica_down", host=self.host, error=str(error))
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+
+    def close(self) -> None:
+        if self.conn is not None and self.conn.closed == 0:
+            self.conn.close()
+
+def replica_read(method):
+    """
+    Run a read-only NeonDB method (taking user_id first) on the user's replica,
+    if one is healthy and the user hasn't written in the last
+    REPLICA_PIN_SECONDS; otherwise, or if the replica fails, on the primary.
+    The method reads through self._reader rather than self.conn.
+    """
+    @functools.wraps(method)
+    def wrapper(self, user_id, *args, **kwargs):
+        replica = self._replica_for(user_id)
+        if replica is not None:
+            outer = getattr(self._local, "conn", None)
+            self._local.conn = replica.conn
+            try:
+                result = method(self, user_id, *args, **kwargs)
+                NEONDB_READS.labels("replica").inc()
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                replica.failed(e)
+            finally:
+                self._local.conn = outer
+        NEONDB_READS.labels("primary").inc()
+        return method(self, user_id, *args, **kwargs)
+    return wrapper
+
 class NeonDB:
-    def __init__(self): 
+    _schema_ready = False
+    _trigram = False  # pg_trgm is available for fuzzy name ranking
+    # user_id -> monotonic time until which their reads stay on the primary (this process only)
+    _pinned_until: Dict[str, float] = {}
+    _pin_lock = threading.Lock()
+
+    def __init__(self, dsn: Optional[str] = None, replica_dsns: Optional[Sequence[str]] = None):
+        """
+        dsn defaults to the PG* variables; replica_dsns to PG_REPLICA_DSNS. Pass
+        replica_dsns=() for a primary-only instance, e.g. for code that reads
+        the tree to plan its own writes.
+        """
+        self.dsn = dsn
         self.conn = None
+        self._replicas = [_Replica(d) for d in (REPLICA_DSNS if replica_dsns is None else replica_dsns)]
+        self._local = threading.local()
         self.connect()
 
     def connect(self):
-        self.conn = psycopg2.connect(
-            host=os.getenv("PGHOST"),
-            port=os.getenv("PGPORT"),
-            user=os.getenv("PGUSER"),
-            password=os.getenv("PGPASSWORD"),
-            dbname=os.getenv("PGDATABASE"),
-        )
+        if self.dsn:
+            self.conn = psycopg2.connect(self.dsn)
+        else:
+            self.conn = psycopg2.connect(
+                host=os.getenv("PGHOST"),
+                port=os.getenv("PGPORT"),
+                user=os.getenv("PGUSER"),
+                password=os.getenv("PGPASSWORD"),
+                dbname=os.getenv("PGDATABASE"),
+            )
         self.conn.autocommit = True
+        log.debug("neondb.connected", host=self.conn.info.host, dbname=self.conn.info.dbname)
+        if not NeonDB._schema_ready:
+            self.ensure_change_log_schema()
+            self.ensure_usage_schema()
+            self.ensure_rate_limit_schema()
+            NeonDB._trigram = self.ensure_search_schema()
+            NeonDB._schema_ready = True
+
+    def close(self) -> None:
+        if self.conn is not None and self.conn.closed == 0:
+            self.conn.close()
+        for replica in self._replicas:
+            replica.close()
+
+    def ensure_connection(self) -> None:
+        """Reconnect if the connection was closed (e.g. by an idle timeout)"""
+        if self.conn is None or self.conn.closed != 0:
+            self.connect()
+
+    @property
+    def _reader(self):
+        """The connection reads use: the replica chosen by replica_read, else the primary"""
+        return getattr(self._local, "conn", None) or self.conn
+
+    def _replica_for(self, user_id: str) -> Optional[_Replica]:
+        """The user's replica (or the next healthy one), or None to read from the primary"""
+        if not self._replicas:
+            return None
+        with NeonDB._pin_lock:
+            pinned_until = NeonDB._pinned_until.get(user_id, 0.0)
+        if pinned_until > time.monotonic():
+            return None
+        start = zlib.crc32(user_id.encode("utf-8"))
+        for i in range(len(self._replicas)):
+            replica = self._replicas[(start + i) % len(self._replicas)]
+            if replica.available():
+                return replica
+        return None
+
+    def read_route(self, user_id: str) -> str:
+        """Where user_id's next read would go: 'primary' or the replica's host"""
+        replica = self._replica_for(user_id)
+        return "primary" if replica is None else replica.host or "replica"
+
+    @staticmethod
+    def _pin(user_id: str) -> None:
+        """Read-your-writes: keep user_id's reads on the primary until replicas have caught up"""
+        now = time.monotonic()
+        # Writes come from executor threads, so don't let the prune iterate mid-insert
+        with NeonDB._pin_lock:
+            pinned = NeonDB._pinned_until
+            if len(pinned) > 10000:
+                for key in [k for k, until in pinned.items() if until <= now]:
+                    del pinned[key]
+            pinned[user_id] = now + REPLICA_PIN_SECONDS
+
+    def ensure_change_log_schema(self) -> None:
+        """
+        Create the per-user tree revision counter and node change log, kept by
+        statement-level triggers on fs_nodes. Every writer is covered (the
+        frontend's routes and cascaded deletes included), and a node write and
+        its revision bump commit together.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS fs_tree_revisions (
+                    user_id TEXT PRIMARY KEY,
+                    revision BIGINT NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS fs_node_changes (
+                    user_id TEXT NOT NULL,
+                    revision BIGINT NOT NULL,
+                    node_id BIGINT NOT NULL,
+                    op CHAR(1) NOT NULL,
+                    PRIMARY KEY (user_id, revision)
+                );
+            """)
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'fs_nodes_changes_delete'")
+            if cursor.fetchone():
+                return
+            try:
+                self._create_change_log_triggers(cursor)
+            except psycopg2.Error as e:
+                # Another worker racing through the same DDL; its run installs the same triggers
+                log.warning("neondb.change_log_schema_failed", error=str(e))
+
+    def _create_change_log_triggers(self, cursor) -> None:
+        # Each changed row gets its own revision ('u'psert or 'd'elete), in id order
+        # per user; the log is pruned in batches as the revision crosses each 100
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION fs_nodes_log_changes() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                change_op CHAR(1) := CASE WHEN TG_OP = 'DELETE' THEN 'd' ELSE 'u' END;
+                changed_users TEXT[];
+                changed_ids BIGINT[];
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    SELECT array_agg(user_id ORDER BY id), array_agg(id ORDER BY id)
+                    INTO changed_users, changed_ids FROM old_rows;
+                ELSE
+                    SELECT array_agg(user_id ORDER BY id), array_agg(id ORDER BY id)
+                    INTO changed_users, changed_ids FROM new_rows;
+                END IF;
+                IF changed_ids IS NULL THEN
+                    RETURN NULL;
+                END IF;
+                WITH changed AS (
+                    SELECT c.user_id, c.node_id,
+                           ROW_NUMBER() OVER (PARTITION BY c.user_id ORDER BY c.ord) AS ord,
+                           COUNT(*) OVER (PARTITION BY c.user_id) AS n
+                    FROM unnest(changed_users, changed_ids) WITH ORDINALITY AS c(user_id, node_id, ord)
+                ),
+                counts AS (
+                    SELECT user_id, MAX(n) AS n FROM changed GROUP BY user_id
+                ),
+                rev AS (
+                    INSERT INTO fs_tree_revisions AS r (user_id, revision)
+                    SELECT user_id, n FROM counts
+                    ON CONFLICT (user_id) DO UPDATE SET revision = r.revision + EXCLUDED.revision
+                    RETURNING r.user_id, r.revision
+                ),
+                logged AS (
+                    INSERT INTO fs_node_changes (user_id, revision, node_id, op)
+                    SELECT c.user_id, rev.revision - c.n + c.ord, c.node_id, change_op
+                    FROM changed c JOIN rev ON rev.user_id = c.user_id
+                )
+                DELETE FROM fs_node_changes stale
+                USING rev JOIN counts ON counts.user_id = rev.user_id
+                WHERE stale.user_id = rev.user_id
+                AND rev.revision / 100 <> (rev.revision - counts.n) / 100
+                AND stale.revision <= rev.revision - {CHANGE_LOG_RETENTION};
+                RETURN NULL;
+            END $$;
+            DROP TRIGGER IF EXISTS fs_nodes_changes_insert ON fs_nodes;
+            DROP TRIGGER IF EXISTS fs_nodes_changes_update ON fs_nodes;
+            DROP TRIGGER IF EXISTS fs_nodes_changes_delete ON fs_nodes;
+            CREATE TRIGGER fs_nodes_changes_insert AFTER INSERT ON fs_nodes
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_log_changes();
+            CREATE TRIGGER fs_nodes_changes_update AFTER UPDATE ON fs_nodes
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_log_changes();
+            CREATE TRIGGER fs_nodes_changes_delete AFTER DELETE ON fs_nodes
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_log_changes();
+        """)
+
+    def ensure_usage_schema(self) -> None:
+        """
+        Per-user byte and node totals, maintained by statement-level triggers on
+        fs_nodes (cascaded deletes included). The first run backfills the
+        totals; the trigger DDL locks fs_nodes until then so none are missed.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'fs_nodes_usage_delete'")
+            if cursor.fetchone():
+                return
+            try:
+                self._create_usage_schema(cursor)
+            except psycopg2.Error as e:
+                # Another worker racing through the same DDL; its run installs the same schema
+                log.warning("neondb.usage_schema_failed", error=str(e))
+
+    def _create_usage_schema(self, cursor) -> None:
+        # One execute: the whole script commits (or fails) as one transaction
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fs_user_usage (
+                user_id TEXT PRIMARY KEY,
+                bytes BIGINT NOT NULL DEFAULT 0,
+                nodes BIGINT NOT NULL DEFAULT 0
+            );
+            CREATE OR REPLACE FUNCTION fs_nodes_track_usage() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO fs_user_usage AS u (user_id, bytes, nodes)
+                    SELECT user_id, COALESCE(SUM(octet_length(content)), 0), COUNT(*)
+                    FROM new_rows GROUP BY user_id
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET bytes = u.bytes + EXCLUDED.bytes, nodes = u.nodes + EXCLUDED.nodes;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    UPDATE fs_user_usage u SET bytes = u.bytes + d.bytes
+                    FROM (
+                        SELECT user_id, SUM(delta) AS bytes FROM (
+                            SELECT user_id, COALESCE(octet_length(content), 0) AS delta FROM new_rows
+                            UNION ALL
+                            SELECT user_id, -COALESCE(octet_length(content), 0) FROM old_rows
+                        ) changes
+                        GROUP BY user_id
+                        HAVING SUM(delta) <> 0
+                    ) d
+                    WHERE u.user_id = d.user_id;
+                ELSE
+                    UPDATE fs_user_usage u SET bytes = u.bytes - d.bytes, nodes = u.nodes - d.nodes
+                    FROM (
+                        SELECT user_id, COALESCE(SUM(octet_length(content)), 0) AS bytes, COUNT(*) AS nodes
+                        FROM old_rows GROUP BY user_id
+                    ) d
+                    WHERE u.user_id = d.user_id;
+                END IF;
+                RETURN NULL;
+            END $$;
+            DROP TRIGGER IF EXISTS fs_nodes_usage_insert ON fs_nodes;
+            DROP TRIGGER IF EXISTS fs_nodes_usage_update ON fs_nodes;
+            DROP TRIGGER IF EXISTS fs_nodes_usage_delete ON fs_nodes;
+            CREATE TRIGGER fs_nodes_usage_insert AFTER INSERT ON fs_nodes
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_track_usage();
+            CREATE TRIGGER fs_nodes_usage_update AFTER UPDATE ON fs_nodes
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_track_usage();
+            CREATE TRIGGER fs_nodes_usage_delete AFTER DELETE ON fs_nodes
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION fs_nodes_track_usage();
+            INSERT INTO fs_user_usage (user_id, bytes, nodes)
+            SELECT user_id, COALESCE(SUM(octet_length(content)), 0), COUNT(*)
+            FROM fs_nodes GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET bytes = EXCLUDED.bytes, nodes = EXCLUDED.nodes;
+        """)
+
+    def ensure_rate_limit_schema(self) -> None:
+        """Token buckets for rate limits shared by every worker (RATE_LIMIT_SHARED=1)"""
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    user_id TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    tokens DOUBLE PRECISION NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (user_id, endpoint)
+                )
+            """)
+
+    def ensure_search_schema(self) -> bool:
+        """
+        Trigram indexes on fs_nodes names and contents. Postgres maintains them
+        on every insert/update, so create_node and update_file_content keep
+        search current without extra writes. Returns False if pg_trgm is
+        unavailable, in which case searches run unindexed.
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                # CONCURRENTLY so the first deploy doesn't block writes while building
+                cursor.execute(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS fs_nodes_name_trgm "
+                    "ON fs_nodes USING gin (name gin_trgm_ops)"
+                )
+                cursor.execute(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS fs_nodes_content_trgm "
+                    "ON fs_nodes USING gin (content gin_trgm_ops) WHERE NOT is_dir"
+                )
+            return True
+        except psycopg2.Error as e:
+            log.warning("neondb.search_schema_failed", error=str(e))
+            return False
+
+    def _check_quota(self, cursor, user_id: str, add_bytes: int = 0, add_nodes: int = 0,
+                     replacing: Sequence[int] = ()) -> None:
+        """
+        Raise QuotaExceeded if writing add_bytes of content (over the current
+        content of the replacing ids) and add_nodes new nodes would exceed the
+        user's quota. Writes that don't grow usage always pass, so a user over
+        a lowered quota can still shrink and delete files.
+        """
+        check_bytes = USER_QUOTA_BYTES and add_bytes > 0
+        check_nodes = USER_QUOTA_NODES and add_nodes > 0
+        if not (check_bytes or check_nodes):
+            return
+        cursor.execute("""
+            SELECT COALESCE((SELECT bytes FROM fs_user_usage WHERE user_id = %s), 0),
+                   COALESCE((SELECT nodes FROM fs_user_usage WHERE user_id = %s), 0),
+                   COALESCE((SELECT SUM(octet_length(content)) FROM fs_nodes
+                             WHERE user_id = %s AND id = ANY(%s)), 0)
+        """, (user_id, user_id, user_id, list(replacing)))
+        used_bytes, used_nodes, replaced = cursor.fetchone()
+        if check_nodes and used_nodes + add_nodes > USER_QUOTA_NODES:
+            raise QuotaExceeded(f"Node quota exceeded: {used_nodes} of {USER_QUOTA_NODES} files and directories used")
+        if check_bytes and add_bytes > replaced and used_bytes - replaced + add_bytes > USER_QUOTA_BYTES:
+            raise QuotaExceeded(f"Storage quota exceeded: {used_bytes} of {USER_QUOTA_BYTES} bytes used")
+
+    @timed_query
+    @replica_read
+    def get_usage(self, user_id: str) -> Dict:
+        """The user's stored bytes and node count, with their quotas (0 = unlimited)"""
+        with self._reader.cursor() as cursor:
+            cursor.execute("SELECT bytes, nodes FROM fs_user_usage WHERE user_id = %s", (user_id,))
+            used_bytes, used_nodes = cursor.fetchone() or (0, 0)
+        return {"bytes": used_bytes, "nodes": used_nodes,
+                "quota_bytes": USER_QUOTA_BYTES, "quota_nodes": USER_QUOTA_NODES}
+
+    @timed_query
+    def take_rate_token(self, user_id: str, endpoint: str, rate: float, burst: int) -> float:
+        """
+        Refill the shared (user_id, endpoint) bucket and take a token from it if
+        it holds one. Returns the tokens held before the take, so the call is
+        admitted iff the result is >= 1. Refill uses the database clock, so
+        every worker sees the same bucket.
+        """
+        with self.conn.cursor() as cursor:
+            while True:
+                cursor.execute("""
+                    WITH refill AS (
+                        SELECT LEAST(%s, tokens + %s * EXTRACT(EPOCH FROM clock_timestamp() - updated_at)) AS tokens
+                        FROM rate_limit_buckets
+                        WHERE user_id = %s AND endpoint = %s
+                        FOR UPDATE
+                    )
+                    UPDATE rate_limit_buckets b
+                    SET tokens = r.tokens - CASE WHEN r.tokens >= 1 THEN 1 ELSE 0 END,
+                        updated_at = clock_timestamp()
+                    FROM refill r
+                    WHERE b.user_id = %s AND b.endpoint = %s
+                    RETURNING r.tokens
+                """, (burst, rate, user_id, endpoint, user_id, endpoint))
+                row = cursor.fetchone()
+                if row:
+                    return float(row[0])
+                # First call: start full, minus this one. Losing the insert race means the row now exists
+                cursor.execute("""
+                    INSERT INTO rate_limit_buckets (user_id, endpoint, tokens, updated_at)
+                    VALUES (%s, %s, %s, clock_timestamp())
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                """, (user_id, endpoint, burst - 1))
+                if cursor.fetchone():
+                    return float(burst)
+
+    @timed_query
+    @replica_read
+    def get_tree_revision(self, user_id: str) -> int:
+        """Get the current revision of a user's tree (0 if never modified)"""
+        with self._reader.cursor() as cursor:
+            cursor.execute(
+                "SELECT revision FROM fs_tree_revisions WHERE user_id = %s",
+                (user_id,)
+            )
+            result = cursor.fetchone()
+            return result[0] if result else 0
+
+    @timed_query
+    @replica_read
+    def get_changes_since(self, user_id: str, revision: int) -> Optional[Dict]:
+        """
+        Get the node-level deltas for a user's tree since a revision.
+
+        Multiple changes to the same node are collapsed into its latest state.
+        Returns None if the change log no longer covers the requested revision
+        and the caller should fall back to a full snapshot.
+        """
+        with self._reader.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    COALESCE((SELECT revision FROM fs_tree_revisions WHERE user_id = %s), 0),
+                    (SELECT MIN(revision) FROM fs_node_changes WHERE user_id = %s)
+            """, (user_id, user_id))
+            current, oldest = cursor.fetchone()
+
+            if revision > current or (revision < current and (oldest is None or revision < oldest - 1)):
+                return None
+            if revision == current:
+                return {'revision': current, 'changes': []}
+
+            cursor.execute("""
+                SELECT c.node_id, c.op, n.id, n.parent_id, n.name, n.is_dir, n.content, n.updated_at
+                FROM (
+                    SELECT DISTINCT ON (node_id) node_id, op, revision
+                    FROM fs_node_changes
+                    WHERE user_id = %s AND revision > %s AND revision <= %s
+                    ORDER BY node_id, revision DESC
+                ) c
+                LEFT JOIN fs_nodes n ON n.id = c.node_id AND n.user_id = %s
+                ORDER BY c.revision
+            """, (user_id, revision, current, user_id))
+
+            changes = []
+            for node_id, op, exists, parent_id, name, is_dir, content, updated_at in cursor.fetchall():
+                if op == 'd' or exists is None:
+                    changes.append({'op': 'delete', 'id': node_id})
+                else:
+                    changes.append({
+                        'op': 'upsert',
+                        'id': node_id,
+                        'parent_id': parent_id,
+                        'name': name,
+                        'is_dir': is_dir,
+                        'content': content,
+                        'updated_at': updated_at.isoformat() if updated_at else None
+                    })
+            return {'revision': current, 'changes': changes}
+
+    @timed_query
+    @replica_read
+    def get_tree_rows(self, user_id: str, parent_id: int = None) -> List[TreeRow]:
+        """
+        Get a user's nodes (or the subtree under parent_id) as flat row tuples
+        in ROW_FIELDS order, directories first and then by name. Timestamps
+        come back as ISO 8601 text, so encoding a large tree doesn't spend
+        its time parsing and re-formatting datetimes.
+        """
+        with self._reader.cursor() as cursor:
+            if parent_id is None:
+                # The whole tree is every node the user owns: no recursion needed
+                cursor.execute(f"""
+                    SELECT id, parent_id, name, is_dir, content,
+                           to_char(created_at AT TIME ZONE 'UTC', {ISO_UTC}),
+                           to_char(updated_at AT TIME ZONE 'UTC', {ISO_UTC})
+                    FROM fs_nodes
+                    WHERE user_id = %s
+                    ORDER BY is_dir DESC, name
+                """, (user_id,))
+            else:
+                cursor.execute(f"""
+                    WITH RECURSIVE file_tree AS (
+                        SELECT id, parent_id, name, is_dir, content, created_at, updated_at
+                        FROM fs_nodes
+                        WHERE user_id = %s AND parent_id = %s
+
+                        UNION ALL
+
+                        SELECT f.id, f.parent_id, f.name, f.is_dir, f.content, f.created_at, f.updated_at
+                        FROM fs_nodes f
+                        JOIN file_tree ft ON f.parent_id = ft.id
+                        WHERE f.user_id = %s
+                    )
+                    SELECT id, parent_id, name, is_dir, content,
+                           to_char(created_at AT TIME ZONE 'UTC', {ISO_UTC}),
+                           to_char(updated_at AT TIME ZONE 'UTC', {ISO_UTC})
+                    FROM file_tree
+                    ORDER BY is_dir DESC, name
+                """, (user_id, parent_id, user_id))
+            return cursor.fetchall()
 
     def get_user_file_structure(self, user_id: str, parent_id: int = None) -> List[Dict]:
         """Get the file structure for a user as a tree structure"""
-        with self.conn.cursor() as cursor:
+        return build_tree(self.get_tree_rows(user_id, parent_id), parent_id)
+
+    @timed_query
+    @replica_read
+    def get_node_paths(self, user_id: str) -> Dict[str, Dict]:
+        """Map each of a user's nodes by its workspace-relative path (e.g. 'src/app.py')"""
+        with self._reader.cursor() as cursor:
             cursor.execute("""
-                WITH RECURSIVE file_tree AS (
-                    -- Base case: select root nodes (where parent_id is NULL)
-                    SELECT 
-                        id, 
-                        parent_id, 
-                        name, 
-                        is_dir, 
-                        content,
-                        created_at,
-                        updated_at,
-                        ARRAY[]::TEXT[] as path
-                    FROM fs_nodes 
-                    WHERE user_id = %s AND (parent_id = %s OR (%s IS NULL AND parent_id IS NULL))
-                    
+                WITH RECURSIVE node_paths AS (
+                    SELECT id, is_dir, updated_at, name::text AS path
+                    FROM fs_nodes
+                    WHERE user_id = %s AND parent_id IS NULL
                     UNION ALL
-                    
-                    -- Recursive case: join with children
-                    SELECT 
-                        f.id, 
-                        f.parent_id, 
-                        f.name, 
-                        f.is_dir, 
-                        f.content,
-                        f.created_at,
-                        f.updated_at,
-                        ft.path || f.name as path
+                    SELECT f.id, f.is_dir, f.updated_at, np.path || '/' || f.name
                     FROM fs_nodes f
-                    JOIN file_tree ft ON f.parent_id = ft.id
+                    JOIN node_paths np ON f.parent_id = np.id
                     WHERE f.user_id = %s
                 )
-                SELECT 
-                    id,
-                    parent_id,
-                    name,
-                    is_dir,
-                    content,
-                    created_at,
-                    updated_at
-                FROM file_tree
-                ORDER BY is_dir DESC, name
-            """, (user_id, parent_id, parent_id, user_id))
-            
-            nodes = []
-            for row in cursor.fetchall():
-                node = {
-                    'id': row[0],
-                    'parent_id': row[1],
-                    'name': row[2],
-                    'is_dir': row[3],
-                    'content': row[4],
-                    'created_at': row[5].isoformat() if row[5] else None,
-                    'updated_at': row[6].isoformat() if row[6] else None,
-                    'children': []
-                }
-                nodes.append(node)
-            
-            # Convert flat list to tree structure
-            return self._build_tree(nodes)
+                SELECT id, is_dir, updated_at, path FROM node_paths
+            """, (user_id, user_id))
+            return {
+                path: {'id': node_id, 'is_dir': is_dir, 'updated_at': updated_at}
+                for node_id, is_dir, updated_at, path in cursor.fetchall()
+            }
 
+    @timed_query
+    @replica_read
+    def find_child_id(self, user_id: str, parent_id: Optional[int], name: str) -> Optional[int]:
+        """Get the id of the node called name directly under parent_id (None for the root)"""
+        with self._reader.cursor() as cursor:
+            if parent_id is None:
+                cursor.execute(
+                    "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id IS NULL AND name = %s",
+                    (user_id, name)
+                )
+            else:
+                cursor.execute(
+                    "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s",
+                    (user_id, parent_id, name)
+                )
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    @timed_query
+    def resolve_path(self, user_id: str, path: str) -> Optional[int]:
+        """Get the id of the node at a workspace-relative path like 'src/app.py'"""
+        node_id = None
+        for part in path.split("/"):
+            node_id = self.find_child_id(user_id, node_id, part)
+            if node_id is None:
+                return None
+        return node_id
+
+    @timed_query
+    @replica_read
+    def get_node_path(self, user_id: str, node_id: int) -> Optional[str]:
+        """Get the workspace-relative path of a node by walking up its parents"""
+        with self._reader.cursor() as cursor:
+            cursor.execute("""
+                WITH RECURSIVE file_path AS (
+                    SELECT id, parent_id, name, name::text AS path
+                    FROM fs_nodes
+                    WHERE id = %s AND user_id = %s
+                    UNION ALL
+                    SELECT p.id, p.parent_id, p.name, (p.name || '/' || fp.path)
+                    FROM fs_nodes p
+                    JOIN file_path fp ON p.id = fp.parent_id
+                )
+                SELECT path FROM file_path WHERE parent_id IS NULL
+            """, (node_id, user_id))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    @timed_query
+    @replica_read
+    def get_node(self, user_id: str, node_id: int) -> Optional[Dict]:
+        """Get a node's id, parent_id, name and is_dir (not its content)"""
+        with self._reader.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, parent_id, name, is_dir FROM fs_nodes WHERE id = %s AND user_id = %s",
+                (node_id, user_id)
+            )
+            result = cursor.fetchone()
+            if not result:
+                return None
+            return {'id': result[0], 'parent_id': result[1], 'name': result[2], 'is_dir': result[3]}
+
+    @timed_query
+    @replica_read
+    def has_children(self, user_id: str, node_id: int) -> bool:
+        """Whether anything lives directly under a directory"""
+        with self._reader.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM fs_nodes WHERE user_id = %s AND parent_id = %s)",
+                (user_id, node_id)
+            )
+            return cursor.fetchone()[0]
+
+    @timed_query
+    @replica_read
+    def search_file_names(self, user_id: str, query: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        """
+        Fuzzy file-name search for quick-open: names containing the query's
+        characters in order, best trigram similarity first. Returns rows of
+        {id, name, path}.
+
+        With pg_trgm, queries of 3+ characters are first narrowed through the
+        name index to names containing the query or passing the word
+        similarity threshold (<%), then rechecked as a subsequence. A scattered
+        match that shares too few trigrams ('mpy' for main.py) is not found.
+        """
+        score = "similarity(name, %(query)s)" if NeonDB._trigram else "0"
+        prefilter = ""
+        if NeonDB._trigram and len(query) >= 3:
+            # '%m%p%y%' yields no trigrams, so the subsequence test alone can't use the index
+            prefilter = "AND (name ILIKE %(substring)s ESCAPE '\\' OR %(query)s <%% name)"
+        with self._reader.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE hits AS (
+                    SELECT id, parent_id, name, {score} AS score
+                    FROM fs_nodes
+                    WHERE user_id = %(user_id)s AND NOT is_dir
+                    {prefilter}
+                    AND name ILIKE %(pattern)s ESCAPE '\\'
+                    ORDER BY score DESC, length(name), id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                ),
+                up AS (
+                    SELECT id AS node_id, parent_id, name::text AS path FROM hits
+                    UNION ALL
+                    SELECT up.node_id, p.parent_id, p.name || '/' || up.path
+                    FROM fs_nodes p
+                    JOIN up ON p.id = up.parent_id
+                )
+                SELECT h.id, h.name, up.path
+                FROM hits h
+                JOIN up ON up.node_id = h.id AND up.parent_id IS NULL
+                ORDER BY h.score DESC, length(h.name), h.id
+            """, {
+                "user_id": user_id,
+                "query": query,
+                "substring": like_pattern(query),
+                "pattern": subsequence_pattern(query),
+                "limit": limit,
+                "offset": offset,
+            })
+            return [{'id': node_id, 'name': name, 'path': path} for node_id, name, path in cursor.fetchall()]
+
+    @timed_query
+    @replica_read
+    def search_file_contents(self, user_id: str, query: str, limit: int = 20, offset: int = 0,
+                             case_sensitive: bool = False) -> List[Dict]:
+        """
+        Substring search over file contents for find-in-project, served by the
+        trigram index. Returns rows of {id, path, content}, grouped by
+        directory; paths are only resolved for the requested page.
+        """
+        operator = "LIKE" if case_sensitive else "ILIKE"
+        with self._reader.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE hits AS (
+                    SELECT id, parent_id, name, content
+                    FROM fs_nodes
+                    WHERE user_id = %(user_id)s AND NOT is_dir
+                    AND content {operator} %(pattern)s ESCAPE '\\'
+                    ORDER BY parent_id NULLS FIRST, name, id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                ),
+                up AS (
+                    SELECT id AS node_id, parent_id, name::text AS path FROM hits
+                    UNION ALL
+                    SELECT up.node_id, p.parent_id, p.name || '/' || up.path
+                    FROM fs_nodes p
+                    JOIN up ON p.id = up.parent_id
+                )
+                SELECT h.id, up.path, h.content
+                FROM hits h
+                JOIN up ON up.node_id = h.id AND up.parent_id IS NULL
+                ORDER BY h.parent_id NULLS FIRST, h.name, h.id
+            """, {
+                "user_id": user_id,
+                "pattern": like_pattern(query),
+                "limit": limit,
+                "offset": offset,
+            })
+            return [{'id': node_id, 'path': path, 'content': content} for node_id, path, content in cursor.fetchall()]
+
+    @timed_query
+    @replica_read
     def get_file_content(self, user_id: str, file_id: int) -> Optional[str]:
         """Get the content of a specific file by ID"""
-        with self.conn.cursor() as cursor:
+        with self._reader.cursor() as cursor:
             cursor.execute(
                 """
                 SELECT content 
@@ -98,24 +809,54 @@ class NeonDB:
             result = cursor.fetchone()
             return result[0] if result else None
 
+    @timed_query
+    @replica_read
+    def get_file_version(self, user_id: str, file_id: int) -> Optional[datetime]:
+        """Get a file's updated_at without fetching its content (None if there is no such file)"""
+        with self._reader.cursor() as cursor:
+            cursor.execute(
+                "SELECT updated_at FROM fs_nodes WHERE user_id = %s AND id = %s AND NOT is_dir",
+                (user_id, file_id)
+            )
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    @timed_query
+    @replica_read
+    def get_file_with_version(self, user_id: str, file_id: int) -> Optional[Tuple[Optional[str], datetime]]:
+        """Get a file's (content, updated_at) from the same row, so the two always agree"""
+        with self._reader.cursor() as cursor:
+            cursor.execute(
+                "SELECT content, updated_at FROM fs_nodes WHERE user_id = %s AND id = %s AND NOT is_dir",
+                (user_id, file_id)
+            )
+            result = cursor.fetchone()
+            return (result[0], result[1]) if result else None
+
+    @timed_query
     def update_file_content(
         self,
         user_id: str,
         file_id: int,
         content: str
-    ) -> None:
-        """Update a file's content by ID"""
+    ) -> datetime:
+        """Update a file's content by ID and return its new updated_at"""
         with self.conn.cursor() as cursor:
+            self._check_quota(cursor, user_id, _utf8_len(content), replacing=(file_id,))
             cursor.execute("""
                 UPDATE fs_nodes 
                 SET content = %s, updated_at = NOW()
                 WHERE id = %s AND user_id = %s AND NOT is_dir
-                RETURNING id
+                RETURNING updated_at
             """, (content, file_id, user_id))
             
-            if not cursor.fetchone():
+            result = cursor.fetchone()
+            if not result:
                 raise ValueError("File not found or not a file")
+            self._pin(user_id)
+            return result[0]
 
+    @timed_query
     def delete_node(self, user_id: str, node_id: int) -> None:
         """Delete a file or directory by ID (recursively for directories)"""
         with self.conn.cursor() as cursor:
@@ -132,7 +873,9 @@ class NeonDB:
                 "DELETE FROM fs_nodes WHERE id = %s RETURNING is_dir",
                 (node_id,)
             )
+            self._pin(user_id)
 
+    @timed_query
     def create_node(
         self,
         user_id: str,
@@ -165,6 +908,7 @@ class NeonDB:
                 )
             if cursor.fetchone():
                 raise ValueError("A node with this name already exists in the specified location")
+            self._check_quota(cursor, user_id, _utf8_len(content), 1)
             
             # Create the node
             cursor.execute("""
@@ -177,6 +921,7 @@ class NeonDB:
             """, (user_id, parent_id, name, is_dir, content))
             
             node_id, created_at, updated_at = cursor.fetchone()
+            self._pin(user_id)
             
             return {
                 'id': node_id,
@@ -189,26 +934,172 @@ class NeonDB:
                 'children': []
             }
     
-    def _build_tree(self, nodes: List[Dict]) -> List[Dict]:
-        """Helper method to convert flat list of nodes into a tree structure"""
-        node_map = {}
-        root_nodes = []
-        
-        # First pass: create a map of all nodes
-        for node in nodes:
-            node_id = node['id']
-            node_map[node_id] = node
-        
-        # Second pass: build the tree
-        for node in nodes:
-            parent_id = node['parent_id']
-            if parent_id is None:
-                root_nodes.append(node)
-            else:
-                parent = node_map.get(parent_id)
-                if parent:
-                    if 'children' not in parent:
-                        parent['children'] = []
-                    parent['children'].append(node)
-        
-        return root_nodes
\ No newline at end of file
+    @timed_query
+    def create_nodes(self, user_id: str, rows: Sequence[Tuple[Optional[int], str, bool, Optional[str]]]) -> List[int]:
+        """
+        Insert many (parent_id, name, is_dir, content) rows in one statement and
+        return their ids in order. Unlike create_node, parents and duplicate
+        names are not checked; the caller resolves paths first.
+        """
+        if not rows:
+            return []
+        with self.conn.cursor() as cursor:
+            self._check_quota(cursor, user_id, sum(_utf8_len(row[3]) for row in rows), len(rows))
+            # One VALUES list per call; ids come back in the order of the rows
+            ids = [row[0] for row in execute_values(cursor, """
+                INSERT INTO fs_nodes (user_id, parent_id, name, is_dir, content)
+                VALUES %s
+                RETURNING id
+            """, [(user_id, *row) for row in rows], page_size=len(rows), fetch=True)]
+            self._pin(user_id)
+            return ids
+
+    @timed_query
+    def update_file_contents(self, user_id: str, updates: Sequence[Tuple[int, str]]) -> None:
+        """Overwrite the content of many files, given as (id, content), in one statement"""
+        if not updates:
+            return
+        with self.conn.cursor() as cursor:
+            self._check_quota(cursor, user_id, sum(_utf8_len(content) for _, content in updates),
+                              replacing=[node_id for node_id, _ in updates])
+            execute_values(cursor, """
+                UPDATE fs_nodes f
+                SET content = v.content, updated_at = NOW()
+                FROM (VALUES %s) AS v(id, user_id, content)
+                WHERE f.id = v.id AND f.user_id = v.user_id AND NOT f.is_dir
+            """, [(node_id, user_id, content) for node_id, content in updates], page_size=len(updates))
+            self._pin(user_id)
+
+    def _check_destination(self, cursor, user_id: str, node_id: int, parent_id: Optional[int], name: str,
+                           moving: bool) -> None:
+        """Raise ValueError unless node_id (or a copy of it) can be placed under parent_id as name"""
+        # A move may keep its own name; a copy can't share one with its source
+        ignore_id = node_id if moving else None
+        if parent_id is not None:
+            # Walk up from the new parent: reaching node_id means it would become its own ancestor
+            cursor.execute("""
+                WITH RECURSIVE up AS (
+                    SELECT id, parent_id FROM fs_nodes WHERE id = %s AND user_id = %s AND is_dir
+                    UNION ALL
+                    SELECT f.id, f.parent_id FROM fs_nodes f JOIN up ON f.id = up.parent_id
+                )
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE id = %s) FROM up
+            """, (parent_id, user_id, node_id))
+            depth, cycles = cursor.fetchone()
+            if not depth:
+                raise ValueError("Parent directory not found or not a directory")
+            if cycles:
+                raise ValueError("Cannot place a directory inside itself")
+            cursor.execute(
+                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id = %s AND name = %s"
+                " AND id IS DISTINCT FROM %s",
+                (user_id, parent_id, name, ignore_id)
+            )
+        else:
+            cursor.execute(
+                "SELECT id FROM fs_nodes WHERE user_id = %s AND parent_id IS NULL AND name = %s"
+                " AND id IS DISTINCT FROM %s",
+                (user_id, name, ignore_id)
+            )
+        if cursor.fetchone():
+            raise ValueError("A node with this name already exists in the specified location")
+
+    @timed_query
+    def move_node(self, user_id: str, node_id: int, parent_id: Optional[int], name: str) -> None:
+        """
+        Move and/or rename a node. Descendants hang off its id, so this is one
+        row update however large the subtree is.
+        """
+        with self.conn.cursor() as cursor:
+            self._check_destination(cursor, user_id, node_id, parent_id, name, moving=True)
+            cursor.execute("""
+                UPDATE fs_nodes
+                SET parent_id = %s, name = %s, updated_at = NOW()
+                WHERE id = %s AND user_id = %s
+                RETURNING id
+            """, (parent_id, name, node_id, user_id))
+            if not cursor.fetchone():
+                raise ValueError("Node not found or access denied")
+            self._pin(user_id)
+
+    @timed_query
+    def copy_node(self, user_id: str, node_id: int, parent_id: Optional[int], name: str) -> int:
+        """
+        Copy a node and all its descendants under parent_id as name, and return
+        the copy's id. The whole subtree is cloned by one INSERT ... SELECT: each
+        source row gets a new id up front, and children are pointed at their
+        parent's new id.
+        """
+        with self.conn.cursor() as cursor:
+            self._check_destination(cursor, user_id, node_id, parent_id, name, moving=False)
+            if USER_QUOTA_BYTES or USER_QUOTA_NODES:
+                cursor.execute("""
+                    WITH RECURSIVE subtree AS (
+                        SELECT id, content FROM fs_nodes WHERE id = %s AND user_id = %s
+                        UNION ALL
+                        SELECT f.id, f.content FROM fs_nodes f JOIN subtree s ON f.parent_id = s.id
+                    )
+                    SELECT COUNT(*), COALESCE(SUM(octet_length(content)), 0) FROM subtree
+                """, (node_id, user_id))
+                nodes, size = cursor.fetchone()
+                self._check_quota(cursor, user_id, size, nodes)
+            cursor.execute("""
+                WITH RECURSIVE subtree AS (
+                    SELECT id, parent_id, name, is_dir, content, 0 AS depth
+                    FROM fs_nodes
+                    WHERE id = %s AND user_id = %s
+                    UNION ALL
+                    SELECT f.id, f.parent_id, f.name, f.is_dir, f.content, s.depth + 1
+                    FROM fs_nodes f
+                    JOIN subtree s ON f.parent_id = s.id
+                ),
+                mapped AS MATERIALIZED (
+                    SELECT s.*, nextval(pg_get_serial_sequence('fs_nodes', 'id')) AS new_id
+                    FROM subtree s
+                )
+                INSERT INTO fs_nodes (id, user_id, parent_id, name, is_dir, content)
+                OVERRIDING SYSTEM VALUE
+                SELECT m.new_id, %s,
+                       CASE WHEN m.depth = 0 THEN %s ELSE p.new_id END,
+                       CASE WHEN m.depth = 0 THEN %s ELSE m.name END,
+                       m.is_dir, m.content
+                FROM mapped m
+                LEFT JOIN mapped p ON m.depth > 0 AND p.id = m.parent_id
+                ORDER BY m.depth
+                RETURNING id, name, parent_id
+            """, (node_id, user_id, user_id, parent_id, name))
+            rows = cursor.fetchall()
+            if not rows:
+                raise ValueError("Node not found or access denied")
+            # Only the copy's root can point at parent_id: every other row points at a new id
+            root_id = next(row[0] for row in rows if row[2] == parent_id and row[1] == name)
+            self._pin(user_id)
+            return root_id
+
+    def iter_tree(self, user_id: str, batch_size: int = 200) -> Iterator[Tuple[str, bool, Optional[str], object]]:
+        """
+        Yield (path, is_dir, content, updated_at) for every node, parents
+        before children, through a server-side cursor so only batch_size rows
+        are held here at a time.
+        """
+        # WITH HOLD lets a named (server-side) cursor live on an autocommit connection.
+        # Stays on the primary: a long-lived cursor on a standby gets cancelled by recovery conflicts
+        with self.conn.cursor(name=f"iter_tree_{uuid.uuid4().hex}", withhold=True) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute("""
+                WITH RECURSIVE tree AS (
+                    SELECT id, is_dir, name::text AS path
+                    FROM fs_nodes
+                    WHERE user_id = %s AND parent_id IS NULL
+                    UNION ALL
+                    SELECT f.id, f.is_dir, t.path || '/' || f.name
+                    FROM fs_nodes f
+                    JOIN tree t ON f.parent_id = t.id
+                    WHERE f.user_id = %s
+                )
+                SELECT t.path, t.is_dir, n.content, n.updated_at
+                FROM tree t
+                JOIN fs_nodes n ON n.id = t.id
+                ORDER BY t.path
+            """, (user_id, user_id))
+            yield from cursor
@@ -0,0 +1,275 @@
+# In project_archive.py
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from workspace_sync import SKIP_DIRS
+from tar_stream import TarStream
+from structured_logging import get_logger
+
+log = get_logger("project_archive")
+
+# Import reads an uploaded tar (optionally compressed) or zip one member at a
+# time and flushes batches of files to fs_nodes with multi-row statements and
+# to the running container with one put_archive per batch. Export walks the
+# tree through a server-side cursor and emits the archive member by member.
+
+MAX_IMPORT_ARCHIVE_BYTES = int(os.getenv("PROJECT_IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+MAX_IMPORT_TOTAL_BYTES = 4 * MAX_IMPORT_ARCHIVE_BYTES   # uncompressed, guards against archive bombs
+MAX_IMPORT_FILE_BYTES = 5 * 1024 * 1024                 # larger files are skipped
+MAX_IMPORT_FILES = 20000
+IMPORT_BATCH_FILES = 500
+IMPORT_BATCH_BYTES = 8 * 1024 * 1024
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024                    # uploads beyond this spill to a temp file
+MAX_REPORTED_SKIPS = 50
+
+ARCHIVE_FORMATS = {
+    "tar": ("application/gzip", "tar.gz"),
+    "zip": ("application/zip", "zip"),
+}
+
+class ImportLimitExceeded(ValueError):
+    pass
+
+def _clean_path(name: str) -> Optional[str]:
+    """Workspace-relative path for an archive member, or None if it escapes or should be skipped"""
+    path = posixpath.normpath(name.replace("\\", "/").lstrip("/"))
+    if path in (".", "") or path.startswith("../") or path == "..":
+        return None
+    if any(part in SKIP_DIRS for part in path.split("/")):
+        return None
+    return path
+
+def iter_archive(fileobj: BinaryIO) -> Iterator[Tuple[str, bool, Optional[bytes]]]:
+    """
+    Yield (name, is_dir, data) per regular file or directory in a tar or zip.
+    data is None for directories and for files over MAX_IMPORT_FILE_BYTES.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    yield info.filename, True, None
+                elif info.file_size > MAX_IMPORT_FILE_BYTES:
+                    yield info.filename, False, None
+                else:
+                    with archive.open(info) as member:
+                        # Don't trust the header's size: read at most one byte past the limit
+                        data = member.read(MAX_IMPORT_FILE_BYTES + 1)
+                    yield info.filename, False, data if len(data) <= MAX_IMPORT_FILE_BYTES else None
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise ValueError("Upload is not a tar or zip archive")
+    with archive:
+        for member in archive:
+            if member.isdir():
+                yield member.name, True, None
+            elif member.isfile():
+                if member.size > MAX_IMPORT_FILE_BYTES:
+                    yield member.name, False, None
+                else:
+                    yield member.name, False, archive.extractfile(member).read()
+            # links, devices and fifos are ignored
+
+class ProjectImporter:
+    """Streams an archive into a user's fs_nodes and, if given, their running container"""
+    def __init__(self, db, user_id: str, container=None, base_path: str = "/workspace"):
+        self.db = db
+        self.user_id = user_id
+        self.container = container
+        self.base_path = base_path
+        self.nodes: Dict[str, Dict] = {}
+        self.batch: Dict[str, bytes] = {}
+        self.batch_dirs: Set[str] = set()
+        self.batch_bytes = 0
+        self.stats = {"files": 0, "directories": 0, "bytes": 0, "skipped": []}
+
+    def _skip(self, name: str, reason: str) -> None:
+        if len(self.stats["skipped"]) < MAX_REPORTED_SKIPS:
+            self.stats["skipped"].append({"path": name, "reason": reason})
+
+    def run(self, fileobj: BinaryIO) -> Dict:
+        start = time.perf_counter()
+        self.nodes = self.db.get_node_paths(self.user_id)
+        total = 0
+        for name, is_dir, data in iter_archive(fileobj):
+            path = _clean_path(name)
+            if path is None:
+                continue
+            if is_dir:
+                self.batch_dirs.add(path)
+                continue
+            if data is None:
+                self._skip(path, "too large")
+                continue
+            total += len(data)
+            if total > MAX_IMPORT_TOTAL_BYTES:
+                raise ImportLimitExceeded("Archive expands beyond the import size limit")
+            if self.stats["files"] + len(self.batch) >= MAX_IMPORT_FILES:
+                raise ImportLimitExceeded(f"Archive has more than {MAX_IMPORT_FILES} files")
+            self.batch[path] = data
+            self.batch_bytes += len(data)
+            if len(self.batch) + len(self.batch_dirs) >= IMPORT_BATCH_FILES or self.batch_bytes >= IMPORT_BATCH_BYTES:
+                self._flush()
+        self._flush()
+
+        seconds = time.perf_counter() - start
+        self.stats["seconds"] = round(seconds, 3)
+        self.stats["mb_per_sec"] = round(self.stats["bytes"] / seconds / 1e6, 2) if seconds else 0.0
+        log.info("project.imported", user_id=self.user_id, files=self.stats["files"],
+                 directories=self.stats["directories"], bytes=self.stats["bytes"],
+                 seconds=self.stats["seconds"], mb_per_sec=self.stats["mb_per_sec"])
+        return self.stats
+
+    def _ensure_dirs(self, paths: List[str]) -> List[str]:
+        """Create missing directories (and their ancestors), one multi-row insert per depth"""
+        missing = set()
+        for path in paths:
+            while path and path not in self.nodes:
+                missing.add(path)
+                path = posixpath.dirname(path)
+        by_depth: Dict[int, List[str]] = {}
+        for path in missing:
+            by_depth.setdefault(path.count("/"), []).append(path)
+        created = []
+        for depth in sorted(by_depth):
+            # A file in the way (or a skipped parent) drops the subtree under it
+            level = [
+                p for p in sorted(by_depth[depth])
+                if not posixpath.dirname(p) or self.nodes.get(posixpath.dirname(p), {}).get("is_dir")
+            ]
+            ids = self.db.create_nodes(self.user_id, [
+                (self.nodes[posixpath.dirname(p)]["id"] if "/" in p else None, posixpath.basename(p), True, None)
+                for p in level
+            ])
+            for path, node_id in zip(level, ids):
+                self.nodes[path] = {"id": node_id, "is_dir": True}
+            created += level
+        self.stats["directories"] += len(created)
+        return created
+
+    def _flush(self) -> None:
+        if not self.batch and not self.batch_dirs:
+            return
+        batch, self.batch, self.batch_bytes = self.batch, {}, 0
+        dirs, self.batch_dirs = self.batch_dirs, set()
+        new_dirs = self._ensure_dirs(list(dirs) + [posixpath.dirname(p) for p in batch if "/" in p])
+
+        inserts, updates, written = [], [], []
+        for path, data in batch.items():
+            parent = posixpath.dirname(path)
+            if parent and not self.nodes.get(parent, {}).get("is_dir"):
+                self._skip(path, "parent is not a directory")
+                continue
+            try:
+                content = data.decode("utf-8")
+            except UnicodeDecodeError:
+                self._skip(path, "binary")  # binary files aren't stored in fs_nodes
+                continue
+            existing = self.nodes.get(path)
+            if existing is None:
+                inserts.append((path, (self.nodes[parent]["id"] if parent else None,
+                                       posixpath.basename(path), False, content)))
+            elif existing["is_dir"]:
+                self._skip(path, "a directory with this name exists")
+                continue
+            else:
+                updates.append((existing["id"], content))
+            written.append((path, data))
+
+        ids = self.db.create_nodes(self.user_id, [row for _, row in inserts])
+        for (path, _), node_id in zip(inserts, ids):
+            self.nodes[path] = {"id": node_id, "is_dir": False}
+        self.db.update_file_contents(self.user_id, updates)
+        self.stats["files"] += len(written)
+        self.stats["bytes"] += sum(len(data) for _, data in written)
+
+        if self.container is not None and (written or new_dirs):
+            self.container.put_archive(path=self.base_path, data=_tar_batch(new_dirs, written))
+
+def _tar_batch(dirs: List[str], files: List[Tuple[str, bytes]]) -> TarStream:
+    archive = TarStream()
+    for path in dirs:
+        archive.add_dir(path)
+    for path, data in files:
+        archive.add_bytes(path, data)
+    return archive
+
+class _ChunkSink:
+    """Write-only file object that hands back what was written since the last drain"""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def export_archive(db, user_id: str, fmt: str = "tar") -> Iterator[bytes]:
+    """
+    Yield a tar.gz or zip of the user's tree, one member at a time. Closes db
+    when done, so pass a connection dedicated to this export.
+    """
+    start = time.perf_counter()
+    sink = _ChunkSink()
+    files = size = 0
+    try:
+        if fmt == "zip":
+            archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            archive = tarfile.open(fileobj=sink, mode="w|gz")
+        with archive:
+            for path, is_dir, content, updated_at in db.iter_tree(user_id):
+                data = (content or "").encode("utf-8")
+                mtime = updated_at.timestamp() if updated_at else time.time()
+                if fmt == "zip":
+                    info = zipfile.ZipInfo(path + "/" if is_dir else path,
+                                           date_time=time.localtime(mtime)[:6])
+                    info.external_attr = (0o40755 if is_dir else 0o100644) << 16
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    archive.writestr(info, b"" if is_dir else data)
+                else:
+                    info = tarfile.TarInfo(name=path)
+                    info.mtime = int(mtime)
+                    if is_dir:
+                        info.type, info.mode = tarfile.DIRTYPE, 0o755
+                        archive.addfile(info)
+                    else:
+                        info.size, info.mode = len(data), 0o644
+                        archive.addfile(info, BytesIO(data))
+                if not is_dir:
+                    files += 1
+                    size += len(data)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        tail = sink.drain()
+        if tail:
+            yield tail
+    finally:
+        db.close()
+        seconds = time.perf_counter() - start
+        log.info("project.exported", user_id=user_id, format=fmt, files=files, bytes=size,
+                 archive_bytes=sink.position, seconds=round(seconds, 3),
+                 mb_per_sec=round(size / seconds / 1e6, 2) if seconds else 0.0)
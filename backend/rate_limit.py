@@ -0,0 +1,88 @@
+# In rate_limit.py
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import RATE_LIMITED
+from structured_logging import get_logger
+from tracing import run_in_executor
+
+log = get_logger("rate_limit")
+
+# One token bucket per (user, endpoint): `rate` calls per second sustained,
+# `burst` back to back. Buckets live in this process, or with
+# RATE_LIMIT_SHARED=1 in Postgres so every worker draws from the same one.
+# Override a limit with RATE_LIMIT_<ENDPOINT>="rate:burst", e.g.
+# RATE_LIMIT_FS_EVENT="50:200"; a rate of 0 turns that limit off.
+
+DEFAULT_LIMITS: Dict[str, Tuple[float, int]] = {
+    "fs_event": (10.0, 50),     # the shell hook posts once per touch/mkdir/rm/mv/cp/cd
+    "file_save": (5.0, 20),     # editor saves (autosave included) across all tabs
+    "import": (0.1, 3),         # project archive imports
+}
+IDLE_BUCKET_SECONDS = 600.0     # local buckets untouched this long are dropped (they'd be full anyway)
+
+def shared_limits_enabled() -> bool:
+    return os.getenv("RATE_LIMIT_SHARED") == "1"
+
+def limits_from_env() -> Dict[str, Tuple[float, int]]:
+    limits = dict(DEFAULT_LIMITS)
+    for endpoint in limits:
+        value = os.getenv(f"RATE_LIMIT_{endpoint.upper()}")
+        if not value:
+            continue
+        try:
+            rate, _, burst = value.partition(":")
+            limits[endpoint] = (float(rate), int(burst) if burst else max(1, int(float(rate))))
+        except ValueError:
+            log.warning("rate_limit.bad_setting", endpoint=endpoint, value=value)
+    return limits
+
+class RateLimiter:
+    """Per-user, per-endpoint token buckets; db (a NeonDB) makes them shared across workers"""
+    def __init__(self, limits: Dict[str, Tuple[float, int]], db=None):
+        self.limits = limits
+        self.db = db
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}  # -> [tokens, updated at]
+        self._pruned_at = time.monotonic()
+
+    def _take_local(self, user_id: str, endpoint: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get((user_id, endpoint))
+        if bucket is None:
+            bucket = self._buckets[(user_id, endpoint)] = [float(burst), now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[0] = tokens - 1 if tokens >= 1 else tokens
+        bucket[1] = now
+        if now - self._pruned_at > IDLE_BUCKET_SECONDS:
+            self._pruned_at = now
+            for key in [k for k, b in self._buckets.items() if now - b[1] > IDLE_BUCKET_SECONDS]:
+                del self._buckets[key]
+        return tokens
+
+    def _take_shared(self, user_id: str, endpoint: str, rate: float, burst: int) -> float:
+        self.db.ensure_connection()
+        return self.db.take_rate_token(user_id, endpoint, rate, burst)
+
+    async def check(self, user_id: str, endpoint: str) -> Optional[float]:
+        """
+        Take a token for one call by user_id to endpoint. Returns None if the
+        call may go ahead, otherwise the seconds until a token is due.
+        """
+        rate, burst = self.limits.get(endpoint, (0.0, 0))
+        if rate <= 0:
+            return None
+        if self.db is None:
+            tokens = self._take_local(user_id, endpoint, rate, burst)
+        else:
+            try:
+                tokens = await run_in_executor(self._take_shared, user_id, endpoint, rate, burst)
+            except Exception as e:
+                # Don't fail requests over the limiter: fall back to this worker's own buckets
+                log.warning("rate_limit.shared_failed", error=str(e))
+                tokens = self._take_local(user_id, endpoint, rate, burst)
+        if tokens >= 1:
+            return None
+        RATE_LIMITED.labels(endpoint).inc()
+        log.info("rate_limit.rejected", user_id=user_id, endpoint=endpoint)
+        return (1 - tokens) / rate
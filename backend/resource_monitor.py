@@ -0,0 +1,283 @@
+# In resource_monitor.py
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import docker
+from metrics import CONTAINER_LIMIT_UPDATES, RESOURCE_STATS_CYCLE
+from structured_logging import get_logger
+
+log = get_logger("resource_monitor")
+
+# One background thread samples every managed container each cycle with
+# one-shot stats requests (no two-sample wait inside the daemon); CPU use is
+# the delta between this cycle's sample and the last. Samples are kept in a
+# rolling window per container and summarised per user. With adaptive limits
+# on, containers whose demand sits near their CPU quota or memory limit get
+# more, within host headroom, and idle ones give CPU back.
+
+STATS_INTERVAL = float(os.getenv("RESOURCE_STATS_INTERVAL", "5"))   # seconds between cycles
+STATS_WINDOW = 60                   # samples kept per container (5 minutes at the default interval)
+STATS_WORKERS = 8                   # concurrent stats requests per cycle
+HOST_INFO_TTL = 60.0                # seconds between docker info refreshes
+
+ADAPTIVE_LIMITS = os.getenv("RESOURCE_ADAPTIVE_LIMITS", "0") == "1"
+CPU_PERIOD = 100000                 # the CFS period cpu_quota is relative to (docker's default)
+MAX_CPU_QUOTA = int(os.getenv("RESOURCE_MAX_CPU_QUOTA", "200000"))
+MAX_MEM_BYTES = int(os.getenv("RESOURCE_MAX_MEM_BYTES", str(2 * 1024 ** 3)))
+CPU_OVERCOMMIT = float(os.getenv("HOST_CPU_OVERCOMMIT", "2.0"))   # total quotas, as a multiple of host CPUs
+ADAPT_WINDOW = 12                   # samples a decision looks at (1 minute at the default interval)
+ADAPT_COOLDOWN = 60.0               # seconds between changes to one container
+CPU_GROW_AT = 0.8                   # p90 demand / quota that earns more CPU
+CPU_SHRINK_AT = 0.2                 # p90 demand / quota below which CPU is handed back
+MEM_GROW_AT = 0.9                   # peak working set / limit that earns more memory
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _io_bytes(stats: Dict) -> Tuple[int, int]:
+    read = write = 0
+    for entry in (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return read, write
+
+def _net_bytes(stats: Dict) -> Tuple[int, int]:
+    networks = (stats.get("networks") or {}).values()
+    return sum(n.get("rx_bytes", 0) for n in networks), sum(n.get("tx_bytes", 0) for n in networks)
+
+def _working_set(memory: Dict) -> int:
+    """Usage minus reclaimable page cache, as docker stats and the OOM killer see it"""
+    usage = memory.get("usage", 0)
+    extra = memory.get("stats") or {}
+    inactive = extra.get("inactive_file", extra.get("total_inactive_file", 0))
+    return max(0, usage - inactive)
+
+class ContainerUsage:
+    """Rolling samples and current limits for one container"""
+    def __init__(self, container_id: str, user_id: str, cpu_quota: int, mem_limit: int):
+        self.container_id = container_id
+        self.user_id = user_id
+        self.cpu_quota = cpu_quota
+        self.mem_limit = mem_limit
+        self.samples: Deque[tuple] = deque(maxlen=STATS_WINDOW)  # (ts, cpu cores, mem bytes, io r/w, net rx/tx)
+        self.last_raw: Optional[tuple] = None                     # (total_usage, system_usage, online_cpus, ts)
+        self.last_change = 0.0
+
+    def add(self, stats: Dict, now: float) -> None:
+        cpu = stats.get("cpu_stats") or {}
+        total = (cpu.get("cpu_usage") or {}).get("total_usage", 0)
+        system = cpu.get("system_cpu_usage", 0)
+        online = cpu.get("online_cpus") or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1
+        cores = 0.0
+        if self.last_raw is not None:
+            last_total, last_system, _, last_ts = self.last_raw
+            if system > last_system:
+                cores = (total - last_total) / (system - last_system) * online
+            elif now > last_ts:
+                cores = (total - last_total) / ((now - last_ts) * 1e9)
+        self.last_raw = (total, system, online, now)
+
+        memory = stats.get("memory_stats") or {}
+        if memory.get("limit"):
+            self.mem_limit = memory["limit"]
+        read, write = _io_bytes(stats)
+        rx, tx = _net_bytes(stats)
+        # The first sample has no CPU delta; summaries skip its CPU and use it as the IO baseline
+        self.samples.append((now, max(0.0, cores), _working_set(memory), read, write, rx, tx))
+
+    def summary(self) -> Dict:
+        samples = list(self.samples)
+        if not samples:
+            return {"container_id": self.container_id, "samples": 0}
+        cpu = [s[1] for s in samples[1:]] or [0.0]
+        mem = [s[2] for s in samples]
+        span = samples[-1][0] - samples[0][0]
+
+        def rate(index):
+            return round((samples[-1][index] - samples[0][index]) / span, 1) if span > 0 else 0.0
+
+        return {
+            "container_id": self.container_id,
+            "samples": len(samples),
+            "window_seconds": round(span, 1),
+            "cpu_cores": {"now": round(cpu[-1], 3), "avg": round(sum(cpu) / len(cpu), 3),
+                          "p95": round(_percentile(cpu, 0.95), 3), "max": round(max(cpu), 3)},
+            "cpu_quota_cores": self.cpu_quota / CPU_PERIOD,
+            "memory_bytes": {"now": mem[-1], "max": max(mem), "limit": self.mem_limit},
+            "io_bytes_per_sec": {"read": rate(3), "write": rate(4)},
+            "net_bytes_per_sec": {"rx": rate(5), "tx": rate(6)},
+        }
+
+class ResourceMonitor:
+    def __init__(self, client, base_cpu_quota: int, base_mem_bytes: int, mem_overcommit: float,
+                 interval: float = STATS_INTERVAL, adaptive: bool = ADAPTIVE_LIMITS):
+        self.client = client
+        self.base_cpu_quota = base_cpu_quota
+        self.base_mem_bytes = base_mem_bytes
+        self.mem_overcommit = mem_overcommit
+        self.interval = interval
+        self.adaptive = adaptive
+        self.usage: Dict[str, ContainerUsage] = {}   # container_id -> usage
+        self.lock = threading.Lock()
+        self._one_shot = True
+        self._host: Dict = {}
+        self._host_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-monitor", daemon=True)
+        self._thread.start()
+        log.info("resource_monitor.started", interval=self.interval, adaptive=self.adaptive)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(STATS_WORKERS, thread_name_prefix="container-stats") as pool:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    self.collect(pool)
+                except Exception as e:
+                    log.warning("resource_monitor.cycle_failed", error=str(e))
+                elapsed = time.perf_counter() - start
+                RESOURCE_STATS_CYCLE.observe(elapsed)
+                self._stop.wait(max(0.0, self.interval - elapsed))
+
+    def _stats(self, container_id: str) -> Optional[Dict]:
+        try:
+            if self._one_shot:
+                try:
+                    return self.client.api.stats(container_id, stream=False, one_shot=True)
+                except (TypeError, docker.errors.InvalidVersion):
+                    # SDK without one_shot, or a daemon API older than 1.41: fall back to the slower call
+                    self._one_shot = False
+            return self.client.api.stats(container_id, stream=False)
+        except Exception as e:
+            log.debug("resource_monitor.stats_failed", container_id=container_id, error=str(e))
+            return None
+
+    def collect(self, pool: ThreadPoolExecutor) -> None:
+        """One cycle: sample every running managed container, then adapt limits"""
+        containers = self.client.containers.list(
+            filters={"label": ["managed_by=terminal"], "status": "running"}
+        )
+        now = time.time()
+        results = pool.map(self._stats, [c.id for c in containers])
+        live = set()
+        with self.lock:
+            for container, stats in zip(containers, results):
+                live.add(container.id)
+                if stats is None:
+                    continue
+                usage = self.usage.get(container.id)
+                if usage is None:
+                    # Start from the container's actual limits: it may predate a restart of
+                    # this process that lost the raised ones
+                    host_config = container.attrs.get("HostConfig") or {}
+                    usage = self.usage[container.id] = ContainerUsage(
+                        container.id, container.labels.get("user_id", ""),
+                        host_config.get("CpuQuota") or self.base_cpu_quota,
+                        host_config.get("Memory") or self.base_mem_bytes,
+                    )
+                usage.add(stats, now)
+            for gone in set(self.usage) - live:
+                del self.usage[gone]
+        if self.adaptive:
+            self.adapt({c.id: c for c in containers}, now)
+
+    def host(self) -> Dict:
+        if time.monotonic() - self._host_at > HOST_INFO_TTL:
+            info = self.client.info()
+            self._host = {"cpus": info.get("NCPU", 0), "mem_bytes": info.get("MemTotal", 0)}
+            self._host_at = time.monotonic()
+        return self._host
+
+    def memory_committed(self, container_ids: Iterable[str]) -> int:
+        """Sum of the memory limits of these containers, using the base limit for unknown ones"""
+        with self.lock:
+            return sum(
+                self.usage[c].mem_limit if c in self.usage else self.base_mem_bytes for c in container_ids
+            )
+
+    def adapt(self, containers: Dict, now: float) -> None:
+        host = self.host()
+        with self.lock:
+            candidates = [u for u in self.usage.values() if len(u.samples) > ADAPT_WINDOW]
+            cpu_committed = sum(u.cpu_quota for u in self.usage.values())
+            mem_committed = sum(u.mem_limit for u in self.usage.values())
+        cpu_budget = host.get("cpus", 0) * CPU_PERIOD * CPU_OVERCOMMIT
+        mem_budget = host.get("mem_bytes", 0) * self.mem_overcommit
+
+        for usage in candidates:
+            if now - usage.last_change < ADAPT_COOLDOWN or usage.container_id not in containers:
+                continue
+            recent = list(usage.samples)[-ADAPT_WINDOW:]
+            demand = _percentile([s[1] for s in recent], 0.9) / (usage.cpu_quota / CPU_PERIOD)
+            peak_mem = max(s[2] for s in recent)
+            changes = {}
+
+            if demand >= CPU_GROW_AT and usage.cpu_quota < MAX_CPU_QUOTA:
+                quota = min(MAX_CPU_QUOTA, usage.cpu_quota * 2)
+                if not cpu_budget or cpu_committed + quota - usage.cpu_quota <= cpu_budget:
+                    changes["cpu_quota"] = quota
+            elif demand <= CPU_SHRINK_AT and usage.cpu_quota > self.base_cpu_quota:
+                changes["cpu_quota"] = max(self.base_cpu_quota, usage.cpu_quota // 2)
+
+            # Memory only grows: shrinking a live cgroup below its usage invites the OOM killer
+            if peak_mem >= usage.mem_limit * MEM_GROW_AT and usage.mem_limit < MAX_MEM_BYTES:
+                limit = min(MAX_MEM_BYTES, int(usage.mem_limit * 1.5))
+                if not mem_budget or mem_committed + limit - usage.mem_limit <= mem_budget:
+                    changes["mem_limit"] = limit
+                    changes["memswap_limit"] = 2 * limit  # keep docker's default swap ratio
+
+            if changes:
+                self._apply(containers[usage.container_id], usage, changes, now)
+                cpu_committed += changes.get("cpu_quota", usage.cpu_quota) - usage.cpu_quota
+                mem_committed += changes.get("mem_limit", usage.mem_limit) - usage.mem_limit
+
+    def _apply(self, container, usage: ContainerUsage, changes: Dict, now: float) -> None:
+        try:
+            container.update(**changes)
+        except Exception as e:
+            log.warning("resource_monitor.update_failed", container_id=container.id, error=str(e))
+            return
+        for resource, key, current in (("cpu", "cpu_quota", usage.cpu_quota), ("memory", "mem_limit", usage.mem_limit)):
+            if key in changes:
+                CONTAINER_LIMIT_UPDATES.labels(resource, "up" if changes[key] > current else "down").inc()
+        log.info("resource_monitor.limits_changed", user_id=usage.user_id, container_id=container.id,
+                 cpu_quota=changes.get("cpu_quota", usage.cpu_quota), mem_limit=changes.get("mem_limit", usage.mem_limit))
+        with self.lock:
+            usage.cpu_quota = changes.get("cpu_quota", usage.cpu_quota)
+            usage.mem_limit = changes.get("mem_limit", usage.mem_limit)
+            usage.last_change = now
+
+    def user_summary(self, user_id: str) -> List[Dict]:
+        with self.lock:
+            return [u.summary() for u in self.usage.values() if u.user_id == user_id]
+
+    def summary(self) -> Dict:
+        with self.lock:
+            users: Dict[str, List[Dict]] = {}
+            for usage in self.usage.values():
+                users.setdefault(usage.user_id, []).append(usage.summary())
+            return {
+                "host": dict(self._host),
+                "adaptive": self.adaptive,
+                "cpu_quota_committed_cores": sum(u.cpu_quota for u in self.usage.values()) / CPU_PERIOD,
+                "memory_committed_bytes": sum(u.mem_limit for u in self.usage.values()),
+                "users": users,
+            }
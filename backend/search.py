@@ -0,0 +1,81 @@
+# In search.py
+import re
+from typing import List, Tuple
+
+# Query patterns and result highlighting for the search API. The database
+# narrows and pages the candidates; highlights are computed here for the
+# returned page only.
+
+MAX_LINE_MATCHES = 20   # matching lines reported per file
+MAX_LINE_CHARS = 400    # longer lines are cut to a window around the first match
+LINE_CONTEXT = 80       # characters kept before the first match in a cut line
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def like_pattern(query: str) -> str:
+    """LIKE pattern matching query as a literal substring"""
+    return f"%{_escape_like(query)}%"
+
+def subsequence_pattern(query: str) -> str:
+    """LIKE pattern matching names that contain query's characters in order ('mpy' ~ 'main.py')"""
+    return "%" + "%".join(_escape_like(c) for c in query) + "%"
+
+def fuzzy_ranges(name: str, query: str) -> List[List[int]]:
+    """[start, end) ranges of name to highlight for a quick-open query"""
+    found = re.search(re.escape(query), name, re.IGNORECASE)
+    if found is not None:
+        return [list(found.span())]
+    # Lowered a character at a time, so positions stay those of name
+    lowered, q = [c.lower() for c in name], query.lower()
+    ranges: List[List[int]] = []
+    pos = 0
+    for char in q:
+        pos = next((i for i in range(pos, len(lowered)) if lowered[i] == char), -1)
+        if pos < 0:
+            return []
+        if ranges and ranges[-1][1] == pos:
+            ranges[-1][1] = pos + 1
+        else:
+            ranges.append([pos, pos + 1])
+        pos += 1
+    return ranges
+
+def line_matches(content: str, query: str, case_sensitive: bool = False) -> Tuple[List[dict], bool]:
+    """
+    Lines of content containing query, as {line, text, ranges}, with line
+    numbers starting at 1. Returns (matches, truncated) where truncated means
+    more than MAX_LINE_MATCHES lines matched.
+    """
+    # Matched on the original text: lowering it first can change its length
+    # ('İ' lowers to two characters), which would shift every offset after it
+    pattern = re.compile(re.escape(query), 0 if case_sensitive else re.IGNORECASE)
+    matches = []
+    line_no, counted_to, start = 1, 0, 0
+    # Walk match positions rather than every line, so large files with few hits stay cheap
+    while True:
+        found = pattern.search(content, start)
+        if found is None:
+            return matches, False
+        if len(matches) == MAX_LINE_MATCHES:
+            return matches, True
+        pos = found.start()
+        line_start = content.rfind("\n", 0, pos) + 1
+        line_end = content.find("\n", pos)
+        if line_end < 0:
+            line_end = len(content)
+        line_no += content.count("\n", counted_to, line_start)
+        counted_to = line_start
+
+        line = content[line_start:line_end]
+        spans = [m.span() for m in pattern.finditer(line)]
+        cut = 0
+        if len(line) > MAX_LINE_CHARS:
+            cut = max(0, spans[0][0] - LINE_CONTEXT) if spans else 0
+            line = line[cut:cut + MAX_LINE_CHARS]
+        ranges = [
+            [begin - cut, min(end - cut, len(line))]
+            for begin, end in spans if cut <= begin < cut + len(line)
+        ]
+        matches.append({"line": line_no, "text": line, "ranges": ranges})
+        start = max(line_end, pos + 1)
@@ -0,0 +1,174 @@
+# In session_recorder.py
+import asyncio
+import codecs
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+from structured_logging import get_logger
+
+log = get_logger("session_recorder")
+
+# Recordings are asciicast v2 event lines ([time, code, data]) grouped into
+# chunks. Each chunk is an independent zlib stream appended to <sid>.cast.z,
+# and <sid>.idx gets one JSON line per chunk (after the asciicast header line)
+# with its byte offset, compressed length and first/last event time, so a
+# player can seek without decompressing what comes before.
+CHUNK_BYTES = 64 * 1024   # raw event bytes per compressed chunk
+FLUSH_INTERVAL = 5.0      # seconds before a partial chunk is handed off anyway
+MAX_IDLE = 2.0            # playback compresses longer pauses to this
+
+_SID_RE = re.compile(r"^[A-Za-z0-9-]+$")
+
+def recordings_dir() -> Optional[str]:
+    """Directory recordings are written to, or None if recording is disabled"""
+    return os.getenv("TERMINAL_RECORDINGS_DIR") or None
+
+def recording_paths(directory: str, sid: str) -> Tuple[str, str]:
+    if not _SID_RE.match(sid):
+        raise ValueError("Invalid session id")
+    base = os.path.join(directory, sid)
+    return base + ".cast.z", base + ".idx"
+
+class _ChunkWriter(threading.Thread):
+    """Single background thread that encodes, compresses and appends chunks"""
+    def __init__(self):
+        super().__init__(name="session-recorder", daemon=True)
+        self.jobs = queue.SimpleQueue()
+
+    def run(self):
+        while True:
+            recorder, events = self.jobs.get()
+            try:
+                recorder._write_chunk(events)
+            except Exception:
+                log.exception("recording.write_failed", session_id=recorder.sid)
+
+_writer: Optional[_ChunkWriter] = None
+_writer_lock = threading.Lock()
+
+def _get_writer() -> _ChunkWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _ChunkWriter()
+            _writer.start()
+        return _writer
+
+class SessionRecorder:
+    """
+    Tees a session's output (and optionally input) into a chunked recording.
+
+    record() only appends to an in-memory list; encoding, compression and file
+    I/O happen on the writer thread.
+    """
+    def __init__(self, directory: str, sid: str, cols: int = 80, rows: int = 24,
+                 record_input: bool = False):
+        self.sid = sid
+        self.record_input = record_input
+        self.data_path, self.index_path = recording_paths(directory, sid)
+        os.makedirs(directory, exist_ok=True)
+        self._started = time.monotonic()
+        self._events: List[Tuple[float, str, bytes]] = []
+        self._pending_bytes = 0
+        self._last_flush = self._started
+        # Only touched from the writer thread
+        self._decoders = {}
+        self._header = {
+            "version": 2,
+            "width": cols,
+            "height": rows,
+            "timestamp": int(time.time()),
+            "env": {"TERM": "xterm-256color", "SHELL": "/bin/bash"},
+        }
+
+    def record(self, code: str, data: bytes) -> None:
+        now = time.monotonic()
+        self._events.append((now - self._started, code, data))
+        self._pending_bytes += len(data)
+        if self._pending_bytes >= CHUNK_BYTES or now - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def record_resize(self, cols: int, rows: int) -> None:
+        self.record("r", f"{cols}x{rows}".encode())
+
+    def flush(self) -> None:
+        if not self._events:
+            return
+        events, self._events = self._events, []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+        _get_writer().jobs.put((self, events))
+
+    def close(self) -> None:
+        self.flush()
+
+    def _write_chunk(self, events: List[Tuple[float, str, bytes]]) -> None:
+        lines = []
+        for t, code, data in events:
+            if code == "r":
+                text = data.decode()
+            else:
+                # Keep multi-byte characters split across reads intact
+                decoder = self._decoders.get(code)
+                if decoder is None:
+                    decoder = self._decoders[code] = codecs.getincrementaldecoder("utf-8")("replace")
+                text = decoder.decode(data)
+            lines.append(json.dumps([round(t, 6), code, text]))
+        compressed = zlib.compress(("\n".join(lines) + "\n").encode("utf-8"), 6)
+
+        new_file = not os.path.exists(self.index_path)
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+            f.write(compressed)
+        with open(self.index_path, "a") as f:
+            if new_file:
+                f.write(json.dumps(self._header) + "\n")
+            f.write(json.dumps({
+                "offset": offset,
+                "length": len(compressed),
+                "start": events[0][0],
+                "end": events[-1][0],
+            }) + "\n")
+
+def read_index(directory: str, sid: str) -> Tuple[dict, List[dict]]:
+    """Return the asciicast header and chunk index for a recording"""
+    _, index_path = recording_paths(directory, sid)
+    with open(index_path) as f:
+        header = json.loads(f.readline())
+        chunks = [json.loads(line) for line in f if line.strip()]
+    return header, chunks
+
+def _read_chunk(data_path: str, chunk: dict) -> List[list]:
+    with open(data_path, "rb") as f:
+        f.seek(chunk["offset"])
+        raw = zlib.decompress(f.read(chunk["length"]))
+    return [json.loads(line) for line in raw.decode("utf-8").splitlines() if line]
+
+async def play(directory: str, sid: str, speed: float = 1.0, start: float = 0.0) -> AsyncIterator[bytes]:
+    """
+    Yield a recording's output in real time scaled by speed, starting at
+    `start` seconds. Chunks before `start` are skipped via the index.
+    """
+    loop = asyncio.get_running_loop()
+    data_path, _ = recording_paths(directory, sid)
+    _, chunks = await loop.run_in_executor(None, read_index, directory, sid)
+    speed = max(speed, 0.01)
+    previous = start
+
+    for chunk in chunks:
+        if chunk["end"] < start:
+            continue
+        events = await loop.run_in_executor(None, _read_chunk, data_path, chunk)
+        for t, code, text in events:
+            if code != "o" or t < start:
+                continue
+            delay = min(t - previous, MAX_IDLE) / speed
+            previous = t
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield text.encode("utf-8")
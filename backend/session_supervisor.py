@@ -0,0 +1,409 @@
+# In session_supervisor.py
+import asyncio
+import json
+import os
+import secrets
+import socket
+import ssl
+import struct
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from fastapi import WebSocket
+from session_recorder import SessionRecorder, recordings_dir
+from metrics import TERMINAL_ECHO_LATENCY
+from structured_logging import get_logger
+
+log = get_logger("session_supervisor")
+
+SCROLLBACK_BYTES = 256 * 1024   # replayable output kept per session
+DETACHED_TTL = 15 * 60          # seconds a shell survives without a client
+REAP_INTERVAL = 60
+READ_SIZE = 4096
+VIEWER_BUFFER_BYTES = 1024 * 1024  # unsent output a viewer may lag behind by
+INPUT_BUFFER_BYTES = 1024 * 1024   # unflushed input before further input is dropped
+RESIZE_DEBOUNCE = 0.05             # seconds a burst of resizes is collapsed over
+
+# Binary control frames (clients that connect with ?proto=binary): one type
+# byte followed by the payload, so input never has to be sniffed for JSON.
+#   FRAME_INPUT   raw bytes for the shell
+#   FRAME_RESIZE  !HH cols, rows
+FRAME_INPUT = 0
+FRAME_RESIZE = 1
+
+def _make_nonblocking(raw) -> bool:
+    """Let the event loop drive a plain exec socket; TLS sockets stay blocking on the executor"""
+    if isinstance(raw, ssl.SSLSocket) or not isinstance(raw, socket.socket):
+        return False
+    raw.setblocking(False)
+    return True
+
+class ScrollbackBuffer:
+    """Fixed-size byte ring buffer addressed by absolute offsets into the output stream"""
+    def __init__(self, capacity: int = SCROLLBACK_BYTES):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self.end = 0  # total bytes ever written
+
+    @property
+    def start(self) -> int:
+        """Oldest offset still held in the buffer"""
+        return max(0, self.end - self.capacity)
+
+    def append(self, data: bytes) -> None:
+        if len(data) >= self.capacity:
+            # Only the tail survives; account for the bytes that never land
+            self.end += len(data) - self.capacity
+            data = data[-self.capacity:]
+        pos = self.end % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self._buf[pos:pos + first] = data[:first]
+        if first < len(data):
+            self._buf[:len(data) - first] = data[first:]
+        self.end += len(data)
+
+    def read_from(self, offset: int) -> Tuple[int, bytes]:
+        """Return (actual_offset, bytes) from offset to the end, clamped to what is retained"""
+        offset = min(max(offset, self.start), self.end)
+        length = self.end - offset
+        if not length:
+            return offset, b""
+        pos = offset % self.capacity
+        if pos + length <= self.capacity:
+            return offset, bytes(self._buf[pos:pos + length])
+        return offset, bytes(self._buf[pos:]) + bytes(self._buf[:length - (self.capacity - pos)])
+
+class Viewer:
+    """A read-only subscriber to a session, with its own bounded output buffer"""
+    def __init__(self, ws: WebSocket, limit: int = VIEWER_BUFFER_BYTES):
+        self.ws = ws
+        self.limit = limit
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.overflowed = False
+        self.finished = False
+        self.ready = asyncio.Event()
+
+    def push(self, data: bytes) -> bool:
+        """Queue output without blocking; returns False if the viewer fell too far behind"""
+        if self.pending_bytes + len(data) > self.limit:
+            self.overflowed = True
+            self.ready.set()
+            return False
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        self.ready.set()
+        return True
+
+    def finish(self) -> None:
+        self.finished = True
+        self.ready.set()
+
+    async def run(self):
+        """Drain the buffer into the WebSocket until the session ends or the viewer overflows"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if self.pending:
+                # Coalesce whatever piled up while the last send was in flight
+                chunk = b"".join(self.pending)
+                self.pending.clear()
+                self.pending_bytes = 0
+                await self.ws.send_bytes(chunk)
+            if self.overflowed:
+                await self.ws.close(code=4001, reason="Viewer fell too far behind")
+                return
+            if self.finished and not self.pending:
+                await self.ws.close()
+                return
+
+class ShellSession:
+    """An interactive exec that outlives the WebSocket attached to it"""
+    def __init__(self, sid: str, user_id: str, container_id: str, exec_id: str, sock,
+                 resize: Callable, stop: Callable):
+        self.sid = sid
+        self.user_id = user_id
+        self.container_id = container_id
+        self.exec_id = exec_id
+        self.sock = sock
+        self.scrollback = ScrollbackBuffer()
+        self.client: Optional[WebSocket] = None
+        self.viewers: Set[Viewer] = set()
+        self.detached_at: Optional[float] = time.monotonic()
+        self.cols, self.rows = 80, 24
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.closed = asyncio.Event()
+        self._resize = resize
+        self._stop = stop
+        self._lock = asyncio.Lock()
+        self._input = bytearray()
+        self._input_ready = asyncio.Event()
+        self._input_at: Optional[float] = None  # when the oldest unanswered input arrived
+        self._pending_size: Optional[Tuple[int, int]] = None
+        self._resizer: Optional[asyncio.Task] = None
+        self._nonblocking = _make_nonblocking(sock._sock)
+        self.recorder: Optional[SessionRecorder] = None
+        directory = recordings_dir()
+        if directory:
+            self.recorder = SessionRecorder(
+                directory, sid, self.cols, self.rows,
+                record_input=os.getenv("TERMINAL_RECORD_INPUT") == "1"
+            )
+        self._writer = asyncio.create_task(self._write_loop())
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        loop = asyncio.get_running_loop()
+        raw = self.sock._sock
+        try:
+            while True:
+                if self._nonblocking:
+                    data = await loop.sock_recv(raw, READ_SIZE)
+                else:
+                    data = await loop.run_in_executor(None, raw.recv, READ_SIZE)
+                if not data:
+                    break
+                self.bytes_out += len(data)
+                if self.recorder is not None:
+                    self.recorder.record("o", data)
+                async with self._lock:
+                    self.scrollback.append(data)
+                    if self.client is not None:
+                        try:
+                            await self.client.send_bytes(data)
+                            if self._input_at is not None:
+                                # Input in, first output back out: the server's share of echo latency
+                                TERMINAL_ECHO_LATENCY.observe(time.perf_counter() - self._input_at)
+                                self._input_at = None
+                        except Exception:
+                            self._detach_locked(self.client)
+                    # Fan out the same read to viewers; slow ones are dropped, not waited on
+                    for viewer in list(self.viewers):
+                        if not viewer.push(data):
+                            self.viewers.discard(viewer)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("terminal.read_failed", session_id=self.sid, error=str(e))
+        finally:
+            self._finish()
+
+    async def _write_loop(self):
+        """Flush queued input; whatever arrives while a write is in flight goes out in the next one"""
+        loop = asyncio.get_running_loop()
+        raw = self.sock._sock
+        try:
+            while True:
+                await self._input_ready.wait()
+                self._input_ready.clear()
+                if not self._input:
+                    continue
+                data = bytes(self._input)
+                self._input.clear()
+                if self._nonblocking:
+                    await loop.sock_sendall(raw, data)
+                else:
+                    await loop.run_in_executor(None, raw.sendall, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("terminal.write_failed", session_id=self.sid, error=str(e))
+
+    def _finish(self) -> None:
+        self.closed.set()
+        self._writer.cancel()
+        if self.recorder is not None:
+            self.recorder.close()
+        for viewer in self.viewers:
+            viewer.finish()
+        self.viewers.clear()
+
+    async def add_viewer(self, ws: WebSocket) -> Viewer:
+        """Subscribe a read-only viewer, seeded with the retained scrollback"""
+        viewer = Viewer(ws)
+        async with self._lock:
+            _, history = self.scrollback.read_from(0)
+            if history:
+                viewer.push(history[-viewer.limit:])
+            if self.closed.is_set():
+                viewer.finish()
+            else:
+                self.viewers.add(viewer)
+        return viewer
+
+    def remove_viewer(self, viewer: Viewer) -> None:
+        self.viewers.discard(viewer)
+
+    async def attach(self, ws: WebSocket, offset: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Make ws the session's client and replay output it missed since offset.
+        Without an offset everything retained is replayed as-is (legacy clients);
+        with one, a JSON text frame {"type": "attached", "offset", "end"} tells
+        the client where the replay starts so it can keep counting bytes.
+        Any previous client is dropped. Returns the (replay_start, replay_end) offsets.
+        """
+        async with self._lock:
+            previous = self.client
+            start, missed = self.scrollback.read_from(offset if offset is not None else 0)
+            end = self.scrollback.end
+            if offset is not None:
+                await ws.send_text(json.dumps({"type": "attached", "offset": start, "end": end}))
+            if missed:
+                await ws.send_bytes(missed)
+            self.client = ws
+            self.detached_at = None
+        if previous is not None and previous is not ws:
+            try:
+                await previous.close(code=4000, reason="Session attached elsewhere")
+            except Exception:
+                pass
+        return start, end
+
+    async def detach(self, ws: WebSocket) -> None:
+        async with self._lock:
+            self._detach_locked(ws)
+
+    def _detach_locked(self, ws: WebSocket) -> None:
+        if self.client is ws:
+            self.client = None
+            self.detached_at = time.monotonic()
+
+    def send(self, data: bytes) -> None:
+        """Queue input for the shell without blocking; the writer task flushes it"""
+        if len(self._input) + len(data) > INPUT_BUFFER_BYTES:
+            log.warning("terminal.input_dropped", session_id=self.sid, bytes=len(data))
+            return
+        self.bytes_in += len(data)
+        if self.recorder is not None and self.recorder.record_input:
+            self.recorder.record("i", data)
+        if self._input_at is None:
+            self._input_at = time.perf_counter()
+        self._input.extend(data)
+        self._input_ready.set()
+
+    def handle_frame(self, frame: bytes) -> None:
+        """Apply one binary control frame from the attached client"""
+        if not frame:
+            return
+        if frame[0] == FRAME_INPUT:
+            self.send(frame[1:])
+        elif frame[0] == FRAME_RESIZE and len(frame) >= 5:
+            cols, rows = struct.unpack_from("!HH", frame, 1)
+            self.request_resize(cols, rows)
+
+    def request_resize(self, cols: int, rows: int) -> None:
+        """Debounced resize: of a burst (e.g. a window drag) only the last size reaches Docker"""
+        self._pending_size = (cols, rows)
+        if self._resizer is None or self._resizer.done():
+            self._resizer = asyncio.create_task(self._apply_resizes())
+
+    async def _apply_resizes(self):
+        await asyncio.sleep(RESIZE_DEBOUNCE)
+        while self._pending_size is not None:
+            cols, rows = self._pending_size
+            self._pending_size = None
+            try:
+                log.debug("terminal.resize", session_id=self.sid, cols=cols, rows=rows)
+                await self.resize(cols, rows)
+            except Exception as e:
+                log.warning("terminal.resize_failed", session_id=self.sid, error=str(e))
+
+    async def resize(self, cols: int, rows: int) -> None:
+        if (cols, rows) == (self.cols, self.rows):
+            return
+        self.cols, self.rows = cols, rows
+        if self.recorder is not None:
+            self.recorder.record_resize(cols, rows)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._resize, self.exec_id, rows, cols)
+
+    async def close(self) -> None:
+        self._reader.cancel()
+        self._writer.cancel()
+        if self._resizer is not None:
+            self._resizer.cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._stop, self.exec_id, self.sock)
+        self._finish()
+
+class SessionSupervisor:
+    """Owns the shells for all terminal sessions, keyed by session id"""
+    def __init__(self):
+        self.sessions: Dict[str, ShellSession] = {}
+        self._start_locks: Dict[str, asyncio.Lock] = {}
+        self.share_tokens: Dict[str, str] = {}  # token -> sid
+        # Byte counts of closed sessions, so exported totals never go backwards
+        self.retired_bytes_out = 0
+        self.retired_bytes_in = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def get_or_start(self, sid: str, user_id: str, container_id: str,
+                           start: Callable, resize: Callable, stop: Callable) -> ShellSession:
+        """Return the live shell for sid, starting one with start(container_id) if needed"""
+        # Serialise starts per sid so two quick reconnects share one exec
+        async with self._start_locks.setdefault(sid, asyncio.Lock()):
+            session = self.sessions.get(sid)
+            if session is not None and not session.closed.is_set():
+                return session
+            loop = asyncio.get_running_loop()
+            exec_id, sock = await loop.run_in_executor(None, start, container_id)
+            session = ShellSession(sid, user_id, container_id, exec_id, sock, resize, stop)
+            self.sessions[sid] = session
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_detached())
+        return session
+
+    def share(self, sid: str) -> str:
+        """Return the viewer token for a running session, creating one if needed"""
+        for token, shared_sid in self.share_tokens.items():
+            if shared_sid == sid:
+                return token
+        token = secrets.token_urlsafe(16)
+        self.share_tokens[token] = sid
+        return token
+
+    def unshare(self, sid: str) -> None:
+        """Revoke the session's viewer token and disconnect its viewers"""
+        self.share_tokens = {t: s for t, s in self.share_tokens.items() if s != sid}
+        session = self.sessions.get(sid)
+        if session is not None:
+            for viewer in session.viewers:
+                viewer.finish()
+            session.viewers.clear()
+
+    def get_shared(self, token: str) -> Optional[ShellSession]:
+        sid = self.share_tokens.get(token)
+        session = self.sessions.get(sid) if sid else None
+        if session is None or session.closed.is_set():
+            return None
+        return session
+
+    async def close(self, sid: str) -> None:
+        session = self.sessions.pop(sid, None)
+        self._start_locks.pop(sid, None)
+        self.share_tokens = {t: s for t, s in self.share_tokens.items() if s != sid}
+        if session is not None:
+            self.retired_bytes_out += session.bytes_out
+            self.retired_bytes_in += session.bytes_in
+            await session.close()
+
+    async def close_user(self, user_id: str) -> None:
+        for sid in [sid for sid, s in self.sessions.items() if s.user_id == user_id]:
+            await self.close(sid)
+
+    async def _reap_detached(self):
+        while self.sessions:
+            await asyncio.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            for sid, session in list(self.sessions.items()):
+                if session.closed.is_set():
+                    await self.close(sid)
+                elif session.detached_at is not None and not session.viewers \
+                        and now - session.detached_at > DETACHED_TTL:
+                    log.info("terminal.reaped", session_id=sid)
+                    await self.close(sid)
+
+supervisor = SessionSupervisor()
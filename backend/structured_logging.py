@@ -0,0 +1,138 @@
+# In structured_logging.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+# Records are JSON lines on stdout. Callers only pay for a level check and,
+# if enabled, a rate-limit check plus an enqueue; formatting and the write
+# happen on a listener thread.
+#
+#   log = get_logger(__name__)
+#   log.info("container.reuse", container_id=cid, user_id=uid)
+#
+# The first argument is the event name: it is the rate-limiting key and the
+# "event" field of the output. Everything else becomes a field.
+
+DEFAULT_RATE = 5.0    # records per second per event, sustained
+DEFAULT_BURST = 20    # records per event allowed back to back
+
+# Events expected in hot loops get a tighter budget
+EVENT_RATES: Dict[str, Tuple[float, int]] = {
+    "terminal.resize": (1.0, 5),
+    "terminal.input_dropped": (1.0, 5),
+    "db_update.send_failed": (1.0, 5),
+    "loop.stall": (0.2, 5),
+    "rate_limit.rejected": (1.0, 5),
+    "workspace_sync.quota_exceeded": (0.2, 5),
+}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": getattr(record, "event", record.getMessage()),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per event; reports how many records were dropped on the next one let through"""
+    def __init__(self):
+        super().__init__()
+        self._buckets: Dict[str, list] = {}  # event -> [tokens, last_refill, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR and getattr(record, "event", None) not in EVENT_RATES:
+            return True
+        event = getattr(record, "event", None) or str(record.msg)
+        rate, burst = EVENT_RATES.get(event, (DEFAULT_RATE, DEFAULT_BURST))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [float(burst), now, 0]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.fields = dict(getattr(record, "fields", {}), suppressed=suppressed)
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the traceback now (it references live frames), defer the rest
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class StructuredLogger:
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, event: str, exc_info: bool = False, **fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, **fields)
+
+    def exception(self, event: str, **fields):
+        """error() with the current exception's traceback attached"""
+        self._log(logging.ERROR, event, exc_info=True, **fields)
+
+_ROOT = "lsclear"
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging() -> None:
+    """Route the lsclear.* loggers through a non-blocking queue to a JSON stdout handler"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger(_ROOT)
+    root.setLevel(os.getenv("LOG_LEVEL", "info").upper())
+    root.addHandler(handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name: str) -> StructuredLogger:
+    configure_logging()
+    return StructuredLogger(f"{_ROOT}.{name}")
@@ -0,0 +1,106 @@
+# In tar_stream.py
+import codecs
+import tarfile
+import time
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+# put_archive uploads whatever file object it is given, reading it in small
+# blocks. TarStream is such an object: it emits the archive header by header
+# while reading each member's data straight from its source (bytes, or a
+# spooled upload), so no tar copy of the content is ever assembled. Its
+# length is known up front, so the upload goes out with a Content-Length.
+
+CHUNK = 64 * 1024   # largest piece read from a member's source at a time
+
+def _padding(size: int) -> int:
+    return -size % tarfile.BLOCKSIZE
+
+def _mtime(mtime: Optional[float]) -> int:
+    """Whole seconds, rounded down: a file written from a DB row (mtime=updated_at)
+    then never looks newer than the row to the workspace sync"""
+    return int(time.time() if mtime is None else mtime)
+
+class TarStream:
+    """A write-once tar archive read like a file; members are added before the first read"""
+    def __init__(self):
+        self._members: List[Tuple[bytes, Optional[Union[bytes, memoryview, BinaryIO]], int]] = []
+        self._length = 2 * tarfile.BLOCKSIZE  # end-of-archive marker
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._pending = b""   # the current chunk, consumed from _offset on
+        self._offset = 0
+
+    def _add(self, info: tarfile.TarInfo, source, size: int) -> None:
+        if self._chunks is not None:
+            raise RuntimeError("TarStream is already being read")
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        self._members.append((header, source, size))
+        self._length += len(header) + size + _padding(size)
+
+    def add_dir(self, name: str, mode: int = 0o755, mtime: Optional[float] = None) -> None:
+        info = tarfile.TarInfo(name)
+        info.type, info.mode, info.mtime = tarfile.DIRTYPE, mode, _mtime(mtime)
+        self._add(info, None, 0)
+
+    def add_bytes(self, name: str, data: Union[bytes, memoryview], mode: int = 0o644,
+                  mtime: Optional[float] = None) -> None:
+        info = tarfile.TarInfo(name)
+        info.size, info.mode, info.mtime = len(data), mode, _mtime(mtime)
+        self._add(info, data, len(data))
+
+    def add_file(self, name: str, fileobj: BinaryIO, size: int, mode: int = 0o644,
+                 mtime: Optional[float] = None) -> None:
+        """fileobj is read from its current position when the archive is read"""
+        info = tarfile.TarInfo(name)
+        info.size, info.mode, info.mtime = size, mode, _mtime(mtime)
+        self._add(info, fileobj, size)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        for header, source, size in self._members:
+            yield header
+            if isinstance(source, (bytes, memoryview)):
+                view = memoryview(source)
+                for offset in range(0, size, CHUNK):
+                    yield view[offset:offset + CHUNK]
+            elif source is not None:
+                remaining = size
+                while remaining:
+                    chunk = source.read(min(CHUNK, remaining))
+                    if not chunk:
+                        raise IOError("Source ended before its declared size")
+                    remaining -= len(chunk)
+                    yield chunk
+            if _padding(size):
+                yield bytes(_padding(size))
+        yield bytes(2 * tarfile.BLOCKSIZE)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._chunks is None:
+            self._chunks = self._iter_chunks()
+        if size is None or size < 0:
+            rest = self._pending[self._offset:]
+            self._pending, self._offset = b"", 0
+            return b"".join([rest, *self._chunks])
+        if len(self._pending) - self._offset < size:
+            parts = [self._pending[self._offset:]]
+            have = len(parts[0])
+            while have < size:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                parts.append(chunk)
+                have += len(chunk)
+            # Joining copies at most one chunk beyond what is returned
+            self._pending, self._offset = b"".join(parts), 0
+        data = bytes(self._pending[self._offset:self._offset + size])
+        self._offset += len(data)
+        return data
+
+def read_utf8(fileobj: BinaryIO) -> str:
+    """Decode a file from its current position without first reading it whole into bytes"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = [decoder.decode(chunk) for chunk in iter(lambda: fileobj.read(CHUNK), b"")]
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
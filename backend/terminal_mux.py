@@ -0,0 +1,234 @@
+# In terminal_mux.py
+import asyncio
+import json
+import struct
+from typing import Callable, Dict, Tuple
+
+from fastapi import WebSocket
+from db_update_manager import ws_manager
+from session_supervisor import INPUT_BUFFER_BYTES, _make_nonblocking
+from structured_logging import get_logger
+
+log = get_logger("terminal_mux")
+
+# Frame layout (binary WebSocket messages only):
+#   type (1 byte) | channel (2 bytes, big endian) | payload
+OPEN = 0x01     # client -> server: payload is a session id; echoed back as an ack
+DATA = 0x02     # both ways: raw terminal bytes
+RESIZE = 0x03   # client -> server: payload is rows, cols as two big-endian uint16
+CLOSE = 0x04    # both ways: payload is an optional utf-8 reason
+CREDIT = 0x05   # client -> server: payload is a big-endian uint32 byte grant
+NOTIFY = 0x06   # both ways on channel 0: JSON file_update / delta sync messages
+
+NOTIFY_CHANNEL = 0
+INITIAL_WINDOW = 256 * 1024  # bytes a channel may send before the client grants more
+READ_SIZE = 4096
+
+_HEADER = struct.Struct("!BH")
+_RESIZE = struct.Struct("!HH")
+_CREDIT = struct.Struct("!I")
+
+def encode_frame(frame_type: int, channel: int, payload: bytes = b"") -> bytes:
+    return _HEADER.pack(frame_type, channel) + payload
+
+def decode_frame(data: bytes) -> Tuple[int, int, bytes]:
+    if len(data) < _HEADER.size:
+        raise ValueError("Frame too short")
+    frame_type, channel = _HEADER.unpack_from(data)
+    return frame_type, channel, data[_HEADER.size:]
+
+class MuxChannel:
+    """One shell carried over a multiplexed connection, with a send window"""
+    def __init__(self, exec_id: str, sock):
+        self.exec_id = exec_id
+        self.sock = sock
+        self.credit = INITIAL_WINDOW
+        self.has_credit = asyncio.Event()
+        self.has_credit.set()
+        self.task = None
+        self.nonblocking = _make_nonblocking(sock._sock)
+        self._input = bytearray()
+        self._input_ready = asyncio.Event()
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, data: bytes) -> None:
+        """Queue input for the shell without blocking; the writer task flushes it"""
+        if len(self._input) + len(data) > INPUT_BUFFER_BYTES:
+            log.warning("mux.input_dropped", exec_id=self.exec_id, bytes=len(data))
+            return
+        self._input.extend(data)
+        self._input_ready.set()
+
+    async def _write_loop(self):
+        """Same as the supervisor's writer: one write per batch of queued input"""
+        loop = asyncio.get_running_loop()
+        raw = self.sock._sock
+        try:
+            while True:
+                await self._input_ready.wait()
+                self._input_ready.clear()
+                if not self._input:
+                    continue
+                data = bytes(self._input)
+                self._input.clear()
+                if self.nonblocking:
+                    await loop.sock_sendall(raw, data)
+                else:
+                    await loop.run_in_executor(None, raw.sendall, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("mux.write_failed", exec_id=self.exec_id, error=str(e))
+
+    def grant(self, amount: int) -> None:
+        self.credit += amount
+        if self.credit > 0:
+            self.has_credit.set()
+
+    def consume(self, amount: int) -> None:
+        self.credit -= amount
+        if self.credit <= 0:
+            self.has_credit.clear()
+
+class _NotifyChannel:
+    """Adapter that lets DBUpdateManager push messages onto the notify channel"""
+    def __init__(self, mux: "MuxConnection"):
+        self.mux = mux
+
+    async def send_text(self, message: str):
+        await self.mux.send_frame(NOTIFY, NOTIFY_CHANNEL, message.encode("utf-8"))
+
+    async def close(self):
+        pass
+
+class MuxConnection:
+    """
+    Carries several terminal shells, their resize events and file notifications
+    over a single WebSocket.
+
+    The Docker side is supplied by the caller: open_shell(sid, user_id) returns
+    (exec_id, sock) or raises ValueError, resize_shell(exec_id, rows, cols) and
+    close_shell(exec_id, sock) are blocking and run in the default executor.
+    """
+    def __init__(
+        self,
+        ws: WebSocket,
+        user_id: str,
+        db,
+        open_shell: Callable,
+        resize_shell: Callable,
+        close_shell: Callable
+    ):
+        self.ws = ws
+        self.user_id = user_id
+        self.db = db
+        self.open_shell = open_shell
+        self.resize_shell = resize_shell
+        self.close_shell = close_shell
+        self.channels: Dict[int, MuxChannel] = {}
+        self.notifier = _NotifyChannel(self)
+        self._send_lock = asyncio.Lock()
+
+    async def send_frame(self, frame_type: int, channel: int, payload: bytes = b""):
+        async with self._send_lock:
+            await self.ws.send_bytes(encode_frame(frame_type, channel, payload))
+
+    async def run(self):
+        await ws_manager.connect(self.user_id, self.notifier)
+        try:
+            while True:
+                message = await self.ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if not data:
+                    continue
+                try:
+                    frame_type, channel, payload = decode_frame(data)
+                except ValueError:
+                    continue
+                await self._dispatch(frame_type, channel, payload)
+        finally:
+            for channel_id in list(self.channels):
+                await self._close_channel(channel_id, notify=False)
+            await ws_manager.disconnect(self.user_id, self.notifier)
+
+    async def _dispatch(self, frame_type: int, channel_id: int, payload: bytes):
+        loop = asyncio.get_running_loop()
+
+        if frame_type == NOTIFY and channel_id == NOTIFY_CHANNEL:
+            try:
+                request = json.loads(payload)
+            except json.JSONDecodeError:
+                return
+            if isinstance(request, dict) and request.get("type") == "subscribe":
+                await ws_manager.subscribe(self.user_id, self.notifier, self.db, int(request.get("revision") or 0))
+            return
+
+        if frame_type == OPEN:
+            if channel_id == NOTIFY_CHANNEL or channel_id in self.channels:
+                await self.send_frame(CLOSE, channel_id, b"channel already in use")
+                return
+            try:
+                exec_id, sock = await loop.run_in_executor(
+                    None, self.open_shell, payload.decode("utf-8"), self.user_id
+                )
+            except Exception as e:
+                await self.send_frame(CLOSE, channel_id, str(e).encode("utf-8"))
+                return
+            channel = MuxChannel(exec_id, sock)
+            self.channels[channel_id] = channel
+            await self.send_frame(OPEN, channel_id)
+            channel.task = asyncio.create_task(self._pump(channel_id, channel))
+            return
+
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return
+
+        if frame_type == DATA:
+            channel.send(payload)
+        elif frame_type == RESIZE and len(payload) == _RESIZE.size:
+            rows, cols = _RESIZE.unpack(payload)
+            await loop.run_in_executor(None, self.resize_shell, channel.exec_id, rows, cols)
+        elif frame_type == CREDIT and len(payload) == _CREDIT.size:
+            channel.grant(_CREDIT.unpack(payload)[0])
+        elif frame_type == CLOSE:
+            await self._close_channel(channel_id, notify=False)
+
+    async def _pump(self, channel_id: int, channel: MuxChannel):
+        """Forward shell output while the channel has credit; stalls apply backpressure to the shell"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await channel.has_credit.wait()
+                size = min(READ_SIZE, channel.credit)
+                if channel.nonblocking:
+                    data = await loop.sock_recv(channel.sock._sock, size)
+                else:
+                    data = await loop.run_in_executor(None, channel.sock._sock.recv, size)
+                if not data:
+                    break
+                channel.consume(len(data))
+                await self.send_frame(DATA, channel_id, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("mux.read_failed", user_id=self.user_id, channel=channel_id, error=str(e))
+        if self.channels.get(channel_id) is channel:
+            await self._close_channel(channel_id, notify=True)
+
+    async def _close_channel(self, channel_id: int, notify: bool):
+        channel = self.channels.pop(channel_id, None)
+        if channel is None:
+            return
+        if channel.task and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+        channel.writer.cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.close_shell, channel.exec_id, channel.sock)
+        if notify:
+            try:
+                await self.send_frame(CLOSE, channel_id)
+            except Exception:
+                pass
@@ -0,0 +1,101 @@
+# In tracing.py
+import asyncio
+import contextvars
+import functools
+import os
+from typing import Optional
+
+from opentelemetry import trace
+
+# Spans go nowhere (the API's no-op tracer) unless TRACING_EXPORTER is set:
+#   console - print finished spans to stdout
+#   file    - append one JSON span per line to TRACING_FILE (default traces.jsonl)
+tracer = trace.get_tracer("lsclear.backend")
+_enabled = False
+
+_user_id: contextvars.ContextVar = contextvars.ContextVar("trace_user_id", default=None)
+_session_id: contextvars.ContextVar = contextvars.ContextVar("trace_session_id", default=None)
+
+def set_correlation(user_id: Optional[str] = None, session_id: Optional[str] = None) -> None:
+    """Tag every span started from here on (in this task) with the user and session"""
+    if user_id is not None:
+        _user_id.set(user_id)
+    if session_id is not None:
+        _session_id.set(session_id)
+
+def span(name: str, **attributes):
+    """Context manager for a child span of whatever is current"""
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+def traced(name: str):
+    """Decorator wrapping a (sync) function in a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def run_in_executor(func, *args):
+    """loop.run_in_executor that carries the current span and correlation ids into the thread"""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return loop.run_in_executor(None, ctx.run, func, *args)
+
+def instrument_docker_client(client) -> None:
+    """
+    Wrap the public methods of a docker client's low-level APIClient in spans.
+    Every high-level SDK call (containers.run, exec_run, put_archive, ...) goes
+    through these, so this covers all Docker traffic without touching call sites.
+    """
+    if not _enabled:
+        return
+    api = client.api
+    names = set()
+    for cls in type(api).__mro__:
+        if cls.__module__.startswith("docker.api"):
+            names.update(n for n, v in vars(cls).items() if callable(v) and not n.startswith("_"))
+    for name in names:
+        method = getattr(api, name)
+        setattr(api, name, _wrap_docker_call(name, method))
+
+def _wrap_docker_call(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with tracer.start_as_current_span(f"docker.{name}"):
+            return method(*args, **kwargs)
+    return wrapper
+
+def configure_tracing() -> None:
+    global _enabled
+    exporter_name = os.getenv("TRACING_EXPORTER")
+    if not exporter_name:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    class CorrelationProcessor(SpanProcessor):
+        def on_start(self, span, parent_context=None):
+            user_id, session_id = _user_id.get(), _session_id.get()
+            if user_id:
+                span.set_attribute("user.id", user_id)
+            if session_id:
+                span.set_attribute("session.id", session_id)
+
+    if exporter_name == "file":
+        out = open(os.getenv("TRACING_FILE", "traces.jsonl"), "a")
+        exporter = ConsoleSpanExporter(out=out, formatter=lambda s: s.to_json(indent=None) + "\n")
+    else:
+        exporter = ConsoleSpanExporter()
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "lsclear-backend"}))
+    provider.add_span_processor(CorrelationProcessor())
+    # Export from a background thread, off the request path
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _enabled = True
+
+configure_tracing()
@@ -1,9 +1,14 @@
 # In user_file_system.py
-import os
-from typing import Dict, List, Union
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 from pathlib import PurePosixPath
 import docker
 from postgres import NeonDB
+from tracing import instrument_docker_client, span
+from tar_stream import TarStream
+from structured_logging import get_logger
+
+log = get_logger("user_file_system")
 
 class FileSystemManager:
     def __init__(self, user_id: str, container_id: str, base_path: str = "/workspace"):
@@ -11,24 +16,33 @@ class FileSystemManager:
         self.base_path = PurePosixPath(base_path)  # Using PurePosixPath for container paths
         self.db = NeonDB()
         self.docker_client = docker.from_env()
+        instrument_docker_client(self.docker_client)
         self.container = self.docker_client.containers.get(container_id)
         
     def initialize_file_structure(self) -> None:
         """Initialize the file structure in the container based on the database"""
-        # Get the root directory structure
-        root_nodes = self.db.get_user_file_structure(self.user_id)
-        if not root_nodes:
-            # Create a default structure if none exists
-            self._create_default_structure()
+        with span("hydrate.initialize_file_structure"):
+            # Get the root directory structure
             root_nodes = self.db.get_user_file_structure(self.user_id)
+            if not root_nodes:
+                # Create a default structure if none exists
+                self._create_default_structure()
+                root_nodes = self.db.get_user_file_structure(self.user_id)
+
+            # Create the file structure
+            with span("hydrate.create_structure"):
+                for node in root_nodes:
+                    self._create_structure(node)
+
+            # Populate file contents
+            with span("hydrate.sync_file_contents"):
+                for node in root_nodes:
+                    self._sync_file_contents(node)
 
-        # Create the file structure
-        for node in root_nodes:
-            self._create_structure(node)
-            
-        # Populate file contents
-        for node in root_nodes:
-            self._sync_file_contents(node)
+    def clear_workspace(self) -> None:
+        """Remove everything under the base path, e.g. files a stale checkpoint still holds"""
+        with span("hydrate.clear"):
+            self.container.exec_run(["find", str(self.base_path), "-mindepth", "1", "-delete"])
 
     def _create_default_structure(self) -> None:
         """Create a default file structure for new users"""
@@ -41,7 +55,7 @@ class FileSystemManager:
                 content="# Welcome to your project!\nprint('Hello, World!')"
             )
         except Exception as e:
-            print(f"Error creating default structure: {e}")
+            log.error("hydrate.default_structure_failed", user_id=self.user_id, error=str(e))
 
     def _create_structure(self, node: Dict, current_path: PurePosixPath = None) -> None:
         """Create directory and file structure in the container"""
@@ -72,48 +86,48 @@ class FileSystemManager:
                 self._sync_file_contents(child, item_path)
         else:
             # It's a file, sync content
+            # Stamped with the row's updated_at, so the workspace sync doesn't take
+            # every hydrated file for a newer edit and write it back
+            mtime = datetime.fromisoformat(node['updated_at']).timestamp() if node.get('updated_at') else None
             if 'content' in node and node['content'] is not None:
-                self._write_file_to_container(item_path, node['content'])
+                self._write_file_to_container(item_path, node['content'], mtime)
             else:
                 # Fallback to database if content isn't in the node
                 content = self.db.get_file_content(self.user_id, node['id'])
                 if content is not None:
-                    self._write_file_to_container(item_path, content)
+                    self._write_file_to_container(item_path, content, mtime)
 
     def _create_directory_in_container(self, path: PurePosixPath) -> None:
         """Create a directory in the container"""
         cmd = f"mkdir -p {path}"
-        self.container.exec_run(cmd, tty=True)
+        with span("hydrate.mkdir", path=str(path)):
+            self.container.exec_run(cmd, tty=True)
 
     def _create_empty_file_in_container(self, path: PurePosixPath) -> None:
         """Create an empty file in the container"""
         cmd = f"touch {path}"
-        self.container.exec_run(cmd, tty=True)
+        with span("hydrate.touch", path=str(path)):
+            self.container.exec_run(cmd, tty=True)
 
-    def _write_file_to_container(self, path: PurePosixPath, content: str) -> None:
+    def _write_file_to_container(self, path: PurePosixPath, content: str, mtime: Optional[float] = None) -> None:
         """Write content to a file in the container"""
+        with span("hydrate.write_file", path=str(path), bytes=len(content)):
+            self._copy_file_to_container(path, content, mtime)
+
+    def _copy_file_to_container(self, path: PurePosixPath, content: str, mtime: Optional[float] = None) -> None:
         try:
             # Ensure parent directory exists
             parent_dir = str(path.parent)
             if parent_dir != '/':
                 self._create_directory_in_container(PurePosixPath(parent_dir))
-            
-            # Create a temporary file with the content
-            temp_file = f"/tmp/{path.name}"
-            with open(temp_file, "w") as f:
-                f.write(content)
-            
-            try:
-                # Use docker cp to copy the file to the container
-                container_path = f"{self.container.id}:/{path}"
-                cmd = f"docker cp {temp_file} {container_path}"
-                os.system(cmd)
-            finally:
-                # Ensure we clean up the temp file
-                os.remove(temp_file)
-                
+
+            # Stream the file in as a tar rather than shelling out to docker cp
+            archive = TarStream()
+            archive.add_bytes(path.name, content.encode('utf-8'), mtime=mtime)
+            self.container.put_archive(path=parent_dir, data=archive)
+
         except Exception as e:
-            print(f"Error writing file to container: {e}")
+            log.error("hydrate.write_failed", user_id=self.user_id, path=str(path), error=str(e))
             raise
 
     def save_file(self, file_path: str, content: str) -> None:
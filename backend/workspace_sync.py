@@ -0,0 +1,232 @@
+# In workspace_sync.py
+import asyncio
+import os
+import re
+import tarfile
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import docker
+from postgres import NeonDB, QuotaExceeded
+from db_update_manager import notify_file_update
+from structured_logging import get_logger
+
+log = get_logger("workspace_sync")
+
+SYNC_INTERVAL = 10                  # seconds between volume scans
+MAX_SYNC_FILE_BYTES = 1024 * 1024   # larger files stay in the volume only
+SKIP_DIRS = ("node_modules", ".git", "__pycache__", ".venv")
+
+def volumes_enabled() -> bool:
+    """Whether each user's /workspace lives on a persistent named volume"""
+    return os.getenv("WORKSPACE_VOLUMES") == "1"
+
+def skipped(path: str) -> bool:
+    """Whether a workspace-relative path is in one of SKIP_DIRS, which scans don't descend into"""
+    return any(part in SKIP_DIRS for part in path.split("/"))
+
+def volume_name(user_id: str) -> str:
+    return "workspace-" + re.sub(r"[^A-Za-z0-9_.-]", "-", user_id)
+
+def ensure_volume(client, user_id: str) -> bool:
+    """Create the user's workspace volume if needed; returns True if it was just created"""
+    name = volume_name(user_id)
+    try:
+        client.volumes.get(name)
+        return False
+    except docker.errors.NotFound:
+        client.volumes.create(name, labels={"user_id": user_id, "managed_by": "terminal"})
+        return True
+
+def remove_volume(client, user_id: str) -> None:
+    try:
+        client.volumes.get(volume_name(user_id)).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+
+def volume_mounts(user_id: str) -> Dict:
+    """`volumes=` argument for containers.run (empty when volumes are disabled)"""
+    if not volumes_enabled():
+        return {}
+    return {volume_name(user_id): {"bind": "/workspace", "mode": "rw"}}
+
+class VolumeSyncer:
+    """
+    Captures changes made in a user's workspace volume and writes them back to
+    fs_nodes. Each pass is one `find` exec; only entries whose type, mtime or
+    size changed since the previous pass (and that are newer than the DB row)
+    are read and written. hydrated means the volume was just filled from
+    fs_nodes, so the first scan is taken as the baseline rather than diffed.
+    Also run for a single pass without a volume, to catch up on deferred
+    fs-events.
+    """
+    def __init__(self, client, user_id: str, container_id: str, base_path: str = "/workspace",
+                 hydrated: bool = False):
+        self.client = client
+        self.user_id = user_id
+        self.container_id = container_id
+        self.base_path = base_path
+        self.hydrated = hydrated
+        # Primary only: each pass diffs against the paths it reads before writing.
+        # Connected by the first pass, which runs in the executor
+        self.db: Optional[NeonDB] = None
+        self.snapshot: Optional[Dict[str, Tuple[str, float, int]]] = None  # None before the first pass
+
+    def scan(self) -> Dict[str, Tuple[str, float, int]]:
+        container = self.client.containers.get(self.container_id)
+        prune = []
+        for name in SKIP_DIRS:
+            prune += ["-name", name, "-o"]
+        result = container.exec_run(
+            ["find", self.base_path, "-mindepth", "1", "(", *prune[:-1], ")", "-prune",
+             "-o", "-printf", "%y\\t%T@\\t%s\\t%P\\n"]
+        )
+        entries = {}
+        for line in result.output.decode("utf-8", "replace").splitlines():
+            parts = line.split("\t", 3)
+            if len(parts) != 4 or parts[0] not in ("f", "d"):
+                continue
+            kind, mtime, size, path = parts
+            entries[path] = (kind, float(mtime), int(size))
+        return entries
+
+    def _read_file(self, path: str) -> Optional[str]:
+        container = self.client.containers.get(self.container_id)
+        stream, _ = container.get_archive(f"{self.base_path}/{path}")
+        with tarfile.open(fileobj=BytesIO(b"".join(stream))) as tar:
+            member = tar.next()
+            data = tar.extractfile(member).read() if member and member.isfile() else None
+        if data is None:
+            return None
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return None  # binary files aren't stored in fs_nodes
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def sync_once(self) -> bool:
+        """Run one change-capture pass; returns True if fs_nodes was modified"""
+        if self.db is None:
+            self.db = NeonDB(replica_dsns=())
+        current = self.scan()
+        previous = self.snapshot
+        nodes = None
+        if previous is None:
+            # Nothing to diff against yet: anything fs_nodes has that the volume doesn't
+            # was deleted while no syncer was running (e.g. just before the last container went)
+            nodes = self.db.get_node_paths(self.user_id)
+            previous = {path: None for path in nodes if not skipped(path)}
+        changed = [p for p, meta in current.items() if previous.get(p) != meta]
+        removed = [p for p in previous if p not in current]
+        if not changed and not removed:
+            self.snapshot = current
+            return False
+
+        if nodes is None:
+            nodes = self.db.get_node_paths(self.user_id)
+        modified = False
+
+        # Sorted so parents are handled before their children
+        for path in sorted(changed):
+            kind, mtime, size = current[path]
+            node = nodes.get(path)
+            parent = os.path.dirname(path)
+            parent_id = nodes[parent]["id"] if parent and parent in nodes else None
+            if parent and parent_id is None:
+                continue  # parent was skipped (e.g. type change); picked up next pass
+
+            if kind == "d":
+                if node is None:
+                    try:
+                        nodes[path] = self.db.create_node(self.user_id, os.path.basename(path), True, parent_id)
+                    except QuotaExceeded as e:
+                        log.warning("workspace_sync.quota_exceeded", user_id=self.user_id, path=path, error=str(e))
+                        continue
+                    modified = True
+                continue
+
+            if size > MAX_SYNC_FILE_BYTES:
+                continue
+            if node is not None and node["updated_at"] and node["updated_at"].timestamp() >= mtime:
+                continue  # DB already has this version (e.g. written by update_file)
+            content = self._read_file(path)
+            if content is None:
+                continue
+            try:
+                if node is None:
+                    nodes[path] = self.db.create_node(self.user_id, os.path.basename(path), False, parent_id, content)
+                elif node["is_dir"]:
+                    continue
+                elif self.db.get_file_content(self.user_id, node["id"]) == content:
+                    continue  # only the mtime moved (e.g. touch, or a file written before its row)
+                else:
+                    self.db.update_file_content(self.user_id, node["id"], content)
+            except QuotaExceeded as e:
+                # Over quota: the file stays in the volume only, like oversized files
+                log.warning("workspace_sync.quota_exceeded", user_id=self.user_id, path=path, error=str(e))
+                continue
+            modified = True
+
+        # Parents first; deleting a directory cascades to anything below it
+        deleted = set()
+        for path in sorted(removed):
+            node = nodes.get(path)
+            if node is None or any(path.startswith(d + "/") for d in deleted):
+                continue
+            self.db.delete_node(self.user_id, node["id"])
+            deleted.add(path)
+            modified = True
+
+        self.snapshot = current
+        return modified
+
+    async def run(self):
+        try:
+            await self._run()
+        finally:
+            if self.db is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self.hydrated:
+            try:
+                # The volume matches fs_nodes right now; without this baseline the first
+                # pass would re-read and rewrite every file, all newer than their rows
+                self.snapshot = await loop.run_in_executor(None, self.scan)
+            except Exception:
+                log.exception("workspace_sync.baseline_failed", user_id=self.user_id)
+        while True:
+            try:
+                if await loop.run_in_executor(None, self.sync_once):
+                    await notify_file_update(self.user_id, "sync", self.base_path, db=self.db)
+            except docker.errors.NotFound:
+                log.info("workspace_sync.container_gone", user_id=self.user_id)
+                return
+            except Exception:
+                log.exception("workspace_sync.failed", user_id=self.user_id)
+            await asyncio.sleep(SYNC_INTERVAL)
+
+_syncers: Dict[str, Tuple[str, asyncio.Task]] = {}  # user_id -> (container_id, task)
+
+def start_sync(client, user_id: str, container_id: str, hydrated: bool = False) -> None:
+    """
+    Start (or restart for a new container) the background volume -> DB sync
+    for a user. Pass hydrated=True right after filling the volume from fs_nodes.
+    """
+    running = _syncers.get(user_id)
+    if running is not None and not running[1].done():
+        if running[0] == container_id:
+            return
+        running[1].cancel()
+    task = asyncio.create_task(VolumeSyncer(client, user_id, container_id, hydrated=hydrated).run())
+    _syncers[user_id] = (container_id, task)
+
+def stop_sync(user_id: str) -> None:
+    running = _syncers.pop(user_id, None)
+    if running is not None:
+        running[1].cancel()